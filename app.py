@@ -2,6 +2,94 @@ import streamlit as st
 import numpy as np
 import beat_manipulator as bm
 import cv2
+import copy, hashlib, os, tempfile, time
+
+UPLOADS_DIR = os.path.join(tempfile.gettempdir(), 'beat_manipulator_uploads')
+MAX_LENGTH = 1800 # seconds
+# jobs that take longer are stopped, so that one huge upload doesn't hold a worker forever
+DEADLINE = 600 # seconds
+
+# Everything below is cached by a hash of the uploaded file, so changing the pattern only re-renders.
+# Arguments that start with `_` aren't hashed by streamlit.
+def upload_digest(audiofile) -> str:
+    return hashlib.sha256(audiofile.getvalue()).hexdigest()[:32]
+
+@st.cache_resource(max_entries=8, show_spinner=False)
+def load_song(digest: str, name: str, _data: bytes):
+    """Decodes the upload once. The song is shared between sessions, so it is never changed in place."""
+    ext = os.path.splitext(name)[1].lower() or '.mp3'
+    # named after the content, so that the file beatmap cache finds it again for the same upload
+    path = os.path.join(UPLOADS_DIR, digest + ext)
+    if not os.path.exists(path):
+        os.makedirs(UPLOADS_DIR, exist_ok=True)
+        with open(path, 'wb') as f: f.write(_data)
+    song = bm.song(audio=path, log=False)
+    if len(song.audio[0]) > (song.sr * MAX_LENGTH):
+        song.audio = song.audio[:, :song.sr * MAX_LENGTH]
+    return song
+
+@st.cache_data(max_entries=32, show_spinner=False)
+def load_beatmap(digest: str, name: str, _data: bytes, lib: str, caching: bool, scale: float, shift: float) -> np.ndarray:
+    """Beatmap from `lib`, scaled and shifted"""
+    song = copy.copy(load_song(digest, name, _data))
+    song.beatmap_generate(lib=lib, caching=caching)
+    return bm.beatmap.scale(bm.beatmap.shift(song.beatmap.copy(), shift, log=False), scale, log=False)
+
+@st.cache_data(max_entries=32, show_spinner=False)
+def load_image(digest: str, name: str, _data: bytes, lib: str, caching: bool, scale: float, shift: float) -> np.ndarray:
+    from beat_manipulator.image import generate, bw_to_colored
+    song = load_song(digest, name, _data)
+    image = bw_to_colored(generate(song, beatmap=load_beatmap(digest, name, _data, lib, caching, scale, shift), log=False))
+    y = min(len(image), len(image[0]), 2048)
+    y = max(y, 2048)
+    return np.rot90(np.clip(cv2.resize(image, (y, y), interpolation=cv2.INTER_NEAREST), -1, 1))
+
+# analysis and rendering run in a shared pool, so one long analysis doesn't block everyone else
+WORKERS = 2
+MAX_QUEUE = 8
+STAGES = {'decode': 'Loading audio file...', 'beat_detection': 'Generating beatmap...', 'image': 'Generating image...', 'render': 'Beatswapping...', 'smoothing': 'Smoothing...', 'encode': 'Encoding...'}
+
+@st.cache_resource
+def get_executor():
+    return bm.jobs.executor(workers=WORKERS, max_queue=MAX_QUEUE, keep=8)
+
+def analyze(digest: str, name: str, data: bytes, lib: str, caching: bool, scale: float, shift: float):
+    try:
+        song = load_song(digest, name, data)
+    except Exception as e:
+        print(f'Failed to load audio, retrying: {e}')
+        song = load_song(digest, name, data)
+    beatmap = load_beatmap(digest, name, data, lib, caching, scale, shift)
+    with bm.instrument.stage('image'):
+        try:
+            image = load_image(digest, name, data, lib, caching, scale, shift)
+        except Exception as e:
+            print(f'Image generation failed: {e}')
+            image = np.asarray([[0.5, -0.5], [-0.5, 0.5]])
+    return song, beatmap, image
+
+def render(song, beatmap: np.ndarray, pattern: str, caching: bool = True) -> bytes:
+    # the same pattern on the same upload and beatmap is read from the render cache after the first time
+    key = bm.cache.key(song, pattern, beatmap=beatmap) if caching is True else None
+    cached = bm.cache.get(key, 'wav')
+    if cached is not None:
+        with open(cached, 'rb') as f: return f.read()
+    # renders a copy that shares audio with the cached song, and encodes it to a 16 bit wav in the same job
+    song = copy.copy(song)
+    song.beatmap = beatmap.copy()
+    audio = song.beatswap(pattern=pattern, scale=1, shift=0, return_audio=True)
+    wav = bm.writer.encode(audio, song.sr, 'wav')['wav']
+    bm.cache.put(key, wav, 'wav')
+    return wav
+
+def wait_for(job, status):
+    """Shows what the job is doing until it finishes, returns its result"""
+    while not job.done():
+        progress = job.progress()
+        if progress['status'] == 'queued': status.write(f'Waiting in queue... ({progress["waited"]:.0f}s)')
+        else: status.write(f'{STAGES.get(progress["stage"], "Working...")} ({progress["elapsed"]:.0f}s)')
+        time.sleep(0.2)
+    return job.wait()
 
 def BeatSwap(audiofile, pattern='test', scale=1, shift=0, caching=True, variableBPM=False):
     st.write(f'path = {audiofile}, pattern = "{pattern}", scale = {scale}, shift = {shift}, caching = {caching}, variable BPM = {variableBPM}')
@@ -23,45 +111,28 @@ def BeatSwap(audiofile, pattern='test', scale=1, shift=0, caching=True, variable
         scale = -scale
     if scale < 0.02:
         scale = 0.02
-    st.write('Loading audio file...')
-    if audiofile is not None:
-        try:
-            song = bm.song(audio=audiofile, log=False)
-        except Exception as e:
-            st.write(f'Failed to load audio, retrying: {e}')
-            song = bm.song(audio=audiofile, log=False)
-    else:
+    if audiofile is None:
         st.write(f'Audiofile is {audiofile}')
-        return None, None
-    try:
-        st.write(f'Scale = {scale}, shift = {shift}, length = {len(song.audio[0]) / song.sr}')
-        if len(song.audio[0]) > (song.sr * 1800):
-            song.audio = np.array(song.audio, copy=False)
-            song.audio = song.audio[:, :song.sr * 1800]
-    except Exception as e:
-        st.write(f'Reducing audio size failed, why? {e}')
+        return None, None, None
+    data = audiofile.getvalue()
+    digest = upload_digest(audiofile)
     lib = 'madmom.BeatDetectionProcessor' if variableBPM is False else 'madmom.BeatTrackingProcessor'
-    song.path = '.'.join(song.path.split('.')[:-1])[:-8] + '.' + song.path.split('.')[-1]
-    st.write(f'path: {song.path}')
-    st.write('Generating beatmap...')
-    song.beatmap_generate(lib=lib, caching=caching)
-    song.beatmap_shift(shift)
-    song.beatmap_scale(scale)
-    st.write('Generating image...')
+    executor = get_executor()
+    status = st.empty()
     try:
-        song.image_generate()
-        image = bm.image.bw_to_colored(song.image)
-        y = min(len(image), len(image[0]), 2048)
-        y = max(y, 2048)
-        image = np.rot90(np.clip(cv2.resize(image, (y, y), interpolation=cv2.INTER_NEAREST), -1, 1))
-    except Exception as e:
-        st.write(f'Image generation failed: {e}')
-        image = np.asarray([[0.5, -0.5], [-0.5, 0.5]])
-    st.write('Beatswapping...')
-    song.beatswap(pattern=pattern, scale=1, shift=0)
-    song.audio = (np.clip(np.asarray(song.audio), -1, 1) * 32766).astype(np.int16).T
-    st.write('___ SUCCESS ___')
-    return song.sr, song.audio, image
+        # same upload with the same settings shares one analysis, even between users
+        job = executor.submit(analyze, digest, audiofile.name, data, lib, caching, scale, shift, key=('analysis', digest, lib, caching, scale, shift), deadline=DEADLINE)
+        song, beatmap, image = wait_for(job, status)
+        st.write(f'Scale = {scale}, shift = {shift}, length = {len(song.audio[0]) / song.sr}')
+        audio = wait_for(executor.submit(render, song, beatmap, pattern, caching, deadline=DEADLINE), status)
+    except bm.jobs.QueueFull:
+        status.write('Too many jobs are running right now, try again in a minute.')
+        return None, None, None
+    except bm.cancel.Cancelled:
+        status.write(f'This took more than {DEADLINE} seconds and was stopped, try a shorter file.')
+        return None, None, None
+    status.write('___ SUCCESS ___')
+    return song.sr, audio, image
 
 st.title("Stunlocked's Beat Manipulator")
 
@@ -75,6 +146,6 @@ variableBPM = st.checkbox("Enable support for variable BPM", value=False)
 if st.button("Run BeatSwap"):
     sr, audio, image = BeatSwap(audiofile, pattern, scale, shift, caching, variableBPM)
     if audio is not None:
-        st.audio(audio.tobytes(), format="audio/wav", start_time=0)
+        st.audio(audio, format="audio/wav", start_time=0)
     if image is not None:
         st.image(image, caption="Generated Image", use_column_width=True)
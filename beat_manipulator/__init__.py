@@ -1,2 +1,2 @@
 from .main import *
-from . import beatmap, effects, image, io, metrics, presets, osu, utils
\ No newline at end of file
+from . import assets, batch, beatmap, cache, cancel, effects, estimate, image, instrument, io, jobs, metrics, presets, osu, schedule, server, spectrum, tempogrid, utils, writer
\ No newline at end of file
@@ -0,0 +1,128 @@
+"""Samples and `[song]` sources that patterns use, loaded once per process and shared by every render.
+
+```
+samples = bm.assets.resolve('1, "cowbell", [song]', {'cowbell': 'cowbell.flac', 'song': 'other song.mp3'}, sr = 44100)
+```
+`resolve` finds every asset a pattern refers to, decodes files and analyzes songs in parallel threads, and returns a new dict
+where they are loaded and resampled to `sr`. The dict that was passed in, including `BM_SAMPLES`, is never changed.
+
+Loaded files are cached by path, modification time, size and samplerate, samples and songs in separate caches,
+since one song takes as much memory as hundreds of samples. Arrays and song objects are used as they are, arrays are assumed to be at `sr` already."""
+import os
+import numpy as np
+from . import io, utils, instrument
+from .utils import C_MISC
+
+samples_cache = utils._lru(64)
+songs_cache = utils._lru(4)
+
+def _key(path: str, sr: int) -> tuple:
+    path = os.path.abspath(path)
+    stat = os.stat(path)
+    return (path, stat.st_mtime_ns, stat.st_size, sr)
+
+def _samples(samples) -> dict:
+    """Same conversion that `parse.parse` does - a path or a list of samples becomes a dict with names `1`, `2`..."""
+    if isinstance(samples, str): samples = (samples,)
+    if not isinstance(samples, dict): samples = {str(i+1):samples[i] for i in range(len(samples))}
+    return samples
+
+def references(pattern: str, c_misc: str = C_MISC) -> dict:
+    """Names of samples a pattern refers to, as `{name: 'sample' or 'song'}`. Names in `[]` are songs."""
+    result = {}
+    cur = 0
+    while cur < len(pattern):
+        quote = pattern[cur]
+        if quote in c_misc[0:3] + c_misc[10]:
+            kind = 'song' if quote == c_misc[10] else 'sample'
+            if quote == c_misc[10]: quote = c_misc[11]
+            end = pattern.find(quote, cur + 1)
+            if end == -1: break
+            # a name used both ways is loaded as a song, which has the audio too
+            name = pattern[cur + 1 : end]
+            if result.get(name) != 'song': result[name] = kind
+            cur = end
+        cur += 1
+    return result
+
+def sample(source, sr: int = None) -> np.ndarray:
+    """Audio of a sample at `sr`. Paths are cached."""
+    from . import main
+    if isinstance(source, np.ndarray):
+        instrument.count('sample_cache_hits')
+        return source
+    if isinstance(source, main.song):
+        instrument.count('sample_cache_hits')
+        return io._resample(source.audio, source.sr, sr)
+    if not isinstance(source, str): return io._load(source)[0]
+    loaded = []
+    def load():
+        loaded.append(source)
+        audio, file_sr = io._load(source)
+        return io._resample(audio, file_sr, sr)
+    result = samples_cache.get_or_set(_key(source, sr), load)
+    instrument.count('sample_cache_misses' if len(loaded) > 0 else 'sample_cache_hits')
+    return result
+
+def _analyzed(source, sr: int = None):
+    from . import main
+    result = main.song(source, sr = sr, log = False)
+    result.beatmap_generate()
+    result.beatmap_adjust()
+    if sr is not None and result.sr != sr:
+        result.beatmap = np.rint(result.beatmap * (sr / result.sr)).astype(int)
+        result.audio, result.sr = io._resample(result.audio, result.sr, sr), sr
+    return result
+
+def song(source, sr: int = None):
+    """Song with an adjusted beatmap, at `sr`. Paths are cached, song objects without a beatmap are analyzed as a copy, so the original is not changed."""
+    from . import main
+    if isinstance(source, main.song):
+        if source.beatmap is not None:
+            instrument.count('sample_cache_hits')
+            return source
+        instrument.count('sample_cache_misses')
+        import copy
+        result = copy.copy(source)
+        result.log = False
+        result.beatmap_generate()
+        result.beatmap_adjust()
+        return result
+    if not isinstance(source, str):
+        instrument.count('sample_cache_misses')
+        return _analyzed(source, sr)
+    loaded = []
+    def load():
+        loaded.append(source)
+        return _analyzed(source, sr)
+    result = songs_cache.get_or_set(_key(source, sr), load)
+    instrument.count('sample_cache_misses' if len(loaded) > 0 else 'sample_cache_hits')
+    return result
+
+def resolve(pattern: str, samples: dict, sr: int = None, workers: int = 4, c_misc: str = C_MISC) -> dict:
+    """New dict with everything `pattern` refers to loaded, in parallel. Samples that the pattern doesn't use are left as they are."""
+    from . import main
+    samples = dict(_samples(samples))
+    if not isinstance(pattern, str): return samples
+    todo = {name: kind for name, kind in references(pattern, c_misc).items() if name in samples}
+    # already loaded assets are left for `parse.parse`
+    for name in [name for name, kind in todo.items() if (kind == 'sample' and isinstance(samples[name], np.ndarray))
+                 or (kind == 'song' and isinstance(samples[name], main.song) and samples[name].beatmap is not None)]: del todo[name]
+    if len(todo) == 0: return samples
+    timer = instrument.start('assets')
+    if len(todo) == 1 or workers is None or workers <= 1:
+        for name, kind in todo.items(): samples[name] = (song if kind == 'song' else sample)(samples[name], sr)
+    else:
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(max_workers = min(workers, len(todo))) as executor:
+            futures = {name: executor.submit(song if kind == 'song' else sample, samples[name], sr) for name, kind in todo.items()}
+            for name, future in futures.items(): samples[name] = future.result()
+    instrument.stop(timer)
+    return samples
+
+def clear():
+    samples_cache.clear()
+    songs_cache.clear()
+
+def stats() -> dict:
+    return {'samples': samples_cache.stats(), 'songs': songs_cache.stats()}
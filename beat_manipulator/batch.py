@@ -0,0 +1,151 @@
+"""Beatswapping many files with many patterns in parallel processes.
+
+```
+jobs = bm.batch.plan(inputs = ['songs/*.mp3', 'more songs.txt'], patterns = ['1, 3, 2, 4'], presets = ['2x speed'], output = 'output')
+bm.batch.run(jobs, workers = 4, manifest = 'output/manifest.json')
+```
+Each job is one input with one pattern and scale. Jobs whose output already exists are skipped, and everything is written to a manifest,
+so running the same thing again after an interruption continues where it stopped."""
+import os, glob, json, time
+from . import io, utils
+
+AUDIO_EXTENSIONS = ('.mp3', '.wav', '.flac', '.ogg', '.wma', '.aac', '.ac3', '.aiff', '.m4a', '.opus')
+
+def expand_inputs(inputs: list = (), lists: list = ()) -> list:
+    """Returns a sorted list of audio files from paths, glob patterns, folders, and text files with one path or glob per line"""
+    if isinstance(inputs, str): inputs = [inputs]
+    if isinstance(lists, str): lists = [lists]
+    inputs = list(inputs)
+    for path in lists:
+        with open(path, 'r', encoding = 'utf-8') as f:
+            inputs.extend(line.strip() for line in f if line.strip() != '' and not line.strip().startswith('#'))
+    files = []
+    for i in inputs:
+        if os.path.isdir(i): files.extend(f for f in glob.glob(os.path.join(glob.escape(i), '**', '*'), recursive = True) if f.lower().endswith(AUDIO_EXTENSIONS))
+        elif any(c in i for c in '*?['): files.extend(glob.glob(i, recursive = True))
+        else: files.append(i)
+    return sorted(dict.fromkeys(f.replace('\\', '/') for f in files))
+
+def _scales(scale) -> list:
+    if isinstance(scale, str): return [i.strip() for i in scale.split(',')]
+    if isinstance(scale, (list, tuple)): return list(scale)
+    return [scale]
+
+def plan(inputs: list = (), patterns: list = (), presets: list = (), lists: list = (), output: str = 'output', scale = 1, shift = 0, ext: str = 'mp3') -> list:
+    """Makes a list of jobs, one for each input and each pattern, and each scale of each preset.
+
+    Every job is a dict with `input`, `pattern`, `name`, `scale`, `shift` and `output` - the exact path it will be written to."""
+    from . import presets as bm_presets
+    if isinstance(patterns, str): patterns = [patterns]
+    if isinstance(presets, str): presets = [presets]
+    # same naming as bm.beatswap, numbered if there are several patterns
+    tasks = [(pattern, 'beatswap' if len(patterns) == 1 else f'beatswap {n+1}', scale, shift, False) for n, pattern in enumerate(patterns)]
+    for preset in presets:
+        # presets made of several patterns are applied in sequence, like `presets.use` does
+        if isinstance(list(bm_presets._presets()[preset].values())[0], dict): tasks.append((preset, preset, scale, shift, True))
+        else:
+            pattern, preset_scale, preset_shift = bm_presets.get(preset)
+            preset_scales = _scales(preset_scale)
+            for i in preset_scales:
+                name = f'{preset}{(" x"+str(round(utils._safer_eval(i), 4))) * (len(preset_scales)>1)}'
+                tasks.append((pattern, name, utils._safer_eval(scale) * utils._safer_eval(i), utils._safer_eval(shift) * utils._safer_eval(preset_shift), False))
+    jobs = []
+    for path in expand_inputs(inputs, lists):
+        for pattern, name, job_scale, job_shift, is_preset in tasks:
+            jobs.append({'input': path, 'pattern': pattern, 'name': name, 'scale': job_scale, 'shift': job_shift, 'preset': is_preset,
+                         'output': io._outputfilename(output, filename = path, suffix = f' ({name})', ext = ext)})
+    return jobs
+
+def _run_input(path: str, jobs: list, log = False) -> list:
+    """Runs all jobs for one input in one process, so the song is decoded and its beatmap is loaded once.
+    Each render is encoded on a writer thread while the next one renders."""
+    from . import main, writer, cache, presets as bm_presets
+    results = []
+    try: song = main.song(path, log = log)
+    except Exception as e: return [dict(job, status = 'failed', error = f'{type(e).__name__}: {e}', time = 0) for job in jobs]
+    pending = []
+    # written under a temporary name first, so that an interrupted job never leaves a file that looks finished
+    with writer.writer(atomic = True) as encoder:
+        for job in jobs:
+            start = time.perf_counter()
+            try:
+                if song.beatmap is None: song.beatmap_generate()
+                if job['preset'] is True:
+                    steps = [(i['pattern'], utils._safer_eval(job['scale']) * utils._safer_eval(i.get('scale', 1)), utils._safer_eval(job['shift']) * utils._safer_eval(i.get('shift', 0)))
+                             for i in bm_presets._presets()[job['pattern']].values()]
+                else: steps = [(job['pattern'], job['scale'], job['shift'])]
+                # outputs that were rendered before, by any job, are copied from the render cache
+                key = cache.digest(song)
+                for pattern, scale, shift in steps: key = cache.key(song, pattern, scale, shift, source = key) if key is not None else None
+                if cache.fetch(key, job['output']) is not None:
+                    results.append(dict(job, status = 'done', cached = True, time = time.perf_counter() - start))
+                    continue
+                result = main.song(song.audio, sr = song.sr, log = log)
+                result.path, result.beatmap = song.path, song.beatmap.copy()
+                for pattern, scale, shift in steps: result.beatswap(pattern, scale = scale, shift = shift)
+                pending.append((job, start, encoder.submit(result.audio, result.sr, job['output'], key = key)))
+            except Exception as e:
+                results.append(dict(job, status = 'failed', error = f'{type(e).__name__}: {e}', time = time.perf_counter() - start))
+        for job, start, future in pending:
+            try:
+                future.result()
+                results.append(dict(job, status = 'done', time = time.perf_counter() - start))
+            except Exception as e:
+                results.append(dict(job, status = 'failed', error = f'{type(e).__name__}: {e}', time = time.perf_counter() - start))
+    return results
+
+def load_manifest(path: str) -> dict:
+    if path is None or not os.path.exists(path): return {}
+    with open(path, 'r', encoding = 'utf-8') as f: return json.load(f).get('jobs', {})
+
+def save_manifest(path: str, jobs: dict):
+    if path is None: return
+    utils._makedirs(path)
+    with open(path + '.tmp', 'w', encoding = 'utf-8') as f: json.dump({'version': 1, 'jobs': jobs}, f, indent = 1)
+    os.replace(path + '.tmp', path)
+
+def run(jobs: list, workers: int = None, manifest: str = None, skip_existing = True, log = True) -> dict:
+    """Runs jobs from `plan` in a pool of `workers` processes (all cores if None), skipping jobs whose output exists or that the manifest marks as done.
+
+    The manifest is rewritten after every finished input. Returns the manifest - a dict of jobs by output path, each with `status` and `time`."""
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+    done = load_manifest(manifest)
+    pending = {}
+    for job in jobs:
+        previous = done.get(job['output'])
+        if skip_existing is True and os.path.exists(job['output']):
+            if previous is None or previous['status'] != 'done': done[job['output']] = dict(job, status = 'skipped', time = 0)
+            continue
+        pending.setdefault(job['input'], []).append(job)
+        done[job['output']] = dict(job, status = 'pending', time = 0)
+    save_manifest(manifest, done)
+    total = sum(len(i) for i in pending.values())
+    if log is True: print(f'{total} jobs to run, {len(jobs) - total} already done')
+
+    start = time.perf_counter()
+    finished = 0
+    if total > 0:
+        with ProcessPoolExecutor(max_workers = workers) as executor:
+            futures = {executor.submit(_run_input, path, path_jobs): path for path, path_jobs in pending.items()}
+            for future in as_completed(futures):
+                try: results = future.result()
+                except Exception as e: results = [dict(job, status = 'failed', error = f'{type(e).__name__}: {e}', time = 0) for job in pending[futures[future]]]
+                for result in results:
+                    done[result['output']] = result
+                    finished += 1
+                    if log is True: print(f"[{finished}/{total}] {result['status']} in {result['time']:.2f}s: {result['output']}" + (f" - {result['error']}" if 'error' in result else ''))
+                save_manifest(manifest, done)
+    if log is True: print(summary(done, time.perf_counter() - start))
+    return done
+
+def summary(jobs: dict, elapsed: float = None) -> str:
+    """Counts of jobs by status, total and slowest job times"""
+    statuses = {}
+    for job in jobs.values(): statuses[job['status']] = statuses.get(job['status'], 0) + 1
+    timed = sorted((job for job in jobs.values() if job['status'] == 'done' and job['time'] > 0), key = lambda job: job['time'])
+    lines = [', '.join(f'{count} {status}' for status, count in statuses.items())]
+    if len(timed) > 0:
+        lines.append(f"job time: total {sum(job['time'] for job in timed):.2f}s, average {sum(job['time'] for job in timed)/len(timed):.2f}s, slowest {timed[-1]['time']:.2f}s ({timed[-1]['output']})")
+    if elapsed is not None: lines.append(f'wall time: {elapsed:.2f}s')
+    lines += [f"failed: {job['output']} - {job.get('error')}" for job in jobs.values() if job['status'] == 'failed']
+    return '\n'.join(lines)
@@ -1,8 +1,10 @@
-import numpy as np
-from . import utils
+import numpy as np, os
+from . import utils, instrument, cancel
+from .tempogrid import tempogrid
 
 
 def scale(beatmap:np.ndarray, scale:float, log = True, integer = True) -> np.ndarray:
+    if isinstance(beatmap, tempogrid): return beatmap.scale(scale)
     if isinstance(scale, str): scale = utils._safer_eval(scale)
     assert scale>0, f"scale should be > 0, your scale is {scale}"
     if scale == 1: return beatmap
@@ -27,10 +29,13 @@ def scale(beatmap:np.ndarray, scale:float, log = True, integer = True) -> np.nda
         return b
     
 def shift(beatmap:np.ndarray, shift:float, log = True, mode = 1) -> np.ndarray:
+    if isinstance(beatmap, tempogrid): return beatmap.shift(shift)
     if isinstance(shift, str): shift = utils._safer_eval(shift)
     if shift == 0: return beatmap
+    # the beatmap that was passed in is not changed
+    beatmap = np.array(beatmap)
     # positive shift
-    elif shift > 0:
+    if shift > 0:
         # full value of beats is removed from the beginning
         if shift >= 1: beatmap = beatmap[int(shift//1):]
         # shift beatmap by the decimal value
@@ -58,71 +63,160 @@ def shift(beatmap:np.ndarray, shift:float, log = True, mode = 1) -> np.ndarray:
                 beatmap[i] = int(beatmap[i] - shift * (beatmap[i] - beatmap[i-1]))
     return beatmap
 
-def generate(audio: np.ndarray, sr: int, lib='madmom.BeatDetectionProcessor', caching=True, filename: str = None, log = True, load_settings = True, split=None):
-    """Creates beatmap attribute with a list of positions of beats in samples."""
+# lib: (processor that makes activations, processor that finds beats in them, its arguments)
+MADMOM_LIBS = {
+    'madmom.BeatTrackingProcessor': ('beats.RNNBeatProcessor', 'beats.BeatTrackingProcessor', {'fps': 100}),
+    'madmom.BeatTrackingProcessor.constant': ('beats.RNNBeatProcessor', 'beats.BeatTrackingProcessor', {'fps': 100, 'look_ahead': None}),
+    'madmom.BeatTrackingProcessor.consistent': ('beats.RNNBeatProcessor', 'beats.BeatTrackingProcessor', {'fps': 100, 'look_ahead': None, 'look_aside': 0}),
+    'madmom.BeatDetectionProcessor': ('beats.RNNBeatProcessor', 'beats.BeatDetectionProcessor', {'fps': 100}),
+    'madmom.BeatDetectionProcessor.consistent': ('beats.RNNBeatProcessor', 'beats.BeatDetectionProcessor', {'fps': 100, 'look_aside': 0}),
+    'madmom.CRFBeatDetectionProcessor': ('beats.RNNBeatProcessor', 'beats.CRFBeatDetectionProcessor', {'fps': 100}),
+    'madmom.CRFBeatDetectionProcessor.constant': ('beats.RNNBeatProcessor', 'beats.CRFBeatDetectionProcessor', {'fps': 100, 'use_factors': True, 'factors': [0.5, 1, 2]}),
+    'madmom.DBNBeatTrackingProcessor': ('beats.RNNBeatProcessor', 'beats.DBNBeatTrackingProcessor', {'fps': 100}),
+    'madmom.DBNBeatTrackingProcessor.1000': ('beats.RNNBeatProcessor', 'beats.DBNBeatTrackingProcessor', {'fps': 100, 'transition_lambda': 1000}),
+    'madmom.DBNDownBeatTrackingProcessor': ('downbeats.RNNDownBeatProcessor', 'downbeats.DBNDownBeatTrackingProcessor', {'beats_per_bar': [4], 'fps': 100}),
+}
+
+_processors = {}
+def _madmom_processor(name: str, **kwargs):
+    """Creates `madmom.features.<name>` processor the first time it's needed and then reuses it. RNNBeatProcessor loads 8 neural networks from disk every time it is created."""
+    key = (name, repr(sorted(kwargs.items())))
+    if key not in _processors:
+        import madmom
+        module, processor = name.split('.')
+        _processors[key] = getattr(getattr(madmom.features, module), processor)(**kwargs)
+    return _processors[key]
+
+def warmup(libs = ('madmom.BeatDetectionProcessor',), profile = 'full'):
+    """Loads processors for `libs` in advance, so that the first beatmap doesn't have to wait for it"""
+    if isinstance(libs, str): libs = (libs,)
+    for lib in libs:
+        if lib in MADMOM_LIBS:
+            activations, tracking, kwargs = MADMOM_LIBS[lib]
+            _madmom_processor(activations, **_activation_kwargs(activations, profile))
+            _madmom_processor(tracking, **kwargs)
+
+ACTIVATIONS_FPS = 100 # madmom beat and downbeat networks output 100 activations per second
+ANALYSIS_SR = 44100 # samplerate madmom networks are trained on, other samplerates get resampled
+
+def proxy(audio: np.ndarray, sr: int, target_sr: int = ANALYSIS_SR) -> np.ndarray:
+    """Mono float32 version of `audio` at `target_sr`, which is all that beat detection needs. A quarter of the size of stereo float64."""
+    audio = np.asarray(audio)
+    mono = audio.mean(axis = 0, dtype = np.float32) if audio.ndim > 1 else audio.astype(np.float32, copy = False)
+    from . import io
+    return io._resample(mono, sr, target_sr)
+
+# `full` - the whole ensemble of networks, `fast` - only the first network of the ensemble.
+# Downbeat processors don't support choosing networks, so they always use `full`.
+PROFILES = ('full', 'fast')
+
+def _activation_kwargs(name: str, profile: str = 'full') -> dict:
+    assert profile in PROFILES, f'Unknown profile `{profile}`, available profiles: {PROFILES}'
+    if profile == 'fast' and name == 'beats.RNNBeatProcessor':
+        from madmom.models import BEATS_LSTM
+        return {'nn_files': BEATS_LSTM[:1]}
+    return {}
+
+def _activations(name: str, audio: np.ndarray, sr: int, profile: str = 'full') -> np.ndarray:
+    import madmom
+    return _madmom_processor(name, **_activation_kwargs(name, profile))(madmom.audio.signal.Signal(audio.T, sr))
+
+def activations_chunked(audio: np.ndarray, sr: int, name: str = 'beats.RNNBeatProcessor', split: float = 60, overlap: float = 10, workers: int = None, profile: str = 'full') -> np.ndarray:
+    """Activations of `madmom.features.<name>` for the whole audio, computed in `split` second windows in parallel processes.
+
+    Each window also gets `overlap` seconds of audio on both sides so that the networks have context at the edges,
+    and only the middle of each window is kept when they are stitched together. Memory use depends on `split` and not on audio length."""
+    from concurrent.futures import ProcessPoolExecutor
+    hop = sr / ACTIVATIONS_FPS
+    total = int(np.ceil(audio.shape[-1] / hop))
+    window, margin = max(int(split * ACTIVATIONS_FPS), 1), int(overlap * ACTIVATIONS_FPS)
+    chunks = []
+    for start in range(0, total, window):
+        stop = min(start + window, total)
+        first, last = max(start - margin, 0), min(stop + margin, total)
+        chunks.append((start, stop, first, audio[..., int(round(first * hop)) : int(round(last * hop))]))
+    if len(chunks) == 1: return _activations(name, audio, sr, profile)
+    from concurrent.futures import wait
+    executor = ProcessPoolExecutor(max_workers = min(workers or os.cpu_count() or 1, len(chunks)))
+    futures = [executor.submit(_activations, name, i[3], sr, profile) for i in chunks]
+    cancelled = False
+    try:
+        stitched = None
+        for n, ((start, stop, first, _), future) in enumerate(zip(chunks, futures)):
+            # waits a bit at a time, so that a cancelled analysis doesn't wait for every chunk
+            while len(wait([future], timeout = 0.5).done) == 0: cancel.check('analysis', n, len(chunks))
+            activations = future.result()
+            if stitched is None: stitched = np.zeros((total,) + activations.shape[1:], dtype = activations.dtype)
+            part = activations[start - first : stop - first]
+            stitched[start : start + len(part)] = part
+        cancel.check('analysis', len(chunks), len(chunks))
+    except cancel.Cancelled:
+        # chunks that haven't started are dropped, the ones that are running finish in the background
+        cancelled = True
+        for future in futures: future.cancel()
+        raise
+    finally: executor.shutdown(wait = not cancelled)
+    return stitched
+
+def _matched(beats: np.ndarray, reference: np.ndarray, tolerance: float) -> int:
+    reference = np.concatenate(([-np.inf], reference, [np.inf]))
+    nearest = np.searchsorted(reference, beats)
+    return int(np.sum(np.minimum(beats - reference[nearest - 1], reference[nearest] - beats) <= tolerance))
+
+def agreement(beatmap: np.ndarray, reference: np.ndarray, sr: int, tolerance: float = 0.07) -> float:
+    """F-measure of beats in `beatmap` against beats in `reference`, where beats within `tolerance` seconds count as the same. 1 means they are identical."""
+    beatmap, reference = np.sort(np.asarray(beatmap, dtype = float)), np.sort(np.asarray(reference, dtype = float))
+    if len(beatmap) == 0 or len(reference) == 0: return float(len(beatmap) == len(reference))
+    precision = _matched(beatmap, reference, tolerance * sr) / len(beatmap)
+    recall = _matched(reference, beatmap, tolerance * sr) / len(reference)
+    return 0.0 if precision + recall == 0 else float(2 * precision * recall / (precision + recall))
+
+def _cache_path(filename: str, lib: str, audio_id: str, suffix: str = '') -> str:
+    """Path to a cached beatmap, or to its settings with suffix `_settings`"""
+    return os.path.join(utils.BEATMAPS_DIR, filename.replace('\\', '/').split('/')[-1] + "_"+lib+"_"+audio_id+suffix+'.txt')
+
+def generate(audio: np.ndarray, sr: int, lib='madmom.BeatDetectionProcessor', caching=True, filename: str = None, log = True, load_settings = True, split=None, workers = None, profile = 'full', analysis_proxy = None):
+    """Creates beatmap attribute with a list of positions of beats in samples.
+
+    `split` - for madmom libs, computes activations in windows of that many seconds in `workers` processes (all cores if None), see `activations_chunked`. Useful for very long audio.
+
+    `profile` - `full` or `fast`, see `PROFILES`. Fast beatmaps are cached separately.
+
+    `analysis_proxy` - result of `proxy(audio, sr)`, or a function that returns it, so that it isn't made again for every beatmap."""
     if log is True: print(f'Analyzing beats using {lib}; ', end='')
+    timer = instrument.start('analysis')
 
+    audio_id=hex(len(audio[0]))
+    beatmap = None
     # load a beatmap if it is cached:
     if caching is True and filename is not None:
-        audio_id=hex(len(audio[0]))
-        import os
-        if not os.path.exists('beat_manipulator/beatmaps'):
-            os.mkdir('beat_manipulator/beatmaps')
-        cacheDir="beat_manipulator/beatmaps/" + ''.join(filename.replace('\\', '/').split('/')[-1]) + "_"+lib+"_"+audio_id+'.txt'
+        cacheDir=_cache_path(filename, lib if profile == 'full' else f'{lib}.{profile}', audio_id)
         try: 
             beatmap=np.loadtxt(cacheDir, dtype=int)
             if log is True: print('loaded cached beatmap.')
+            instrument.count('beatmap_cache_hits')
         except OSError: 
             if log is True:print("beatmap hasn't been generated yet. Generating...")
             beatmap = None
+            instrument.count('beatmap_cache_misses')
 
     #generate the beatmap
     if beatmap is None:
+        detection_timer = instrument.start('beat_detection')
         if 'madmom' in lib.lower():
             from collections.abc import MutableMapping, MutableSequence
             import madmom
             assert len(audio[0])>sr*2, f'Audio file is too short, len={len(audio[0])} samples, or {len(audio[0])/sr} seconds. Minimum length is 2 seconds, audio below that breaks madmom processors.'
-        if lib=='madmom.BeatTrackingProcessor':
-            proc = madmom.features.beats.BeatTrackingProcessor(fps=100)
-            act = madmom.features.beats.RNNBeatProcessor()(madmom.audio.signal.Signal(audio.T, sr))
-            beatmap= proc(act)*sr
-        elif lib=='madmom.BeatTrackingProcessor.constant':
-            proc = madmom.features.beats.BeatTrackingProcessor(fps=100, look_ahead=None)
-            act = madmom.features.beats.RNNBeatProcessor()(madmom.audio.signal.Signal(audio.T, sr))
-            beatmap= proc(act)*sr
-        elif lib=='madmom.BeatTrackingProcessor.consistent':
-            proc = madmom.features.beats.BeatTrackingProcessor(fps=100, look_ahead=None, look_aside=0)
-            act = madmom.features.beats.RNNBeatProcessor()(madmom.audio.signal.Signal(audio.T, sr))
-            beatmap= proc(act)*sr
-        elif lib=='madmom.BeatDetectionProcessor':
-            proc = madmom.features.beats.BeatDetectionProcessor(fps=100)
-            act = madmom.features.beats.RNNBeatProcessor()(madmom.audio.signal.Signal(audio.T, sr))
-            beatmap= proc(act)*sr
-        elif lib=='madmom.BeatDetectionProcessor.consistent':
-            proc = madmom.features.beats.BeatDetectionProcessor(fps=100, look_aside=0)
-            act = madmom.features.beats.RNNBeatProcessor()(madmom.audio.signal.Signal(audio.T, sr))
-            beatmap= proc(act)*sr
-        elif lib=='madmom.CRFBeatDetectionProcessor':
-            proc = madmom.features.beats.CRFBeatDetectionProcessor(fps=100)
-            act = madmom.features.beats.RNNBeatProcessor()(madmom.audio.signal.Signal(audio.T, sr))
-            beatmap= proc(act)*sr
-        elif lib=='madmom.CRFBeatDetectionProcessor.constant':
-            proc = madmom.features.beats.CRFBeatDetectionProcessor(fps=100, use_factors=True, factors=[0.5, 1, 2])
-            act = madmom.features.beats.RNNBeatProcessor()(madmom.audio.signal.Signal(audio.T, sr))
-            beatmap= proc(act)*sr
-        elif lib=='madmom.DBNBeatTrackingProcessor':
-            proc = madmom.features.beats.DBNBeatTrackingProcessor(fps=100)
-            act = madmom.features.beats.RNNBeatProcessor()(madmom.audio.signal.Signal(audio.T, sr))
-            beatmap= proc(act)*sr
-        elif lib=='madmom.DBNBeatTrackingProcessor.1000':
-            proc = madmom.features.beats.DBNBeatTrackingProcessor(fps=100, transition_lambda=1000)
-            act = madmom.features.beats.RNNBeatProcessor()(madmom.audio.signal.Signal(audio.T, sr))
-            beatmap= proc(act)*sr
-        elif lib=='madmom.DBNDownBeatTrackingProcessor':
-            proc = madmom.features.downbeats.DBNDownBeatTrackingProcessor(beats_per_bar=[4], fps=100)
-            act = madmom.features.downbeats.RNNDownBeatProcessor()(madmom.audio.signal.Signal(audio.T, sr))
-            beatmap= proc(act)*sr
-            beatmap=beatmap[:,0]
+        if lib in MADMOM_LIBS:
+            activations, tracking, kwargs = MADMOM_LIBS[lib]
+            if analysis_proxy is None: analysis_proxy = proxy(audio, sr)
+            elif callable(analysis_proxy): analysis_proxy = analysis_proxy()
+            if split is not None: act = activations_chunked(analysis_proxy, ANALYSIS_SR, activations, split = split, workers = workers, profile = profile)
+            else: act = _activations(activations, analysis_proxy, ANALYSIS_SR, profile)
+            cancel.check('beat_detection')
+            beatmap= _madmom_processor(tracking, **kwargs)(act)*sr
+            # downbeat processors return (time, beat number) pairs
+            if beatmap.ndim > 1: beatmap=beatmap[:,0]
         elif lib=='madmom.PatternTrackingProcessor': #broken
             from madmom.models import PATTERNS_BALLROOM
             proc = madmom.features.downbeats.PatternTrackingProcessor(PATTERNS_BALLROOM, fps=50)
@@ -140,18 +234,24 @@ def generate(audio: np.ndarray, sr: int, lib='madmom.BeatDetectionProcessor', ca
             proc = madmom.features.downbeats.DBNBarTrackingProcessor(beats_per_bar=[4], fps=100)
             act = madmom.features.downbeats.RNNBarProcessor()(((madmom.audio.signal.Signal(audio.T, sr)), beats))
             beatmap= proc(act)*sr
+        elif lib=='stunlocked':
+            from . import onsets
+            beatmap = onsets.beats(audio, sr)
         elif lib=='librosa': #broken in 3.9, works in 3.8
             import librosa
             beat_frames = librosa.beat.beat_track(y=audio[0], sr=sr, hop_length=512)
             beatmap = librosa.frames_to_samples(beat_frames[1])
         
+        instrument.stop(detection_timer)
         # save the beatmap and return
-        if caching is True: np.savetxt(cacheDir, beatmap.astype(int), fmt='%d')
+        if caching is True and filename is not None: 
+            utils._makedirs(cacheDir)
+            np.savetxt(cacheDir, beatmap.astype(int), fmt='%d')
         if not isinstance(beatmap, np.ndarray): beatmap=np.asarray(beatmap, dtype=int)
         else: beatmap=beatmap.astype(int)
 
-    if load_settings is True:
-        settingsDir="beat_manipulator/beatmaps/" + ''.join(filename.split('/')[-1]) + "_"+lib+"_"+audio_id+'_settings.txt'
+    if load_settings is True and filename is not None:
+        settingsDir=_cache_path(filename, lib, audio_id, '_settings')
         if os.path.exists(settingsDir):
             with open(settingsDir, 'r') as f:
                 settings = f.read().split(',')
@@ -159,6 +259,7 @@ def generate(audio: np.ndarray, sr: int, lib='madmom.BeatDetectionProcessor', ca
             if settings[1] != 'None': beatmap = shift(beatmap, settings[1], log = False)
             if settings[2] != 'None': beatmap = np.sort(np.absolute(beatmap - int(settings[2])))
 
+    instrument.stop(timer)
     return beatmap
 
 
@@ -166,10 +267,9 @@ def generate(audio: np.ndarray, sr: int, lib='madmom.BeatDetectionProcessor', ca
 def save_settings(audio: np.ndarray, filename: str = None, lib: str = 'madmom.BeatDetectionProcessor', scale: float = None, shift: float = None, adjust: int = None, normalized: str = None, log = True, overwrite = 'ask'):
     if isinstance(overwrite, str): overwrite = overwrite.lower()
     audio_id=hex(len(audio[0]))
-    cacheDir="beat_manipulator/beatmaps/" + ''.join(filename.split('/')[-1]) + "_"+lib+"_"+audio_id+'.txt'
-    import os
+    cacheDir=_cache_path(filename, lib, audio_id)
     assert os.path.exists(cacheDir), f"Beatmap `{cacheDir}` doesn't exist"
-    settingsDir="beat_manipulator/beatmaps/" + ''.join(filename.split('/')[-1]) + "_"+lib+"_"+audio_id+'_settings.txt'
+    settingsDir=_cache_path(filename, lib, audio_id, '_settings')
 
     try: 
         a = utils._safer_eval_strict(scale)
@@ -0,0 +1,135 @@
+"""Encoded renders stored on disk by what they were made from, so that the same render is never made or encoded twice.
+
+```
+key = bm.cache.key(song, '1, 3, 2, 4', scale = 0.5)
+bm.cache.fetch(key, 'output/song (beatswap).mp3')  # copies the cached file there, returns None if it isn't cached
+```
+A key is a sha256 of the song's audio, its beatmap, the pattern without spaces, the samples it uses, every render argument and the seed.
+Patterns with random parts (`random`, `shuffle`, `@`, `#`) are only cached when they have a seed.
+A chain of renders is keyed by the key of the render before it, passed as `source`, so the audio in between is never hashed.
+Audio is hashed every time its key is needed, so audio that was changed in place gets a new key.
+
+Files go to `utils.RENDERS_DIR`, one for every key and format. When they take more than `MAX_SIZE` bytes, the least recently used are deleted."""
+import os, hashlib, shutil, threading
+import numpy as np
+from . import utils, instrument
+from .utils import C_MISC
+
+MAX_SIZE = 2 * 1024**3
+# changed when renders of the same pattern change, so that old files are not used
+VERSION = 1
+
+_lock = threading.Lock()
+
+def _sha256(*values) -> str:
+    result = hashlib.sha256()
+    for i in values:
+        result.update(repr(i).encode())
+        result.update(b'\0')
+    return result.hexdigest()
+
+def _array(a) -> str:
+    a = np.ascontiguousarray(a)
+    result = hashlib.sha256(f'{a.dtype}{a.shape}'.encode())
+    result.update(a.data)
+    return result.hexdigest()
+
+def digest(song) -> str:
+    """sha256 of the audio and samplerate of a song. Not kept on the song, because its audio can be changed in place."""
+    timer = instrument.start('hash')
+    result = _sha256(song.sr, _array(np.asarray(song.audio, dtype = np.float32)))
+    instrument.stop(timer)
+    return result
+
+def is_random(pattern: str, c_misc: str = C_MISC) -> bool:
+    return pattern.lower() in ('random', 'shuffle') or c_misc[4] in pattern or c_misc[8] in pattern
+
+def _sources(pattern: str, samples) -> list:
+    """What the samples and songs a pattern uses are made from - file path, modification time and size, or a hash"""
+    from . import assets, main
+    samples = assets._samples(samples) if samples is not None else {}
+    result = []
+    for name in sorted(assets.references(pattern)):
+        source = samples.get(name, name)
+        if isinstance(source, str): result.append((name, assets._key(source, None)[:3] if os.path.exists(source) else source))
+        elif isinstance(source, main.song): result.append((name, digest(source)))
+        else: result.append((name, _array(np.asarray(source, dtype = np.float32))))
+    return result
+
+def key(song, pattern, scale = 1, shift = 0, adjust = 500, seed = None, samples = None, beatmap = None, source: str = None,
+        length = None, smoothing = 100, limit_beats = 10000, limit_length = 52920000) -> str:
+    """Key of a render of `song` with `pattern` and `song.beatswap` arguments. None if it can't be cached - the pattern is already parsed,
+    or it has random parts and no seed.
+
+    `beatmap` - beatmap the render starts from, `song.beatmap` by default. `source` - digest of the audio it starts from, `digest(song)` by default."""
+    if not isinstance(pattern, str): return None
+    from . import parse
+    from .presets import BM_SAMPLES
+    if beatmap is None: beatmap = song.beatmap
+    if beatmap is None: return None
+    if is_random(pattern):
+        if seed is None: return None
+    else: seed = None
+    if samples is None: samples = BM_SAMPLES
+    if source is None: source = digest(song)
+    return _sha256(VERSION, source, song.sr, _array(np.asarray(beatmap, dtype = np.int64)), parse.normalize(pattern), float(utils._safer_eval(scale)), float(utils._safer_eval(shift)),
+                   adjust, seed, _sources(pattern, samples), length, smoothing, limit_beats, limit_length)
+
+def path(key: str, ext: str) -> str:
+    return os.path.join(utils.RENDERS_DIR, f"{key}.{ext.lstrip('.').lower()}")
+
+def get(key: str, ext: str) -> str:
+    """Path to the cached file with `key` in format `ext`, or None. Marks it as recently used."""
+    if key is None: return None
+    cached = path(key, ext)
+    try: os.utime(cached)
+    except OSError:
+        instrument.count('render_cache_misses')
+        return None
+    instrument.count('render_cache_hits')
+    return cached
+
+def fetch(key: str, output: str) -> str:
+    """Copies the cached file with `key` to `output`, in the format of its extension. Returns `output`, or None if it isn't cached."""
+    cached = get(key, os.path.splitext(output)[1])
+    if cached is None: return None
+    utils._makedirs(output)
+    partial = f'{output}.{threading.get_ident()}.partial'
+    shutil.copyfile(cached, partial)
+    os.replace(partial, output)
+    return output
+
+def put(key: str, source, ext: str = None):
+    """Stores a file, or bytes in format `ext`, under `key`, then deletes the least recently used files if there are more than `MAX_SIZE` bytes."""
+    if key is None: return
+    if ext is None: ext = os.path.splitext(source)[1]
+    target = path(key, ext)
+    utils._makedirs(target)
+    partial = f'{target}.{threading.get_ident()}.partial'
+    if isinstance(source, bytes):
+        with open(partial, 'wb') as f: f.write(source)
+    else: shutil.copyfile(source, partial)
+    os.replace(partial, target)
+    evict()
+
+def evict(max_size: int = None):
+    """Deletes the least recently used files until the cache is at most `max_size` bytes, `MAX_SIZE` by default"""
+    if max_size is None: max_size = MAX_SIZE
+    if not os.path.isdir(utils.RENDERS_DIR): return
+    with _lock:
+        files = [(i.stat().st_mtime, i.stat().st_size, i.path) for i in os.scandir(utils.RENDERS_DIR) if i.is_file() and not i.name.endswith('.partial')]
+        total = sum(i[1] for i in files)
+        for _, size, file in sorted(files):
+            if total <= max_size: break
+            try: os.remove(file)
+            except OSError: continue
+            total -= size
+            instrument.count('render_cache_evictions')
+
+def clear():
+    evict(0)
+
+def size() -> int:
+    """Bytes that cached files take"""
+    if not os.path.isdir(utils.RENDERS_DIR): return 0
+    return sum(i.stat().st_size for i in os.scandir(utils.RENDERS_DIR) if i.is_file())
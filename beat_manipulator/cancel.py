@@ -0,0 +1,84 @@
+"""Cancellation and deadlines for analysis and rendering.
+
+```
+token = bm.cancel.token(deadline = 30)  # seconds from now, None for no deadline
+with bm.cancel.scope(token):
+    song.beatswap('1, 3, 2, 4')          # raises bm.cancel.Cancelled after 30 seconds, or when another thread calls token.cancel()
+```
+The render loop, smoothing, image generation, osu! export and chunked analysis check the token of their thread regularly.
+When it is tripped they stop, drop what they made so far and raise `Cancelled`, which has how far they got in `progress`.
+Whoever catches it should call `release(error)`, so that buffers that the traceback still refers to are freed right away.
+
+`bm.jobs` runs every job with its own token - `job.cancel()` stops a queued or running job, `executor.submit(..., deadline = 30)` sets a deadline.
+Without a token, a check is one thread local lookup."""
+import threading, time, traceback
+
+class Cancelled(RuntimeError):
+    """Raised by `check` when its token was cancelled or is past its deadline. `progress` is a dict with
+    `stage`, `done` and `total` from the last check, `elapsed` seconds and `reason` - `cancelled` or `deadline`."""
+    def __init__(self, message: str, progress: dict = None):
+        super().__init__(message)
+        self.progress = progress if progress is not None else {}
+
+_current = threading.local()
+
+class token:
+    def __init__(self, deadline: float = None):
+        self.started = time.monotonic()
+        self.deadline = None if deadline is None else self.started + deadline
+        self.reason = None
+        # last progress that was checked
+        self.stage = None
+        self.done = None
+        self.total = None
+
+    def cancel(self, reason: str = 'cancelled'):
+        if self.reason is None: self.reason = reason
+
+    @property
+    def cancelled(self) -> bool:
+        if self.reason is None and self.deadline is not None and time.monotonic() >= self.deadline: self.reason = 'deadline'
+        return self.reason is not None
+
+    def remaining(self) -> float:
+        """Seconds until the deadline, None if there is none"""
+        return None if self.deadline is None else max(self.deadline - time.monotonic(), 0.)
+
+    def progress(self) -> dict:
+        return {'stage': self.stage, 'done': self.done, 'total': self.total, 'elapsed': time.monotonic() - self.started, 'reason': self.reason}
+
+    def check(self, stage: str = None, done: int = None, total: int = None):
+        """Records progress, and raises `Cancelled` if the token was cancelled or is past its deadline"""
+        if stage is not None: self.stage, self.done, self.total = stage, done, total
+        if self.cancelled:
+            where = f' in {self.stage}' + (f' after {self.done} of {self.total}' if self.done is not None else '') if self.stage is not None else ''
+            raise Cancelled(f'stopped{where}: {self.reason}', self.progress())
+
+    def __repr__(self):
+        return f'token(reason = {self.reason}, remaining = {self.remaining()}, stage = {self.stage})'
+
+def current() -> token:
+    """Token of this thread, or None"""
+    return getattr(_current, 'token', None)
+
+class scope:
+    """Makes `token` the token of this thread inside a `with` block. Thread pools pass `current()` on to their threads this way."""
+    def __init__(self, token: token):
+        self.token = token
+
+    def __enter__(self) -> token:
+        self.previous = current()
+        _current.token = self.token
+        return self.token
+
+    def __exit__(self, *args):
+        _current.token = self.previous
+
+def check(stage: str = None, done: int = None, total: int = None):
+    """Checks the token of this thread, if there is one"""
+    t = getattr(_current, 'token', None)
+    if t is not None: t.check(stage, done, total)
+
+def release(error: BaseException):
+    """Clears local variables of every frame in the traceback of a caught exception, so that arrays they refer to are freed now, not when the exception is"""
+    traceback.clear_frames(error.__traceback__)
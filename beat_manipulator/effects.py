@@ -1,3 +1,4 @@
+import functools
 import numpy as np
 from . import io
 
@@ -31,15 +32,15 @@ def speed(audio: np.ndarray, s: float = 2, precision:int = 24):
         return np.repeat(audio, int(1/s), axis=1)
 
 def channel(audio: np.ndarray, c:int = None):
+    # audio can be a view of the song, so it is copied instead of changed in place
     if c is None:
-        audio[0], audio[1] = audio[1], audio[0]
-        return audio
-    elif c == 0:
+        return audio[::-1].copy()
+    audio = audio.copy()
+    if c == 0:
         audio[0] = 0
-        return audio
     else:
         audio[1] = 0
-        return audio
+    return audio
     
 def downsample(audio: np.ndarray, d:int = 10):
     return np.repeat(audio[:,::d], d, axis=1)
@@ -71,6 +72,94 @@ def to_sidechain(audio: np.ndarray):
     return audio
 
 
+# Time-stretch and pitch-shift with a phase vocoder. FFT functions and window tables are made once and shared by every beat,
+# pyfftw plans are cached between calls when it is installed.
+N_FFT = 2048
+TAU = np.float32(2 * np.pi)
+
+@functools.lru_cache(maxsize = 1)
+def _fft():
+    """rfft and irfft, from pyfftw if it is installed, otherwise scipy or numpy"""
+    try:
+        import pyfftw.interfaces.numpy_fft, pyfftw.interfaces.cache
+        pyfftw.interfaces.cache.enable()
+        pyfftw.interfaces.cache.set_keepalive_time(60)
+        return pyfftw.interfaces.numpy_fft.rfft, pyfftw.interfaces.numpy_fft.irfft
+    except ImportError: pass
+    try:
+        import scipy.fft
+        return scipy.fft.rfft, scipy.fft.irfft
+    except ImportError: return np.fft.rfft, np.fft.irfft
+
+@functools.lru_cache(maxsize = 16)
+def _tables(n_fft: int) -> tuple:
+    """Hann window, overlap-add normalization for every position in a hop, and phase advance of every bin per hop, for hop = n_fft/4"""
+    hop = n_fft // 4
+    window = np.hanning(n_fft + 1)[:-1].astype(np.float32)
+    norm = np.sum((window**2).reshape(4, hop), axis = 0)
+    advance = (2 * np.pi * hop * np.arange(n_fft // 2 + 1) / n_fft).astype(np.float32)
+    return window, norm, advance
+
+def _stft(audio: np.ndarray, n_fft: int) -> np.ndarray:
+    """Spectrum of every channel shaped (channels, frames, bins), frames are centered on every hop"""
+    hop = n_fft // 4
+    window = _tables(n_fft)[0]
+    padded = np.pad(np.asarray(audio, dtype = np.float32), ((0, 0), (n_fft // 2, n_fft // 2 + hop)))
+    frames = np.lib.stride_tricks.sliding_window_view(padded, n_fft, axis = 1)[:, ::hop]
+    return _fft()[0](frames * window, axis = -1)
+
+def _istft(spectrum: np.ndarray, n_fft: int, length: int) -> np.ndarray:
+    hop = n_fft // 4
+    window, norm, _ = _tables(n_fft)
+    channels, count = spectrum.shape[:2]
+    frames = (_fft()[1](spectrum, n = n_fft, axis = -1) * window).reshape(channels, count, 4, hop)
+    # overlap-add, every frame covers 4 hops
+    blocks = np.zeros((channels, count + 3, hop), dtype = frames.dtype)
+    for i in range(4): blocks[:, i : i + count] += frames[:, :, i]
+    result = (blocks / norm).reshape(channels, -1)[:, n_fft // 2 : n_fft // 2 + length]
+    return np.pad(result, ((0, 0), (0, length - result.shape[1])))
+
+def _vocoder(spectrum: np.ndarray, rate: float, advance: np.ndarray) -> np.ndarray:
+    """Frames at every `rate` frames of `spectrum`, with magnitudes interpolated and phases advanced by the measured frequency of every bin"""
+    steps = np.arange(0, spectrum.shape[1] - 1, rate)
+    index = steps.astype(int)
+    alpha = (steps - index).astype(np.float32)[None, :, None]
+    magnitude, angle = np.abs(spectrum), np.angle(spectrum)
+    result_magnitude = magnitude[:, index] * (1 - alpha) + magnitude[:, index + 1] * alpha
+    delta = angle[:, index + 1] - angle[:, index] - advance
+    delta = delta - TAU * np.rint(delta / TAU) + advance
+    delta[:, 1:] = delta[:, :-1]
+    delta[:, 0] = angle[:, 0]
+    # summed in float64 and wrapped, cos and sin of small angles are much faster
+    phase = np.cumsum(delta, axis = 1, dtype = np.float64)
+    phase = (phase - 2 * np.pi * np.rint(phase / (2 * np.pi))).astype(np.float32)
+    result = np.empty(phase.shape, dtype = np.complex64 if spectrum.dtype == np.complex64 else np.complex128)
+    result.real = result_magnitude * np.cos(phase)
+    result.imag = result_magnitude * np.sin(phase)
+    return result
+
+def stretch(audio: np.ndarray, t: float = 2, n_fft: int = N_FFT):
+    """Time-stretch without changing pitch, `t2` is twice as fast, `t0.5` twice as slow"""
+    if t is None: t = 2
+    assert t > 0, f'time-stretch should be > 0, it is {t}'
+    length = max(int(round(audio.shape[1] / t)), 1)
+    dtype = audio.dtype if audio.dtype.kind == 'f' else np.float32
+    if t == 1 or audio.shape[1] < 2: return np.array(audio, dtype = dtype)
+    # short beats get a shorter window, so that they aren't mostly padding
+    while n_fft > 256 and n_fft > audio.shape[1]: n_fft //= 2
+    spectrum = _stft(audio, n_fft)
+    return _istft(_vocoder(spectrum, t, _tables(n_fft)[2]), n_fft, length).astype(dtype, copy = False)
+
+def pitch(audio: np.ndarray, p: float = 12, n_fft: int = N_FFT):
+    """Pitch-shift by `p` semitones without changing length"""
+    if p is None: p = 12
+    if p == 0 or audio.shape[1] < 2: return np.array(audio, dtype = audio.dtype if audio.dtype.kind == 'f' else np.float32)
+    ratio = 2 ** (p / 12)
+    stretched = stretch(audio, 1 / ratio, n_fft)
+    # playing the stretched beat `ratio` times faster brings it back to the original length at a higher pitch
+    positions = np.linspace(0, stretched.shape[1] - 1, audio.shape[1])
+    samples = np.arange(stretched.shape[1])
+    return np.stack([np.interp(positions, samples, channel) for channel in stretched]).astype(stretched.dtype, copy = False)
 
 # some stuff is defined in main.py to reduce function calls for 1 line stuff
 BM_EFFECTS = {
@@ -81,4 +170,66 @@ BM_EFFECTS = {
     "g": "gradient",
     "b": bitcrush,
     "r": "reverse",
-}
\ No newline at end of file
+    "t": stretch,
+    "p": pitch,
+}
+
+# Batched effects work on many beats concatenated into one array, `offsets` are where each beat starts, plus the total length.
+# They give exactly the same samples as applying the effect to each beat, and return the new audio and offsets.
+def _segments(lengths: np.ndarray) -> tuple:
+    """Beat number and position inside the beat of every sample of beats with `lengths`"""
+    starts = np.cumsum(lengths) - lengths
+    beat = np.repeat(np.arange(len(lengths)), lengths)
+    return beat, np.arange(np.sum(lengths)) - starts[beat]
+
+def _gather(audio: np.ndarray, offsets: np.ndarray, lengths: np.ndarray, index) -> tuple:
+    """Beats with new `lengths`, where sample k of beat i is `audio[:, offsets[i] + index(k, old length of beat i)]`"""
+    beat, local = _segments(lengths)
+    return audio[:, offsets[:-1][beat] + index(local, np.diff(offsets)[beat])], np.concatenate(([0], np.cumsum(lengths)))
+
+def _batch_speed(audio: np.ndarray, offsets: np.ndarray, s: float = 2, precision: int = 24):
+    if s <= 0: return None
+    length = np.diff(offsets)
+    if s%1 != 0 and (1/s)%1 != 0:
+        import fractions
+        s = fractions.Fraction(s).limit_denominator(precision)
+        num, den = s.numerator, s.denominator
+        return _gather(audio, offsets, (length * den + num - 1) // num, lambda k, n: (k * num) // den)
+    elif s%1 == 0:
+        s = int(s)
+        return _gather(audio, offsets, (length + s - 1) // s, lambda k, n: k * s)
+    else:
+        r = int(1/s)
+        return _gather(audio, offsets, length * r, lambda k, n: k // r)
+
+def _batch_downsample(audio: np.ndarray, offsets: np.ndarray, d: int = 8):
+    if d is None: d = 8
+    if not isinstance(d, int) or d <= 0: return None
+    return _gather(audio, offsets, (np.diff(offsets) + d - 1) // d * d, lambda k, n: k // d * d)
+
+def _batch_reverse(audio: np.ndarray, offsets: np.ndarray, v = None):
+    return _gather(audio, offsets, np.diff(offsets), lambda k, n: n - 1 - k)
+
+def _batch_gradient(audio: np.ndarray, offsets: np.ndarray, v = None):
+    # np.gradient needs at least 2 samples
+    if np.min(np.diff(offsets)) < 2: return None
+    result = np.empty_like(audio, dtype = audio.dtype if audio.dtype.kind == 'f' else np.float64)
+    result[:, 1:-1] = (audio[:, 2:] - audio[:, :-2]) / 2.
+    first, last = offsets[:-1], offsets[1:] - 1
+    result[:, first] = (audio[:, first + 1] - audio[:, first]) / 1.
+    result[:, last] = (audio[:, last] - audio[:, last - 1]) / 1.
+    return result, offsets
+
+def _batch_volume(audio: np.ndarray, offsets: np.ndarray, v: float = 0):
+    return audio * (0 if v is None else v), offsets
+
+# effects that change every sample on its own or whole channels can just be applied to the concatenated beats
+BM_BATCHED = {
+    speed: _batch_speed,
+    channel: lambda audio, offsets, v: (channel(audio, v), offsets),
+    bitcrush: lambda audio, offsets, v: (bitcrush(audio, v), offsets),
+    "volume": _batch_volume,
+    "downsample": _batch_downsample,
+    "gradient": _batch_gradient,
+    "reverse": _batch_reverse,
+}
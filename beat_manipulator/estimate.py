@@ -0,0 +1,249 @@
+"""Predicts how big a beatswap will be without rendering it.
+
+`estimate(song, pattern, ...)` returns a dict with `beats` (beats in the output), `length` (output length in samples),
+`memory` (approximate peak memory of the render in bytes), `loops` (how many times the pattern repeats) and `truncated`
+(True if `limit_beats` or `limit_length` will stop the render early).
+
+`song.beatswap(..., budget = {'length': 44100*600, 'beats': 5000, 'memory': 2**30})` checks the estimate before rendering
+and raises `BudgetExceeded` if any of the limits is exceeded. Budget can also have `seconds`, which is output length in seconds."""
+import numpy as np
+from . import utils, main
+from .utils import C_SLICE, C_JOIN, C_MISC
+
+# Peak render memory per stereo output sample. Beats without effects are views of the song until they are concatenated,
+# beats with effects and joined beats are float32 copies, so the worst case is every beat copied once plus the output.
+BYTES_PER_SAMPLE = 16
+
+class BudgetExceeded(ValueError):
+    """Raised before rendering when the estimated render is over the budget. `estimate` attribute has the full estimate."""
+    def __init__(self, message, estimate):
+        super().__init__(message)
+        self.estimate = estimate
+
+def _random_mean(beat: str, length: int, rchar = C_MISC[4], schar = C_MISC[5]) -> str:
+    """Replaces every `@start_stop_step` with the average of all possible choices, which is what `parse._random` picks from"""
+    while rchar in beat:
+        start = beat.find(rchar)
+        values = []
+        cur = start + 1
+        for _ in range(3):
+            number = ''
+            while cur < len(beat) and (beat[cur].isdecimal() or beat[cur] in '.+-*/'):
+                number += beat[cur]
+                cur += 1
+            values.append(number)
+            if cur < len(beat) and beat[cur] == schar and len(values) < 3: cur += 1
+            else: break
+        first = utils._safer_eval(values[0]) if values[0] != '' else 0
+        last = utils._safer_eval(values[1]) if len(values) > 1 and values[1] != '' else length
+        step = utils._safer_eval(values[2]) if len(values) > 2 and values[2] != '' else length
+        choices = np.arange(first, last + step * 1e-9, step) if step > 0 and last >= first else np.array([first])
+        beat = beat[:start] + str(float(np.mean(choices))) + beat[cur:]
+    return beat
+
+def _eval(beat: str, length: int) -> float:
+    if C_MISC[4] in beat: beat = _random_mean(beat, length)
+    return utils._safer_eval(beat)
+
+def _speed(effects: list, effect_functions: dict) -> float:
+    """How much effects change the length of a beat. Only speed and time-stretch change it, other effects keep it."""
+    factor = 1
+    for e in effects:
+        if e[0] in effect_functions and e[0] in ('s', 't'):
+            v = utils._safer_eval(e[1]) if e[1] is not None and C_MISC[7] not in e[1] else 2
+            if v > 0: factor /= v
+    return factor
+
+def _positions(beatmap: np.ndarray, indexes: np.ndarray) -> np.ndarray:
+    """Sample positions of fractional beat indexes, same as `song._slice` but for arrays"""
+    return np.interp(indexes, np.arange(len(beatmap)), beatmap)
+
+def _beat_lengths(beatmap: np.ndarray, beat, offsets: np.ndarray, length: int, wrap = False):
+    """Lengths of one pattern beat in every loop, and a mask of loops where it exists"""
+    size = len(beatmap)
+    def _wrap(index):
+        # songs used as samples wrap around instead of running out of beats
+        if wrap is True: return np.where(index > size - 1, index - (size - 1) * np.ceil((index - (size - 1)) / (size - 1)), index)
+        return index
+    if isinstance(beat, str):
+        stop = _wrap(_eval(beat, length) + offsets)
+        start = stop - 1
+    else:
+        a, b = _eval(beat[0], length), _eval(beat[1], length)
+        if beat[2] == C_SLICE[0]: start, stop = a + offsets, b + offsets
+        elif beat[2] == C_SLICE[1]: start, stop = a - 1 + offsets, a - 1 + b + offsets
+        else: start, stop = a - b + offsets, a + offsets
+        start, stop = _wrap(start), _wrap(stop)
+    valid = (np.ceil(np.maximum(start, stop)) <= size - 1) & (np.minimum(start, stop) >= 0)
+    lengths = np.abs(_positions(beatmap, np.clip(stop, 0, size - 1)) - _positions(beatmap, np.clip(start, 0, size - 1)))
+    return np.where(valid, lengths, 0), valid & (lengths >= 1)
+
+def _sample_length(sample, fallback: float) -> float:
+    if isinstance(sample, np.ndarray): return sample.shape[-1]
+    if hasattr(sample, 'audio') and sample.audio is not None: return len(sample.audio[0])
+    if isinstance(sample, str):
+        try:
+            import soundfile
+            return soundfile.info(sample).frames
+        except Exception: pass
+    return fallback
+
+def render(beatmap: np.ndarray, parsed: tuple, audio_length: int, effects: dict = None, limit_beats = 10000, limit_length = 52920000) -> dict:
+    """Estimates a render of an already parsed pattern on an already adjusted, shifted and scaled beatmap.
+
+    `parsed` is what `parse.parse` returns. This is what `song.beatswap` calls right before rendering."""
+    from .effects import BM_EFFECTS
+    if effects is None: effects = BM_EFFECTS
+    beats, operators, pattern_length, shuffle_groups, shuffle_beats, c_slice, c_misc, c_join = parsed
+    beatmap = np.asarray(beatmap, dtype=float)
+    loops = int(len(beatmap) // max(pattern_length, 1)) + 2 if pattern_length > 0 else 1
+    offsets = np.arange(loops, dtype=float) * pattern_length
+    average = float(np.median(np.diff(beatmap))) if len(beatmap) > 1 else audio_length
+
+    closed = np.zeros(loops)
+    current = np.zeros(loops)
+    count = np.zeros(loops)
+    processed = np.zeros(loops)
+    for num, b in enumerate(beats):
+        beat = b[3] if len(b) == 4 else b[0]
+        if beat is not None and c_misc[9] in (''.join(beat) if isinstance(beat, list) else beat): continue
+        if len(b) == 4:
+            # song
+            if b[2] == c_misc[11]:
+                song_beatmap = getattr(b[0], 'beatmap', None)
+                if beat is None: lengths, valid = np.full(loops, _sample_length(b[0], average)), np.ones(loops, dtype=bool)
+                elif song_beatmap is None or len(song_beatmap) < 2:
+                    lengths, valid = np.full(loops, average * (1 if isinstance(beat, str) else abs(_eval(beat[1], pattern_length)))), np.ones(loops, dtype=bool)
+                else: lengths, valid = _beat_lengths(np.asarray(song_beatmap, dtype=float), beat, offsets, pattern_length, wrap = True)
+            # sample
+            else:
+                sample_length = _sample_length(b[0], average)
+                fraction = abs(utils._safer_eval(beat[1]) - utils._safer_eval(beat[0])) if isinstance(beat, list) else 1
+                lengths, valid = np.full(loops, sample_length * min(fraction, 1)), np.ones(loops, dtype=bool)
+        else: lengths, valid = _beat_lengths(beatmap, beat, offsets, pattern_length)
+        lengths = lengths * _speed(b[1], effects)
+
+        # how beats are joined decides how much of them ends up in the output
+        processed += np.where(valid, lengths, 0)
+        operator = operators[num]
+        if operator == c_join[0]:
+            closed += np.where(valid, current, 0)
+            current = np.where(valid, lengths, current)
+            count += valid
+        elif operator == c_join[2]: current = np.where(valid, np.maximum(np.minimum(current, lengths) - 1, 0), current)
+        elif operator == c_join[3]: current = np.where(valid, np.maximum(current, lengths), current)
+
+    # first beat of the output is everything before the first beat
+    intro = float(beatmap[0]) if len(beatmap) > 0 else 0
+    per_loop = closed + current
+    cumulative_beats = 1 + np.cumsum(count)
+    cumulative_processed = np.cumsum(processed)
+    truncated = False
+    keep = np.ones(loops, dtype=bool)
+    if limit_beats is not None and cumulative_beats[-1] >= limit_beats:
+        keep &= cumulative_beats < limit_beats
+        truncated = True
+    if limit_length is not None and cumulative_processed[-1] >= limit_length:
+        keep &= cumulative_processed < limit_length
+        truncated = True
+    output_length = int(intro + np.sum(per_loop[keep]))
+    output_beats = int(1 + np.sum(count[keep]))
+    if truncated:
+        # the loop that hits the limit is rendered partially
+        output_beats = min(output_beats + int(count[np.argmin(keep)]), limit_beats if limit_beats is not None else output_beats)
+    return {
+        'beats': output_beats,
+        'length': output_length,
+        'memory': int(output_length * BYTES_PER_SAMPLE + audio_length * 2 * 4),
+        'loops': int(np.sum(keep)),
+        'truncated': truncated,
+    }
+
+def _plain(beatmap: np.ndarray, parsed: tuple, audio: np.ndarray, limit_beats = 10000, limit_length = 52920000) -> dict:
+    """Exact estimate of a pattern of plain beats joined with `,`, like the ones `reverse` and `shuffle` render.
+    Walks the schedule the way `schedule.render` does, including beats that are out of range, without rendering anything."""
+    from . import schedule
+    plan = schedule.build(beatmap, parsed, audio)
+    lengths, valid = (plan.stop - plan.start).tolist(), plan.valid.tolist()
+    beats, total_length, tries, truncated = 1, 0, 0, False
+    for n in range(plan.loops):
+        for num in range(len(lengths[n])):
+            if limit_beats is not None and beats >= limit_beats:
+                truncated = True
+                break
+            if not valid[n][num]:
+                tries += 1
+                if tries > 30: break
+                continue
+            if lengths[n][num] < 1: continue
+            if limit_length is not None and total_length + lengths[n][num] >= limit_length:
+                truncated = True
+                break
+            total_length += lengths[n][num]
+            beats += 1
+        if truncated is True: break
+    output_length = int(plan.intro) + total_length
+    return {'beats': beats, 'length': output_length, 'memory': int(output_length * BYTES_PER_SAMPLE + len(audio[0]) * 2 * 4), 'loops': n + 1, 'truncated': truncated}
+
+def _placeholders(samples: dict, pattern: str, sr: int) -> dict:
+    """Replaces samples that aren't loaded yet with silent arrays of the same length that take no memory, so that parsing doesn't load or analyze anything"""
+    from . import assets
+    songs = {name for name, kind in assets.references(pattern).items() if kind == 'song'}
+    placeholders = {}
+    for name, sample in samples.items():
+        if isinstance(sample, (np.ndarray, main.song)): placeholders[name] = sample
+        else:
+            audio = np.broadcast_to(np.float32(0), (2, max(int(_sample_length(sample, 1)), 1)))
+            if name in songs:
+                placeholder = main.song(audio, sr = sr, log = False)
+                placeholder.beatmap = np.zeros(1, dtype=int)
+                placeholders[name] = placeholder
+            else: placeholders[name] = audio
+    return placeholders
+
+def estimate(song, pattern: str, scale: float = 1, shift: float = 0, length = None, samples: dict = None, effects: dict = None, adjust = 500, limit_beats = 10000, limit_length = 52920000, seed = None) -> dict:
+    """Estimates output beats, length and peak memory of `song.beatswap` with the same arguments, without rendering anything.
+
+    Samples given as paths aren't loaded, their length is read from the file header if possible. Random `@` beats are estimated by their average.
+    If the song has no beatmap yet, it is generated and kept on the song, like `song.beatswap` does.
+    `random` is only estimated with the `seed` it will be rendered with, because the pattern it renders is picked with that seed."""
+    from . import parse
+    from .presets import BM_SAMPLES
+    if samples is None: samples = BM_SAMPLES
+    audio_length = len(song.audio[0])
+    prepared = song._prepare(scale, shift, adjust)
+    beatmap = prepared.beatmap
+    if pattern.lower() in ('reverse', 'shuffle'):
+        # `reverse` renders `prepared[::-1]`, which adds a beat at the start and adjusts again,
+        # `shuffle` renders a pattern of every beat in random order, which `beatswap` adjusts again. Its estimate is for beats in order.
+        # Both render with the default limits.
+        size = len(beatmap)
+        if pattern.lower() == 'reverse': beats, beatmap = range(size - 2, -1, -1), prepared.beatmap_derived(adjust = 500, start = True)
+        else: beats, beatmap = range(size), prepared.beatmap_derived(adjust = 500)
+        parsed = parse.parse(pattern = ','.join(str(i) for i in beats), samples = {}, log = False, sr = song.sr)
+        return _plain(beatmap, parsed, song.audio)
+    if pattern.lower() == 'test':
+        # rendered like `shuffle`, by beatswapping the prepared song with default limits
+        pattern = '1;"cowbell"s3v2, 2;"cowbell"s2, 3;"cowbell", 4;"cowbell"s0.5, 5;"cowbell"s0.25, 6;"cowbell"s0.4, 7;"cowbell"s0.8, 8;"cowbell"s1.6'
+        beatmap, limit_beats, limit_length = prepared.beatmap_derived(adjust = 500), 10000, 52920000
+    elif pattern.lower() == 'random':
+        if seed is None: raise ValueError('`random` picks a different pattern every time it renders, so it can only be estimated with the `seed` it will be rendered with')
+        import random
+        pattern = parse.random_pattern(random.Random(seed))[0]
+    if isinstance(samples, str): samples = (samples,)
+    if not isinstance(samples, dict): samples = {str(i+1):samples[i] for i in range(len(samples))}
+    parsed = parse.parse(pattern = pattern, samples = _placeholders(samples, pattern, song.sr), pattern_length = length, log = False)
+    return render(beatmap, parsed, audio_length, effects = effects, limit_beats = limit_beats, limit_length = limit_length)
+
+def check(estimate: dict, budget: dict, sr: int = None):
+    """Raises `BudgetExceeded` if estimate is over any limit in `budget` - `beats`, `length` (samples), `seconds` or `memory` (bytes)"""
+    if budget is None: return
+    limits = dict(budget)
+    if 'seconds' in limits:
+        assert sr is not None, 'budget in seconds needs a samplerate'
+        seconds = limits.pop('seconds')
+        limits['length'] = min(limits.get('length', np.inf), seconds * sr)
+    for key, limit in limits.items():
+        assert key in estimate, f'Unknown budget `{key}`, budget can have `beats`, `length`, `seconds` and `memory`'
+        if limit is not None and estimate[key] > limit:
+            raise BudgetExceeded(f'Estimated {key} = {estimate[key]} is over the budget of {limit}', estimate)
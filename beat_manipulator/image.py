@@ -1,14 +1,27 @@
-from . import io, main
+from . import io, main, spectrum, cancel
 import numpy as np
-def generate(song, beatmap = None, mode='median', sr = None, log = True):
+def generate(song, beatmap = None, mode='median', sr = None, log = True, spectral = False, bands = 256, hop = 512):
+    """Image with a row for every beat. `spectral = True` makes rows the average spectrum of each beat in `bands` log-spaced bands instead of the waveform,
+    from the song's cached spectrogram, `mode` is only used for waveform images."""
     if log is True: print(f'Generating an image from beats...', end = ' ')
+    original = song
     song = main.song(song, sr=sr)
     if song.beatmap is None: song.beatmap = beatmap
     if song.beatmap is None: song.beatmap_generate()
+    if spectral is True:
+        # spectrogram of the song that was passed in, so that it is cached on it
+        if not isinstance(original, main.song) or original.sr != song.sr: original = song
+        image = spectrum.get(original, hop = hop).beats(np.asarray(song.beatmap), bands = bands)
+        image = np.log1p(image)
+        image /= max(float(np.max(image)), 1e-9)
+        if log is True: print('Done!')
+        return image
+    token = cancel.current()
     if isinstance(song.audio, np.ndarray): song.audio = song.audio.tolist()
     # create the image
     image = [[],[]]
     for i in range(1, len(song.beatmap)):
+        if token is not None and i % 256 == 0: token.check('image', i, len(song.beatmap) - 1)
         beat = song[i]
         image[0].append(beat[0])
         image[1].append(beat[1])
@@ -25,6 +38,7 @@ def generate(song, beatmap = None, mode='median', sr = None, log = True):
 
     # fill or crop rows:
     for i in range(len(image[0])):
+        if token is not None and i % 256 == 0: token.check('image', i, len(image[0]))
         difference = lengths[i] - width
         if difference<0:
             image[0][i].extend([np.nan]*(-difference))
@@ -67,4 +81,6 @@ def write(image, output, mode = 'r', max_size = 4096, rotate = True, contrast=1)
     image = image*(255*contrast)
     image = cv2.resize(src=image, dsize=(w, h), interpolation = cv2.INTER_NEAREST)
     if rotate is True: image = np.rot90(image)
+    from . import utils
+    utils._makedirs(output)
     cv2.imwrite(output, image)
@@ -0,0 +1,117 @@
+"""Stage timings and counters from the analysis and render pipeline.
+
+Usage:
+```
+with bm.instrument.record() as stats:
+    song.beatswap('1, 3, 2, 4')
+print(stats.stages) # {'parse': 0.0002, 'render': 0.08, 'smoothing': 0.01, 'concatenate': 0.05}
+print(stats.counters) # {'beats_rendered': 40, 'samples_produced': 441000, ...}
+```
+or `bm.instrument.add_callback(function)`, where function gets called as `function(event, name, value)` -
+event is `start` when a stage starts (value is None), `stage` when it ends (value is duration in seconds), or `count` (value is the increment).
+
+Callbacks get events from every thread. `record()` only gets events from its own thread (or asyncio task),
+and from thread pools that pass `current()` on to their threads with `scope`, so concurrent `record()` blocks don't see each other's stages.
+
+When nothing is recording, every hook is a check of an empty tuple and a context variable."""
+import contextvars, time, threading
+
+_callbacks = () # replaced, never changed in place, so emitting doesn't need the lock
+_lock = threading.Lock()
+_recorders = contextvars.ContextVar('recorders', default = ())
+
+def enabled() -> bool:
+    return len(_callbacks) > 0 or len(_recorders.get()) > 0
+
+def _emit(event, name, value):
+    for listener in _callbacks + _recorders.get(): listener(event, name, value)
+
+def count(name: str, n = 1):
+    """Increments counter `name` by `n`"""
+    if _callbacks or _recorders.get(): _emit('count', name, n)
+
+def start(name: str):
+    """Starts timing stage `name`, returns a token for `stop`. For stages where a `with` block doesn't fit."""
+    if not (_callbacks or _recorders.get()): return None
+    _emit('start', name, None)
+    return (name, time.perf_counter())
+
+def stop(token):
+    if token is None or not (_callbacks or _recorders.get()): return
+    _emit('stage', token[0], time.perf_counter() - token[1])
+
+class _stage:
+    __slots__ = ('name', 'token')
+    def __init__(self, name): self.name = name
+    def __enter__(self):
+        self.token = start(self.name)
+        return self
+    def __exit__(self, *args): stop(self.token)
+
+class _nothing:
+    def __enter__(self): return self
+    def __exit__(self, *args): pass
+_NOTHING = _nothing()
+
+def stage(name: str):
+    """Context manager that times stage `name`"""
+    return _stage(name) if _callbacks or _recorders.get() else _NOTHING
+
+def add_callback(function):
+    """Calls `function(event, name, value)` on every stage start, stage end and counter increment, from whatever thread it happened in."""
+    global _callbacks
+    with _lock: _callbacks = _callbacks + (function,)
+    return function
+
+def remove_callback(function):
+    global _callbacks
+    with _lock: _callbacks = tuple(i for i in _callbacks if i is not function)
+
+def current() -> tuple:
+    """Recorders of this thread, to pass on to other threads with `scope`"""
+    return _recorders.get()
+
+class scope:
+    """Makes `recorders` the recorders of this thread inside a `with` block. Thread pools pass `current()` on to their threads this way."""
+    def __init__(self, recorders: tuple):
+        self.recorders = recorders
+
+    def __enter__(self):
+        self._token = _recorders.set(self.recorders)
+        return self.recorders
+
+    def __exit__(self, *args):
+        _recorders.reset(self._token)
+
+class recorder:
+    """Accumulates total duration and number of calls of each stage, and totals of each counter. Thread safe."""
+    def __init__(self):
+        self.stages = {}
+        self.calls = {}
+        self.counters = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, event, name, value):
+        if event == 'start': return
+        with self._lock:
+            if event == 'stage':
+                self.stages[name] = self.stages.get(name, 0) + value
+                self.calls[name] = self.calls.get(name, 0) + 1
+            elif event == 'count':
+                self.counters[name] = self.counters.get(name, 0) + value
+
+    def __enter__(self):
+        self._token = _recorders.set(_recorders.get() + (self,))
+        return self
+
+    def __exit__(self, *args):
+        _recorders.reset(self._token)
+
+    def summary(self) -> str:
+        lines = [f'{name}: {duration:.4f}s' + (f' ({self.calls[name]} calls)' if self.calls[name] > 1 else '') for name, duration in self.stages.items()]
+        lines += [f'{name}: {value}' for name, value in self.counters.items()]
+        return '\n'.join(lines)
+
+def record() -> recorder:
+    """`with record() as stats:` records everything that happens inside the block, in this thread and in threads it passes `current()` to, into `stats.stages`, `stats.calls` and `stats.counters`"""
+    return recorder()
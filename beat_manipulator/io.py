@@ -1,6 +1,6 @@
 
 import numpy as np
-from . import main
+from . import main, instrument, utils
 
 def open_audio(path:str = None, lib:str = 'auto', normalize = True) -> tuple:
     """Opens audio from path, returns (audio, samplerate) tuple.
@@ -21,6 +21,8 @@ def open_audio(path:str = None, lib:str = 'auto', normalize = True) -> tuple:
     
     path=path.replace('\\', '/')
 
+    # `auto` calls this with each lib, those calls are the ones that get timed
+    timer = instrument.start('decode') if lib != 'auto' else None
     if lib=='pedalboard.io':
         import pedalboard.io
         with pedalboard.io.AudioFile(path) as f:
@@ -61,36 +63,34 @@ def open_audio(path:str = None, lib:str = 'auto', normalize = True) -> tuple:
     if normalize is True: 
         audio = np.clip(audio, -1, 1)
         audio = audio*(1/np.max(np.abs(audio)))
-    return audio.astype(np.float32),sr
+    audio = audio.astype(np.float32)
+    if timer is not None:
+        instrument.stop(timer)
+        instrument.count('samples_decoded', len(audio[0]))
+    return audio,sr
     
 def _sr(sr):
     try: return int(sr)
     except (ValueError, TypeError): assert False, f"Audio is an array, but `sr` argument is not valid. If audio is an array, you have to provide samplerate as an integer in the `sr` argument. Currently sr = {sr} of type {type(sr)}"
 
-def write_audio(audio:np.ndarray, sr:int, output:str, lib:str='auto', libs=('pedalboard.io', 'soundfile'), log = True):
-        """"writes audio to path specified by output. Path should end with file extension, for example `folder/audio.mp3`"""
+def _resample(audio: np.ndarray, sr: int, target_sr: int) -> np.ndarray:
+    """Resamples audio along the last axis, float32. Returns `audio` as it is if `target_sr` is None or the same."""
+    if target_sr is None or sr is None or int(sr) == int(target_sr): return audio
+    import math, scipy.signal
+    gcd = math.gcd(int(sr), int(target_sr))
+    return scipy.signal.resample_poly(np.asarray(audio, dtype = np.float32), int(target_sr) // gcd, int(sr) // gcd, axis = -1).astype(np.float32)
+
+def write_audio(audio:np.ndarray, sr:int, output:str, lib:str='auto', libs=None, log = True):
+        """"writes audio to path specified by output. Path should end with file extension, for example `folder/audio.mp3`
+
+        `lib = 'auto'` uses the library that `writer.backend` picked for that format, `libs` - libraries to pick from instead of `writer.BACKENDS`."""
+        from . import writer
         if log is True: print(f'Writing {output}...', end=' ')
         assert _iterable(audio), f"audio should be an array/iterable object, but it is {type(audio)}"
         sr = _sr(sr)
         if not isinstance(audio, np.ndarray): audio = np.array(audio, copy=False)
-        if lib=='pedalboard.io':
-            #print(audio)
-            import pedalboard.io
-            with pedalboard.io.AudioFile(output, 'w', sr, audio.shape[0]) as f:
-                f.write(audio)
-        elif lib=='soundfile':
-            audio=audio.T
-            import soundfile
-            soundfile.write(output, audio, sr)
-            del audio
-        elif lib=='auto':
-            for i in libs:
-                try: 
-                    write_audio(audio=audio, sr=sr, output=output, lib=i, log = False)
-                    break
-                except Exception as e:
-                    print(e)
-            else: assert False, 'Failed to write audio, chances are there is something wrong with it...'
+        if lib == 'auto': writer.encode(audio, sr, output, libs = libs)
+        else: writer._write(lib, audio, sr, output, writer.pcm16(audio) if writer._format(output) in writer.PCM16_FORMATS else None)
         if log is True: print(f'Done!')
 
 def _iterable(a):
@@ -0,0 +1,165 @@
+"""Runs jobs in a bounded thread pool, with a queue limit, progress of each job, and deduplication of jobs with the same key.
+
+```
+executor = bm.jobs.executor(workers = 2, max_queue = 16)
+job = executor.submit(analyze, upload, key = ('analysis', upload_hash))
+while not job.done(): print(job.progress())
+result = job.wait()
+```
+Progress comes from `instrument` stages that the job goes through (`decode`, `analysis`, `beat_detection`, `render`...), so anything the job calls is reported without passing anything around.
+Submitting a job with the same key as a queued, running or recently finished job returns that job instead of running it again.
+
+Every job runs with its own `cancel.token`: `job.cancel()` stops it at the next check, or before it starts if it is still queued,
+and `executor.submit(..., deadline = 30)` stops it 30 seconds after it was submitted. Cancelled jobs have status `cancelled`,
+`progress()` shows how far they got, and they are not remembered for deduplication."""
+import threading, time, itertools
+from . import instrument, utils, cancel
+
+class QueueFull(RuntimeError):
+    """Raised by `executor.submit` when there are already `max_queue` jobs waiting or running"""
+
+_current = threading.local()
+_ids = itertools.count(1)
+_executors = [] # progress callback is registered while any executor exists
+
+class job:
+    """One submitted function. `status` is `queued`, `running`, `done`, `failed` or `cancelled`, `stage` is the stage it is in right now."""
+    def __init__(self, function, args, kwargs, key = None, deadline: float = None):
+        self.id = next(_ids)
+        self.key = key
+        self.function, self.args, self.kwargs = function, args, kwargs
+        self.status = 'queued'
+        self.stage = None
+        self.stages = [] # (name, duration) of finished stages
+        self.counters = {}
+        self.result = None
+        self.error = None
+        self.submitted = time.perf_counter()
+        self.started = None
+        self.finished = None
+        self.token = cancel.token(deadline)
+        # `instrument.record()` around `submit` also records the job
+        self.recorders = instrument.current()
+        self._event = threading.Event()
+
+    def _run(self):
+        self.status = 'running'
+        self.started = time.perf_counter()
+        _current.job = self
+        try:
+            with cancel.scope(self.token), instrument.scope(self.recorders):
+                # a job that was cancelled or ran out of time while it was queued doesn't start
+                self.token.check()
+                self.result = self.function(*self.args, **self.kwargs)
+            self.status = 'done'
+        except cancel.Cancelled as e:
+            # whatever the job made so far is freed now, not when the job is forgotten
+            cancel.release(e)
+            self.error = e
+            self.status = 'cancelled'
+        except Exception as e:
+            self.error = e
+            self.status = 'failed'
+        finally:
+            _current.job = None
+            self.stage = None
+            self.finished = time.perf_counter()
+            self._event.set()
+
+    def done(self) -> bool:
+        return self._event.is_set()
+
+    def cancel(self, reason: str = 'cancelled'):
+        """Stops the job at its next check, or before it starts. A job that already finished is not changed."""
+        self.token.cancel(reason)
+
+    def wait(self, timeout: float = None):
+        """Waits for the job and returns its result, raises its exception if it failed, or TimeoutError"""
+        if not self._event.wait(timeout): raise TimeoutError(f'job {self.id} is still {self.status} after {timeout} seconds')
+        if self.error is not None: raise self.error
+        return self.result
+
+    def progress(self) -> dict:
+        now = time.perf_counter()
+        return {'id': self.id, 'status': self.status, 'stage': self.stage, 'stages': list(self.stages), 'counters': dict(self.counters),
+                'waited': (self.started or now) - self.submitted, 'elapsed': ((self.finished or now) - self.started) if self.started is not None else 0,
+                'done': self.token.done, 'total': self.token.total, 'remaining': self.token.remaining()}
+
+def _progress(event, name, value):
+    j = getattr(_current, 'job', None)
+    if j is None: return
+    if event == 'start': j.stage = name
+    elif event == 'stage': j.stages.append((name, value))
+    elif event == 'count': j.counters[name] = j.counters.get(name, 0) + value
+
+class executor:
+    """`workers` threads run jobs, at most `max_queue` jobs can be queued or running at once, and `keep` finished jobs with keys are remembered for deduplication.
+
+    Threads share memory, so jobs can share songs and results; numpy and madmom release the GIL for most of the heavy work."""
+    def __init__(self, workers: int = 2, max_queue: int = 16, keep: int = 64):
+        from concurrent.futures import ThreadPoolExecutor
+        self.workers = workers
+        self.max_queue = max_queue
+        self._pool = ThreadPoolExecutor(max_workers = workers, thread_name_prefix = 'beat_manipulator')
+        self._lock = threading.Lock()
+        self._active = {} # id: job
+        self._keys = {} # key: active job
+        self._finished = utils._lru(keep) # key: finished job
+        self.submitted = 0
+        self.deduplicated = 0
+        self.rejected = 0
+        if len(_executors) == 0: instrument.add_callback(_progress)
+        _executors.append(self)
+
+    def submit(self, function, *args, key = None, deadline: float = None, **kwargs) -> job:
+        """Queues `function(*args, **kwargs)`. If `key` is not None and a job with that key is active or finished successfully, returns that job.
+        `deadline` - seconds from now after which the job is cancelled."""
+        with self._lock:
+            if key is not None:
+                existing = self._keys.get(key)
+                if existing is None: existing = self._finished.get(key)
+                if existing is not None:
+                    self.deduplicated += 1
+                    return existing
+            if self.max_queue is not None and len(self._active) >= self.max_queue:
+                self.rejected += 1
+                raise QueueFull(f'{len(self._active)} jobs are already queued or running, the limit is {self.max_queue}')
+            j = job(function, args, kwargs, key = key, deadline = deadline)
+            self._active[j.id] = j
+            if key is not None: self._keys[key] = j
+            self.submitted += 1
+        self._pool.submit(self._run, j)
+        return j
+
+    def _run(self, j: job):
+        j._run()
+        with self._lock:
+            self._active.pop(j.id, None)
+            if j.key is not None:
+                if self._keys.get(j.key) is j: del self._keys[j.key]
+                # failed jobs are forgotten, so that submitting them again retries
+                if j.status == 'done': self._finished.set(j.key, j)
+
+    def get(self, key):
+        """Active or finished job with `key`, or None"""
+        with self._lock:
+            return self._keys.get(key) or self._finished.get(key)
+
+    def queued(self) -> int:
+        return sum(1 for j in list(self._active.values()) if j.status == 'queued')
+
+    def running(self) -> int:
+        return sum(1 for j in list(self._active.values()) if j.status == 'running')
+
+    def stats(self) -> dict:
+        return {'workers': self.workers, 'max_queue': self.max_queue, 'queued': self.queued(), 'running': self.running(),
+                'submitted': self.submitted, 'deduplicated': self.deduplicated, 'rejected': self.rejected, 'finished': len(self._finished)}
+
+    def shutdown(self, wait = True):
+        self._pool.shutdown(wait = wait)
+        if self in _executors:
+            _executors.remove(self)
+            if len(_executors) == 0: instrument.remove_callback(_progress)
+
+    def __enter__(self): return self
+    def __exit__(self, *args): self.shutdown()
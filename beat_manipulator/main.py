@@ -1,10 +1,9 @@
-import numpy as np, scipy.interpolate
-from . import io, utils
+import numpy as np
+from . import io, utils, instrument
 from .effects import BM_EFFECTS
 from .metrics import BM_METRICS
 from .presets import BM_SAMPLES
 import os
-if not os.path.isdir('output'):os.mkdir('output')
 
 class song:
     def __init__(self, audio = None, sr:int=None, log=True):
@@ -65,10 +64,8 @@ class song:
                 while ((i > end) if is_reversed else (i < end)):
                     pattern+=f'{i},'
                     i+=step
-                song_copy = song(audio = self.audio, sr = self.sr, log = False)
-                song_copy.beatmap = self.beatmap.copy()
-                song_copy.beatmap = np.insert(song_copy.beatmap, 0, 0)
-                result = song_copy.beatswap(pattern = pattern, return_audio = True)
+                from . import parse
+                result = self._prepare(start = True)._render(parse.parse(pattern = pattern, samples = {}, log = False, sr = self.sr))
                 return result if isinstance(self.audio, np.ndarray) else result.tolist()
                 
 
@@ -115,20 +112,37 @@ class song:
         if self.log: print(*args, end=end, sep=sep)
 
 
-    def write(self, output='', ext='mp3', suffix=' (beatswap)', literal_output=False):
-        """writes"""
+    def write(self, output='', ext='mp3', suffix=' (beatswap)', literal_output=False, caching = True):
+        """writes. With `caching`, the same audio is encoded once and copied from `cache` after that."""
         if literal_output is False: output = io._outputfilename(output, filename=self.path, suffix=suffix, ext=ext)
+        if caching is True:
+            from . import cache
+            if cache.fetch(cache.digest(self), output) is not None:
+                self._print(f'Copied {output} from cache')
+                return output
         io.write_audio(audio=self.audio, sr=self.sr, output=output, log=self.log)
+        if caching is True: cache.put(cache.digest(self), output)
         return output
 
 
-    def beatmap_generate(self, lib='madmom.BeatDetectionProcessor', caching = True, load_settings = True):
-        """Find beat positions"""
+    def analysis_proxy(self):
+        """Mono float32 audio at the samplerate beat detection uses. Made once and reused until audio changes."""
+        import weakref
         from . import beatmap
-        self.beatmap = beatmap.generate(audio = self.audio, sr = self.sr, lib=lib, caching=caching, filename = self.path, log = self.log, load_settings = load_settings)
+        cached = getattr(self, '_analysis_proxy', None)
+        if cached is None or cached[0]() is not self.audio:
+            cached = (weakref.ref(self.audio), beatmap.proxy(self.audio, self.sr))
+            self._analysis_proxy = cached
+        return cached[1]
+
+    def beatmap_generate(self, lib='madmom.BeatDetectionProcessor', caching = True, load_settings = True, split = None, workers = None, profile = 'full'):
+        """Find beat positions. `split` analyzes audio in windows of that many seconds in parallel, for very long audio. `profile = 'fast'` is quicker and less accurate."""
+        from . import beatmap
+        self.beatmap = beatmap.generate(audio = self.audio, sr = self.sr, lib=lib, caching=caching, filename = self.path, log = self.log, load_settings = load_settings, split = split, workers = workers,
+                                        profile = profile, analysis_proxy = self.analysis_proxy)
         if load_settings is True:
             audio_id=hex(len(self.audio[0]))
-            settingsDir="beat_manipulator/beatmaps/" + ''.join(self.path.split('/')[-1]) + "_"+lib+"_"+audio_id+'_settings.txt'
+            settingsDir=beatmap._cache_path(self.path, lib, audio_id, '_settings')
             if os.path.exists(settingsDir):
                 with open(settingsDir, 'r') as f:
                     settings = f.read().split(',')
@@ -144,6 +158,48 @@ class song:
         from . import beatmap
         self.beatmap = beatmap.shift(beatmap = self.beatmap, shift = shift, log = self.log, mode = mode)
 
+    def beatmap_derived(self, scale: float = 1, shift: float = 0, adjust: int = None, start = False) -> np.ndarray:
+        """`self.beatmap` adjusted, shifted and scaled, without changing it. `adjust = None` doesn't adjust, `start = True` adds a beat at 0 before adjusting.
+
+        The last few derived beatmaps are kept until `self.beatmap` or the audio length changes. They are shared, so they are read-only.
+        `self.beatmap` can also be a `tempogrid`, derived beatmaps are always arrays."""
+        if self.beatmap is None: self.beatmap_generate()
+        cached = self.__dict__.get('_derived')
+        if cached is None or cached[2] != len(self.audio[0]) or not self._same_beatmap(cached[0], cached[1]):
+            from . import tempogrid
+            # beatmaps are derived from a read-only copy, so `self.beatmap` can still be changed in place
+            if isinstance(self.beatmap, tempogrid.tempogrid): base = tempogrid.tempogrid(*(np.array(getattr(self.beatmap, i)) for i in tempogrid.ARRAYS), self.beatmap.step, self.beatmap.offset)
+            else:
+                base = np.array(self.beatmap)
+                base.setflags(write = False)
+            cached = (self.beatmap, base, len(self.audio[0]), utils._lru(8))
+            self._derived = cached
+        key = (float(utils._safer_eval(scale)), float(utils._safer_eval(shift)), adjust, start)
+        return cached[3].get_or_set(key, lambda: self._derive(cached[1], *key))
+
+    def _same_beatmap(self, source, base) -> bool:
+        """Whether `self.beatmap` is still the beatmap that `base` was copied from, and wasn't changed since"""
+        if source is not self.beatmap: return False
+        from . import tempogrid
+        if isinstance(base, tempogrid.tempogrid): return (base.step, base.offset) == (source.step, source.offset) and all(np.array_equal(getattr(base, i), getattr(source, i)) for i in tempogrid.ARRAYS)
+        return np.array_equal(base, source)
+
+    def _derive(self, base, scale: float, shift: float, adjust: int, start: bool) -> np.ndarray:
+        from . import beatmap, tempogrid
+        result = base
+        if isinstance(result, tempogrid.tempogrid):
+            # a grid is shifted and scaled without rebuilding it, and turned into an array at the end
+            if start is False and adjust is None:
+                result = beatmap.scale(beatmap.shift(result, shift, log = self.log), scale, log = self.log).array()
+                result.setflags(write = False)
+                return result
+            result = result.array()
+        if start is True: result = np.insert(result, 0, 0)
+        if adjust is not None: result = np.append(np.sort(np.absolute(result - adjust)), len(self.audio[0]))
+        result = beatmap.scale(beatmap.shift(result, shift, log = self.log), scale, log = self.log)
+        if isinstance(result, np.ndarray): result.setflags(write = False)
+        return result
+
     def beatmap_reset(self):
         self.beatmap = self.beatmap_default.copy()
 
@@ -156,94 +212,96 @@ class song:
         beatmap.save_settings(audio = self.audio, filename = self.path, scale = scale, shift = shift,adjust = adjust, normalized = normalized, log=self.log, overwrite=overwrite, lib = self.lib)
 
     def beatswap(self, pattern = '1;"cowbell"s3v2, 2;"cowbell"s2, 3;"cowbell", 4;"cowbell"s0.5, 5;"cowbell"s0.25, 6;"cowbell"s0.4, 7;"cowbell"s0.8, 8;"cowbell"s1.6', 
-        scale:float = 1, shift:float = 0, length = None, samples:dict = BM_SAMPLES, effects:dict = BM_EFFECTS, metrics:dict = BM_METRICS, smoothing: int = 100, adjust=500, return_audio = False, normalize = False, limit_beats=10000, limit_length = 52920000):
-        
+        scale:float = 1, shift:float = 0, length = None, samples:dict = BM_SAMPLES, effects:dict = BM_EFFECTS, metrics:dict = BM_METRICS, smoothing: int = 100, adjust=500, return_audio = False, normalize = False, limit_beats=10000, limit_length = 52920000, budget: dict = None, workers: int = None, seed = None):
+        """`pattern` can also be a tuple returned by `parse.parse`.
+
+        `seed` - seed for `random`, `shuffle`, `@` and `#`, so that the render can be reproduced. Without it the global `random` is used, so `random.seed` works too.
+
+        `workers` - threads that render ranges of pattern loops at once, the result is the same for any number of workers.
+
+        `budget` - dict with any of `beats`, `length` (samples), `seconds` and `memory` (bytes). The render is estimated before it starts, and if it would go over the budget, `estimate.BudgetExceeded` is raised without rendering anything."""
         if normalize is True:
             self.normalize_beats()
         if self.beatmap is None: self.beatmap_generate()
-        beatmap_default = self.beatmap.copy()
-        self.beatmap = np.append(np.sort(np.absolute(self.beatmap - adjust)), len(self.audio[0]))
-        self.beatmap_shift(shift)
-        self.beatmap_scale(scale)
-
+        # shallow copy with the adjusted, shifted and scaled beatmap, `self` is not changed until the result is ready
+        prepared = self._prepare(scale, shift, adjust)
+        prepared.log = self.log
+        import random
+        rng = random.Random(seed) if seed is not None else None
+
+        parsed = None
+        # pattern that was already parsed by `parse.parse`, so that it can be reused between renders
+        if isinstance(pattern, tuple): parsed = pattern
         # baked in presets
         #reverse
-        if pattern.lower() == 'reverse':
-            if return_audio is False:
-                self.audio = self[::-1]
-                self.beatmap = beatmap_default.copy()
-                return
-            else:
-                result = self[::-1]
-                self.beatmap = beatmap_default.copy()
-                return result
+        elif pattern.lower() == 'reverse':
+            if budget is not None:
+                from . import estimate
+                estimate.check(estimate.estimate(self, 'reverse', scale, shift, adjust = adjust), budget, self.sr)
+            result = prepared[::-1]
+            if return_audio is False: self.audio = result
+            else: return result
+            return
         # shuffle
         elif pattern.lower() == 'shuffle':
-            import random
-            beats = list(range(len(self.beatmap)))
-            random.shuffle(beats)
+            beats = list(range(len(prepared.beatmap)))
+            (rng or random).shuffle(beats)
             beats = ','.join(list(str(i) for i in beats))
-            if return_audio is False:
-                self.beatswap(beats)
-                self.beatmap = beatmap_default.copy()
-                return
-            else:
-                result = self.beatswap(beats, return_audio = True)
-                self.beatmap = beatmap_default.copy()
-                return result
+            result = prepared.beatswap(beats, return_audio = True, budget = budget, workers = workers, seed = seed)
+            if return_audio is False: self.audio = result
+            else: return result
+            return
         # test
         elif pattern.lower() == 'test':
-            if return_audio is False:
-                self.beatswap('1;"cowbell"s3v2, 2;"cowbell"s2, 3;"cowbell", 4;"cowbell"s0.5, 5;"cowbell"s0.25, 6;"cowbell"s0.4, 7;"cowbell"s0.8, 8;"cowbell"s1.6')
-                self.beatmap = beatmap_default.copy()
-                return
-            else:
-                result = self.beatswap('1;"cowbell"s3v2, 2;"cowbell"s2, 3;"cowbell", 4;"cowbell"s0.5, 5;"cowbell"s0.25, 6;"cowbell"s0.4, 7;"cowbell"s0.8, 8;"cowbell"s1.6', return_audio = True)
-                self.beatmap = beatmap_default.copy()
-                return result
-        # random
+            result = prepared.beatswap('1;"cowbell"s3v2, 2;"cowbell"s2, 3;"cowbell", 4;"cowbell"s0.5, 5;"cowbell"s0.25, 6;"cowbell"s0.4, 7;"cowbell"s0.8, 8;"cowbell"s1.6', return_audio = True, budget = budget, seed = seed)
+            if return_audio is False: self.audio = result
+            else: return result
+            return
+        # random, checked against the budget after it is picked, like `estimate` with the same seed
         elif pattern.lower() == 'random':
-            import random,math
-            pattern = ''
-            rand_length=0
-            limit = 10000
-            while True:
-                limit -= 1
-                rand_num = int(math.floor(random.triangular(1, 16, rand_length-1)))
-                if random.uniform(0, rand_num)>rand_length: rand_num = rand_length+1
-                rand_slice = random.choices(['','>0.5','>0.25', '<0.5', '<0.25', '<1/3', '<2/3', '>1/3', '>2/3', '<0.75', '>0.75', 
-                                             f'>{random.uniform(0.01,2)}', f'<{random.uniform(0.01,2)}'], weights = [13,1,1,1,1,1,1,1,1,1,1,1,1], k=1)[0]
-                
-                rand_effect = random.choices(['', 's0.5', 's2', f's{random.triangular(0.1,1,4)}', 'r','v0.5', 'v2', 'v0', 
-                                              f'd{int(random.triangular(1,8,16))}', 'g', 'c', 'c0', 'c1', f'b{int(random.triangular(1,8,4))}'], 
-                                              weights=[30, 2, 2, 2, 2, 1, 1, 2, 2, 1, 2, 2, 2, 1], k=1)[0]
-                
-                rand_join = random.choices([', ', ';'], weights = [5, 1], k=1)[0]
-                pattern += f'{rand_num}{rand_slice}{rand_effect}{rand_join}'
-                if rand_join == ',': rand_length+=1
-                if rand_length in [4, 8, 16]: 
-                    if random.uniform(rand_num,16)>14: break
-                else: 
-                    if random.uniform(rand_num,16)>15.5: break
-                if limit <= 0: break
-            pattern_length = 4
-            if rand_length > 6: pattern_length = 8
-            if rand_length > 12: pattern_length = 16
-            if rand_length > 24: pattern_length = 32
-
-
-
-        
+            from . import parse
+            pattern = parse.random_pattern(rng)[0]
+
+        from . import parse, assets
+        if parsed is None: parsed = parse.parse(pattern = pattern, samples = assets.resolve(pattern, samples, self.sr), pattern_length = length, log = self.log, sr = self.sr)
+
+        # checks that the render fits into the budget before doing any work
+        if budget is not None:
+            from . import estimate
+            estimate.check(estimate.render(prepared.beatmap, parsed, len(self.audio[0]), effects = effects, limit_beats = limit_beats, limit_length = limit_length), budget, self.sr)
+
+        result = prepared._render(parsed, effects = effects, metrics = metrics, smoothing = smoothing, limit_beats = limit_beats, limit_length = limit_length, rng = rng, workers = workers)
+        if return_audio is False: self.audio = result
+        else: return result
+
+    def _render(self, parsed: tuple, effects: dict = BM_EFFECTS, metrics: dict = BM_METRICS, smoothing: int = 100, limit_beats = 10000, limit_length = 52920000, rng = None, workers: int = None) -> np.ndarray:
+        """Renders a pattern from `parse.parse` on `self.beatmap`, which is already adjusted, shifted and scaled. Doesn't change the song,
+        so several renders can run at once on shallow copies. `rng` is a `random.Random` for `@` and `#`, `workers` - threads for `schedule.render`.
+
+        Uses `schedule` when the pattern allows it, and `_render_reference` otherwise."""
+        from . import schedule
+        plan = schedule.build(self.beatmap, parsed, self.audio, rng = rng)
+        if plan is None: return self._render_reference(parsed, effects = effects, metrics = metrics, smoothing = smoothing, limit_beats = limit_beats, limit_length = limit_length, rng = rng)
+        result = schedule.render(plan, effects = effects, smoothing = smoothing, limit_beats = limit_beats, limit_length = limit_length, workers = workers)
+        instrument.count('samples_produced', result.shape[-1])
+        return result
+
+    def _render_reference(self, parsed: tuple, effects: dict = BM_EFFECTS, metrics: dict = BM_METRICS, smoothing: int = 100, limit_beats = 10000, limit_length = 52920000, rng = None) -> np.ndarray:
+        """Renders beat by beat. Used for patterns that `schedule` can't render, and as the reference for what it renders."""
         from . import parse
-        pattern, operators, pattern_length, shuffle_groups, shuffle_beats, c_slice, c_misc, c_join = parse.parse(pattern = pattern, samples = samples, pattern_length = length, log = self.log)
-        
+        pattern, operators, pattern_length, shuffle_groups, shuffle_beats, c_slice, c_misc, c_join = parsed
+
         #print(f'pattern length = {pattern_length}')
 
         # beatswap
+        from . import cancel
+        token = cancel.current()
+        timer = instrument.start('render')
         n=-1
         tries = 0
         metric = None
-        result=[self.audio[:,:self.beatmap[0]]]
+        result=[self.audio[:,:self.beatmap[0]].copy()] # copied, smoothing and `;` joins modify beats in place
+        allocations = 0
         #for i in pattern: print(i)
 
 
@@ -255,10 +313,11 @@ class song:
             n+=1
 
             if stop is True: break
+            if token is not None: token.check('render', n, int(len(self.beatmap) // max(pattern_length, 1)) + 1)
 
             # Every time pattern loops, shuffles beats with #
             if len(shuffle_beats) > 0:
-                pattern = parse._shuffle(pattern, shuffle_beats, shuffle_groups)
+                pattern = parse._shuffle(pattern, shuffle_beats, shuffle_groups, rng = rng)
 
             # Loops over all beats in pattern
             for num, b in enumerate(pattern):
@@ -281,13 +340,13 @@ class song:
                     audio = b[0]
 
                     # Audio is a song
-                    if b[2] == c_misc[10]:
+                    if b[2] == c_misc[11]:
                         try:
 
                             # Song slice is a single beat, takes it
                             if isinstance(beat, str):
                                 # random beat if `@` in beat (`_` is separator)
-                                if c_misc[4] in beat: beat = parse._random(beat, rchar = c_misc[4], schar = c_misc[5], length = pattern_length)
+                                if c_misc[4] in beat: beat = parse._random(beat, rchar = c_misc[4], schar = c_misc[5], length = pattern_length, rng = rng)
                                 beat = utils._safer_eval(beat) + pattern_length*n
                                 while beat > len(audio.beatmap)-1: beat = 1 + beat - len(audio.beatmap)
                                 beat = audio[beat]
@@ -296,7 +355,7 @@ class song:
                             elif isinstance(beat, list):
                                 beat = beat.copy()
                                 for i in range(len(beat)-1): # no separator
-                                    if c_misc[4] in beat[i]: beat[i] = parse._random(beat[i], rchar = c_misc[4], schar = c_misc[5], length = pattern_length)
+                                    if c_misc[4] in beat[i]: beat[i] = parse._random(beat[i], rchar = c_misc[4], schar = c_misc[5], length = pattern_length, rng = rng)
                                     beat[i] = utils._safer_eval(beat[i])
                                     while beat[i] + pattern_length*n > len(audio.beatmap)-1: beat[i] = 1 + beat[i] - len(audio.beatmap)
                                 if beat[2] == c_slice[0]: beat = audio[beat[0] + pattern_length*n : beat[1] + pattern_length*n]
@@ -333,14 +392,14 @@ class song:
                         beat_str = beat if isinstance(beat, str) else ''.join(beat)
                         # Takes a single beat
                         if isinstance(beat, str):
-                            if c_misc[4] in beat: beat = parse._random(beat, rchar = c_misc[4], schar = c_misc[5], length = pattern_length)
+                            if c_misc[4] in beat: beat = parse._random(beat, rchar = c_misc[4], schar = c_misc[5], length = pattern_length, rng = rng)
                             beat = self[utils._safer_eval(beat) + pattern_length*n]
 
                         # Takes a range of beats
                         elif isinstance(beat, list):
                             beat = beat.copy()
                             for i in range(len(beat)-1): # no separator
-                                if c_misc[4] in beat[i]: beat[i] = parse._random(beat[i], rchar = c_misc[4], schar = c_misc[5], length = pattern_length)
+                                if c_misc[4] in beat[i]: beat[i] = parse._random(beat[i], rchar = c_misc[4], schar = c_misc[5], length = pattern_length, rng = rng)
                                 beat[i] = utils._safer_eval(beat[i])
                             if beat[2] == c_slice[0]: beat = self[beat[0] + pattern_length*n : beat[1] + pattern_length*n]
                             elif beat[2] == c_slice[1]: beat = self[beat[0] - 1 + pattern_length*n: beat[0] - 1 + beat[1] + pattern_length*n]
@@ -358,31 +417,11 @@ class song:
                 
                 # Applies effects
                 effect = b[1]
-                for e in effect:
-                    if e[0] in effects:
-                        v = e[1]
-                        e = effects[e[0]]
-                        # parse effect value
-                        if isinstance(v, str):
-                            if metric is not None: v = parse._metric_replace(v, metric, c_misc[7])
-                            v = utils._safer_eval(v)
-
-                        # effects
-                        if e == 'volume':
-                            if v is None: v = 0
-                            beat = beat * v
-                        elif e == 'downsample':
-                            if v is None: v = 8
-                            beat = np.repeat(beat[:,::v], v, axis=1)
-                        elif e == 'gradient':
-                            beat = np.gradient(beat, axis=1)
-                        elif e == 'reverse':
-                            beat = beat[:,::-1]
-                        else:
-                            beat = e(beat, v)
+                beat = _apply_effects(beat, effect, effects, metric, c_misc)
 
                 # clip beat to -1, 1
                 beat = np.clip(beat, -1, 1)
+                allocations += 1 + len(effect)
 
                 # checks if length limit has been reached
                 if limit_length is not None:
@@ -397,69 +436,19 @@ class song:
                     result.append(beat)
                 
                 # Makes sure beat doesn't get added on top of previous beat multiple times when pattern is out of range of song beats, to avoid distorted end.
-                elif tries<2:
-
-                    # Separator is `;` - always use first beat length, normalizes volume to 1.5
-                    if operators[num] == c_join[1]:
-                        length = len(beat[0])
-                        prev_length = len(result[-1][0])
-                        if length > prev_length: 
-                            result[-1] += beat[:,:prev_length]
-                        else:
-                            result[-1][:,:length] += beat
-                        limit = np.max(result[-1])
-                        if limit > 1.5:
-                            result[-1] /= limit*0.75
-                    
-                    # Separator is `~` - cuts to shortest
-                    elif operators[num] == c_join[2]:
-                        minimum = min(len(beat[0]), len(result[-1][0]))
-                        result[-1] = beat[:,:minimum-1] + result[-1][:,:minimum-1]
-
-                    # Separator is `&` - extends to longest
-                    elif operators[num] == c_join[3]:
-                        length = len(beat[0])
-                        prev_length = len(result[-1][0])
-                        if length > prev_length: 
-                            beat[:,:prev_length] += result[-1]
-                            result[-1] = beat
-                        else:
-                            result[-1][:,:length] += beat
-
-                    # Separator is `^` - uses first beat length and multiplies beats, used for sidechain
-                    elif operators[num] == c_join[4]:
-                        length = len(beat[0])
-                        prev_length = len(result[-1][0])
-                        if length > prev_length: 
-                            result[-1] *= beat[:,:prev_length]
-                        else:
-                            result[-1][:,:length] *= beat
-
-
-                    # Separator is `$` - always use first beat length, additionally sidechains first beat by second
-                    elif operators[num] == c_join[5]:
-                        from . import effects
-                        length = len(beat[0])
-                        prev_length = len(result[-1][0])
-                        if length > prev_length: 
-                            result[-1] *= effects.to_sidechain(beat[:,:prev_length])
-                            result[-1] += beat[:,:prev_length]
-                        else:
-                            result[-1][:,:length] *= effects.to_sidechain(beat)
-                            result[-1][:,:length] += beat
-
-                    # Separator is `}` - always use first beat length
-                    elif operators[num] == c_join[6]:
-                        length = len(beat[0])
-                        prev_length = len(result[-1][0])
-                        if length > prev_length: 
-                            result[-1] += beat[:,:prev_length]
-                        else:
-                            result[-1][:,:length] += beat
+                elif tries<2: _join(result, beat, operators[num], c_join)
 
+        instrument.stop(timer)
+        instrument.count('beats_rendered', len(result) - 1)
+        instrument.count('allocations', allocations)
 
         # smoothing
+        timer = instrument.start('smoothing')
+        import scipy.interpolate
         for i in range(len(result)-1):
+            if token is not None and i % 1024 == 0: token.check('smoothing', i, len(result)-1)
+            # intro is empty when the first beat is at 0
+            if len(result[i][0]) < 2 or len(result[i+1][0]) < 2: continue
             current1 = result[i][0][-2]
             current2 = result[i][0][-1]
             following1 = result[i+1][0][0]
@@ -478,16 +467,110 @@ class song:
                         result[i][1][-num:] += line
                     except (IndexError, ValueError): pass
 
-        self.beatmap = beatmap_default.copy()
+        instrument.stop(timer)
+
         # Beats are conjoined into a song
+        timer = instrument.start('concatenate')
         import functools
         import operator
         # Makes a [l, r, l, r, ...] list of beats (left and right channels)
         result = functools.reduce(operator.iconcat, result, [])
 
         # Every first beat is conjoined into left channel, every second beat is conjoined into right channel
-        if return_audio is False: self.audio = np.array([functools.reduce(operator.iconcat, result[::2], []), functools.reduce(operator.iconcat, result[1:][::2], [])])
-        else: return np.array([functools.reduce(operator.iconcat, result[::2], []), functools.reduce(operator.iconcat, result[1:][::2], [])])
+        result = np.array([functools.reduce(operator.iconcat, result[::2], []), functools.reduce(operator.iconcat, result[1:][::2], [])])
+        instrument.stop(timer)
+        instrument.count('samples_produced', len(result[0]))
+        return result
+
+    def _prepare(self, scale:float = 1, shift:float = 0, adjust = 500, start = False) -> 'song':
+        """Shallow copy that shares audio with this song, with the beatmap adjusted, shifted and scaled like `beatswap` does it. See `beatmap_derived`."""
+        import copy
+        prepared = copy.copy(self)
+        prepared.log = False
+        prepared.beatmap = self.beatmap_derived(scale, shift, adjust, start)
+        return prepared
+
+    def beatswap_many(self, patterns:list, seeds:list = None, scale:float = 1, shift:float = 0, length = None, samples:dict = BM_SAMPLES, effects:dict = BM_EFFECTS, metrics:dict = BM_METRICS, 
+                      smoothing: int = 100, adjust = 500, limit_beats = 10000, limit_length = 52920000, workers:int = None, output:str = None, ext = 'mp3', suffixes:list = None, caching = True) -> list:
+        """Renders every pattern on the same beatmap in `workers` threads, without changing the song. Returns a list of arrays, or of written files if `output` is not None.
+
+        The beatmap is adjusted, shifted and scaled once, samples are loaded once and every distinct pattern is parsed once.
+        `seeds` - a seed for each pattern, used by `random`, `shuffle`, `@` and `#`, so results can be reproduced. Patterns without a seed use the global `random`, like `beatswap`.
+        `scale` - a number, or a list with a scale for each pattern. Each distinct scale is prepared once.
+        Patterns, seeds and scales can each be a single value, which is repeated for the others - one pattern with several seeds or scales is rendered once for each.
+        `output` - folder or filename, like in `write`. Files get `suffixes`, ` (1)`, ` (2)`... by default, and each one is written as soon as it is rendered.
+        With `caching`, files that are in `cache` are copied from it without rendering, and new files are added to it."""
+        import random
+        from concurrent.futures import ThreadPoolExecutor, Future
+        from . import parse, assets
+        if isinstance(patterns, (str, tuple)): patterns = [patterns]
+        scales = list(scale) if isinstance(scale, (list, range)) else [scale]
+        seeds = [None] if seeds is None else list(seeds)
+        count = max(len(patterns), len(scales), len(seeds))
+        for name, values in (('patterns', patterns), ('scales', scales), ('seeds', seeds)):
+            assert len(values) in (1, count), f'there are {len(values)} {name}, there should be 1 or {count}'
+        patterns, scales, seeds = [list(i) * count if len(i) == 1 else list(i) for i in (patterns, scales, seeds)]
+        assert suffixes is None or len(suffixes) == count, f'there are {len(suffixes)} suffixes for {count} renders'
+        rngs = [random.Random(seed) if seed is not None else None for seed in seeds]
+        prepared = {}
+        for i in scales:
+            if i not in prepared: prepared[i] = self._prepare(i, shift, adjust)
+
+        # special patterns are turned into normal patterns, except `reverse`, which is None.
+        # `beatswap` renders `shuffle` and `test` by beatswapping the prepared song, which adjusts its beatmap again, so they are rendered on that beatmap here too
+        texts = []
+        targets = []
+        readjusted = {}
+        for pattern, rng, i in zip(patterns, rngs, scales):
+            target = prepared[i]
+            if isinstance(pattern, str):
+                if pattern.lower() == 'reverse': pattern = None
+                elif pattern.lower() == 'random': pattern = parse.random_pattern(rng)[0]
+                elif pattern.lower() in ('shuffle', 'test'):
+                    if i not in readjusted: readjusted[i] = prepared[i]._prepare()
+                    target = readjusted[i]
+                    if pattern.lower() == 'shuffle':
+                        beats = list(range(len(prepared[i].beatmap)))
+                        (rng or random).shuffle(beats)
+                        pattern = ','.join(list(str(i) for i in beats))
+                    else: pattern = '1;"cowbell"s3v2, 2;"cowbell"s2, 3;"cowbell", 4;"cowbell"s0.5, 5;"cowbell"s0.25, 6;"cowbell"s0.4, 7;"cowbell"s0.8, 8;"cowbell"s1.6'
+            texts.append(pattern)
+            targets.append(target)
+        strings = [i for i in texts if isinstance(i, str)]
+        samples = assets.resolve(' '.join(strings), samples, self.sr)
+        parsed = {}
+        for i in strings:
+            if i not in parsed: parsed[i] = parse.parse(pattern = i, samples = samples, pattern_length = length, log = False, sr = self.sr)
+
+        from . import cache, cancel, instrument
+        token, recorders = cancel.current(), instrument.current()
+        # audio is hashed once for all renders
+        source = cache.digest(self) if (output is not None and caching is True and effects is BM_EFFECTS and metrics is BM_METRICS) else None
+        def render(i):
+            with cancel.scope(token), instrument.scope(recorders): return _render(i)
+        def _render(i):
+            if output is not None:
+                filename = io._outputfilename(output, filename = self.path, suffix = suffixes[i] if suffixes is not None else f' ({i+1})', ext = ext)
+                key = cache.key(self, patterns[i], scales[i], shift, adjust, seed = seeds[i], samples = samples, source = source, length = length, smoothing = smoothing,
+                                limit_beats = limit_beats, limit_length = limit_length) if source is not None else None
+                if cache.fetch(key, filename) is not None:
+                    done = Future()
+                    done.set_result({filename: filename})
+                    return done
+            if texts[i] is None: result = targets[i][::-1]
+            else: result = targets[i]._render(texts[i] if isinstance(texts[i], tuple) else parsed[texts[i]], effects = effects, metrics = metrics, smoothing = smoothing,
+                                            limit_beats = limit_beats, limit_length = limit_length, rng = rngs[i])
+            if output is None: return result
+            # encoded on the writer thread while the next pattern renders
+            return encoder.submit(result, self.sr, filename, key = key)
+
+        from . import writer
+        with writer.writer(log = self.log) as encoder:
+            if workers == 1 or len(texts) == 1: results = [render(i) for i in range(len(texts))]
+            else:
+                with ThreadPoolExecutor(max_workers = workers) as executor: results = list(executor.map(render, range(len(texts))))
+            if output is None: return results
+            return [list(i.result())[0] for i in results]
 
     def normalize_beats(self):
         if self.normalized is not None: 
@@ -497,14 +580,14 @@ class song:
                 from . import presets
                 self.beatswap(*presets.get(self.normalized))
 
-    def image_generate(self, scale=1, shift=0, mode = 'median'):
-        if self.beatmap is None: self.beatmap_generate()
-        beatmap_default = self.beatmap.copy()
-        self.beatmap_shift(shift)
-        self.beatmap_scale(scale)
+    def spectrogram(self, hop: int = 512, n_fft: int = 2048):
+        """Magnitude spectrogram, computed once and cached until `self.audio` changes. See `spectrum.spectrogram`."""
+        from . import spectrum
+        return spectrum.get(self, hop = hop, n_fft = n_fft)
+
+    def image_generate(self, scale=1, shift=0, mode = 'median', spectral = False):
         from .image import generate as image_generate
-        self.image = image_generate(song = self, mode = mode, log = self.log)
-        self.beatmap = beatmap_default.copy()
+        self.image = image_generate(song = self, beatmap = self.beatmap_derived(scale, shift), mode = mode, log = self.log, spectral = spectral)
 
     def image_write(self, output='', mode = 'color', max_size = 4096, ext = 'png', rotate=True, suffix = ''):
         from .image import write as image_write
@@ -513,8 +596,98 @@ class song:
         return output
 
 
-
-def beatswap(audio = None, pattern = 'test', scale = 1, shift = 0, length = None, sr = None, output = '', log = True, suffix = ' (beatswap)', copy = True):
+def _apply_effects(beat: np.ndarray, effect: list, effects: dict = BM_EFFECTS, metric = None, c_misc: str = None) -> np.ndarray:
+    """Applies effects of one parsed beat, `effect` is a list of [letter, value]. Effects that are not in `effects` are ignored."""
+    from . import parse
+    if c_misc is None: c_misc = utils.C_MISC
+    for e in effect:
+        if e[0] in effects:
+            v = e[1]
+            e = effects[e[0]]
+            # parse effect value
+            if isinstance(v, str):
+                if metric is not None: v = parse._metric_replace(v, metric, c_misc[7])
+                v = utils._safer_eval(v)
+
+            # effects
+            if e == 'volume':
+                if v is None: v = 0
+                beat = beat * v
+            elif e == 'downsample':
+                if v is None: v = 8
+                beat = np.repeat(beat[:,::v], v, axis=1)
+            elif e == 'gradient':
+                beat = np.gradient(beat, axis=1)
+            elif e == 'reverse':
+                beat = beat[:,::-1]
+            else:
+                beat = e(beat, v)
+    return beat
+
+def _join(result: list, beat: np.ndarray, operator: str, c_join: str = None):
+    """Joins `beat` onto the last beat in `result` with any join operator except `,`. Changes `result[-1]`, and `beat` for `&`, in place."""
+    if c_join is None: c_join = utils.C_JOIN
+    # Separator is `;` - always use first beat length, normalizes volume to 1.5
+    if operator == c_join[1]:
+        length = len(beat[0])
+        prev_length = len(result[-1][0])
+        if length > prev_length: 
+            result[-1] += beat[:,:prev_length]
+        else:
+            result[-1][:,:length] += beat
+        limit = np.max(result[-1])
+        if limit > 1.5:
+            result[-1] /= limit*0.75
+
+    # Separator is `~` - cuts to shortest
+    elif operator == c_join[2]:
+        minimum = min(len(beat[0]), len(result[-1][0]))
+        result[-1] = beat[:,:minimum-1] + result[-1][:,:minimum-1]
+
+    # Separator is `&` - extends to longest
+    elif operator == c_join[3]:
+        length = len(beat[0])
+        prev_length = len(result[-1][0])
+        if length > prev_length: 
+            beat[:,:prev_length] += result[-1]
+            result[-1] = beat
+        else:
+            result[-1][:,:length] += beat
+
+    # Separator is `^` - uses first beat length and multiplies beats, used for sidechain
+    elif operator == c_join[4]:
+        length = len(beat[0])
+        prev_length = len(result[-1][0])
+        if length > prev_length: 
+            result[-1] *= beat[:,:prev_length]
+        else:
+            result[-1][:,:length] *= beat
+
+
+    # Separator is `$` - always use first beat length, additionally sidechains first beat by second
+    elif operator == c_join[5]:
+        from . import effects
+        length = len(beat[0])
+        prev_length = len(result[-1][0])
+        if length > prev_length: 
+            result[-1] *= effects.to_sidechain(beat[:,:prev_length])
+            result[-1] += beat[:,:prev_length]
+        else:
+            result[-1][:,:length] *= effects.to_sidechain(beat)
+            result[-1][:,:length] += beat
+
+    # Separator is `}` - always use first beat length
+    elif operator == c_join[6]:
+        length = len(beat[0])
+        prev_length = len(result[-1][0])
+        if length > prev_length: 
+            result[-1] += beat[:,:prev_length]
+        else:
+            result[-1][:,:length] += beat
+
+
+
+def beatswap(audio = None, pattern = 'test', scale = 1, shift = 0, length = None, sr = None, output = '', log = True, suffix = ' (beatswap)', copy = True, budget = None, caching = True, seed = None):
     if not isinstance(audio, song): audio = song(audio = audio, sr = sr, log = log)
     elif copy is True: 
         beatmap = audio.beatmap
@@ -522,14 +695,28 @@ def beatswap(audio = None, pattern = 'test', scale = 1, shift = 0, length = None
         audio = song(audio = audio.audio, sr = audio.sr)
         audio.beatmap = beatmap
         audio.path = path
-    audio.beatswap(pattern = pattern, scale = scale, shift = shift, length = length)
+    if output is not None and caching is True:
+        # renders that were written before are copied from cache without rendering
+        from . import cache
+        if audio.beatmap is None: audio.beatmap_generate()
+        filename = io._outputfilename(output, filename = audio.path, suffix = suffix, ext = 'mp3')
+        key = cache.key(audio, pattern, scale, shift, seed = seed, length = length)
+        if cache.fetch(key, filename) is not None:
+            audio._print(f'Copied {filename} from cache')
+            return filename
+    audio.beatswap(pattern = pattern, scale = scale, shift = shift, length = length, budget = budget, seed = seed)
+    if output is not None and caching is True:
+        # stored under the key of the render, which doesn't need the new audio to be hashed
+        audio.write(output = filename, literal_output = True, caching = False)
+        cache.put(key, filename)
+        return filename
     if output is not None: 
-        return audio.write(output = output, suffix = suffix)
+        return audio.write(output = output, suffix = suffix, caching = caching)
     else: return audio
 
-def image(audio, scale = 1, shift = 0, sr = None, output = '', log = True, suffix = '', max_size = 4096):
+def image(audio, scale = 1, shift = 0, sr = None, output = '', log = True, suffix = '', max_size = 4096, spectral = False):
     if not isinstance(audio, song): audio = song(audio = audio, sr = sr, log = log)
-    audio.image_generate(scale = scale, shift = shift)
+    audio.image_generate(scale = scale, shift = shift, spectral = spectral)
     if output is not None: 
         return audio.image_write(output = output, max_size=max_size, suffix=suffix)
     else: return audio.image
\ No newline at end of file
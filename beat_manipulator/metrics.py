@@ -28,6 +28,23 @@ def hit_in_middle(audio: np.ndarray, diff = 0.1) -> int:
 def hit_at_end(audio: np.ndarray, diff = 0.1) -> int:
     return is_hit(audio) * (locate_1st_hit(audio) >= (1-diff))
 
+def _power(audio: np.ndarray, n_fft: int = 2048) -> np.ndarray:
+    """Power spectrum averaged over channels and non-overlapping frames"""
+    from .spectrum import stft
+    return np.mean(stft(audio, n_fft = n_fft, hop = n_fft)**2, axis = (0, 1))
+
+def low_energy(audio: np.ndarray, high: float = 150, sr: int = 44100) -> float:
+    """Share of energy below `high` hz, high on beats with a kick"""
+    power = _power(audio)
+    frequencies = np.fft.rfftfreq(2048, 1 / sr)
+    return float(np.sum(power[frequencies < high]) / max(float(np.sum(power)), 1e-12))
+
+def brightness(audio: np.ndarray, sr: int = 44100) -> float:
+    """Spectral centroid as a fraction of the nyquist frequency"""
+    power = _power(audio)
+    frequencies = np.fft.rfftfreq(2048, 1 / sr)
+    return float(np.sum(power * frequencies) / max(float(np.sum(power)), 1e-12) / (sr / 2))
+
 BM_METRICS = {
     "v": volume,
     "g": volume_gradient,
@@ -37,4 +54,6 @@ BM_METRICS = {
     "s": hit_at_start,
     "a": hit_in_middle,
     "e": hit_at_end,
+    "k": low_energy,
+    "b": brightness,
 }
\ No newline at end of file
@@ -0,0 +1,89 @@
+"""Beat detection in pure numpy, for when madmom isn't available or for instant previews. Selected with `lib = 'stunlocked'`.
+
+Finds transients the same way as the `stunlocked` osu! peak detector - maximum absolute gradient in every 10 ms frame,
+and frames over a threshold that come after enough quiet frames - then fits a regular tempo grid to them and snaps grid beats to nearby transients.
+Works best on music with a steady tempo, which is also what beatswapping assumes."""
+import numpy as np
+
+FPS = 100
+
+def strength(audio: np.ndarray, sr: int, fps: int = FPS) -> np.ndarray:
+    """Maximum absolute gradient of the first channel in every 1/fps second frame"""
+    signal = audio[0] if audio.ndim > 1 else audio
+    hop = int(sr / fps)
+    signal = signal[:len(signal) - len(signal) % hop]
+    return np.abs(np.gradient(np.clip(signal, -1, 1))).reshape(-1, hop).max(axis = 1)
+
+def flux(audio: np.ndarray, sr: int, fps: int = FPS) -> np.ndarray:
+    """How much louder every 1/fps second frame is than the previous one, in RMS. Follows kicks and snares, which `strength` mostly misses."""
+    signal = audio.mean(axis = 0) if audio.ndim > 1 else audio
+    hop = int(sr / fps)
+    signal = signal[:len(signal) - len(signal) % hop].reshape(-1, hop)
+    rms = np.sqrt(np.einsum('ij,ij->i', signal, signal) / hop)
+    return np.maximum(np.diff(rms, prepend = rms[:1]), 0)
+
+def peak_frames(frame_strength: np.ndarray, threshold: float = 0.1, hold: int = 7) -> np.ndarray:
+    """Indexes of frames over `threshold` that come after at least `hold` frames under it since the previous peak.
+    Same result as the frame by frame hysteresis loop in osu.py, but it only loops over peaks."""
+    loud = np.flatnonzero(frame_strength >= threshold)
+    if len(loud) == 0: return loud
+    # quiet[i] is how many quiet frames there are before frame i
+    quiet = np.concatenate(([0], np.cumsum(frame_strength <= threshold)))
+    # for every loud frame, the first loud frame after `hold` quiet frames that follow it
+    following = np.maximum(np.searchsorted(quiet[loud], quiet[loud + 1] + hold), np.arange(1, len(loud) + 1))
+    peaks = [0]
+    while following[peaks[-1]] < len(loud): peaks.append(following[peaks[-1]])
+    return loud[peaks]
+
+def peaks(audio: np.ndarray, sr: int, threshold: float = 0.1, hold: int = 7, fps: int = FPS) -> np.ndarray:
+    """Array with 1 in frames that have a peak and 0 everywhere else, one value per 1/fps seconds"""
+    frame_strength = strength(audio, sr, fps)
+    result = np.zeros(len(frame_strength))
+    result[peak_frames(frame_strength, threshold, hold)] = 1
+    return result
+
+def tempo(envelope: np.ndarray, fps: int = FPS, bpm_range = (60, 200), prior: float = 120) -> float:
+    """Beat period in frames, from autocorrelation of the onset envelope weighted towards `prior` bpm so that it doesn't pick half or double tempo"""
+    length = len(envelope)
+    envelope = np.convolve(envelope, (0.25, 0.5, 1, 0.5, 0.25), mode = 'same')
+    n = 1 << int(np.ceil(np.log2(2 * length)))
+    spectrum = np.fft.rfft(envelope, n)
+    autocorrelation = np.fft.irfft(spectrum * np.conj(spectrum), n)
+    shortest, longest = int(fps * 60 / bpm_range[1]), int(np.ceil(fps * 60 / bpm_range[0]))
+    lags = np.arange(shortest, min(longest, length - 1) + 1)
+    if len(lags) < 3: return fps * 60 / prior
+    score = autocorrelation[lags] * np.exp(-0.5 * np.log2((fps * 60 / lags) / prior) ** 2)
+    best = int(np.argmax(score))
+    # parabolic interpolation for a fractional period
+    if 0 < best < len(lags) - 1:
+        a, b, c = score[best - 1], score[best], score[best + 1]
+        if a - 2 * b + c != 0: return lags[best] + 0.5 * (a - c) / (a - 2 * b + c)
+    return float(lags[best])
+
+def grid(peaks: np.ndarray, weights: np.ndarray, period: float, length: int, tolerance: float = 0.15, iterations: int = 3) -> np.ndarray:
+    """Regular beat grid in frames. Phase is the weighted circular mean of peak positions, then period and phase are refitted to the peaks closest to grid beats.
+    Grid beats within `tolerance` of the period from a peak are moved onto that peak."""
+    if len(peaks) == 0: return np.arange(0, length, period)
+    angles = np.exp(2j * np.pi * peaks / period)
+    phase = (np.angle(np.sum(weights * angles)) / (2 * np.pi) * period) % period
+    padded = np.concatenate(([-np.inf], peaks, [np.inf]))
+    for i in range(iterations + 1):
+        beats = phase + period * np.arange(int(np.ceil((length - phase) / period)))
+        index = np.searchsorted(padded, beats)
+        before, after = padded[index - 1], padded[index]
+        nearest = np.where(beats - before < after - beats, before, after)
+        matched = np.abs(nearest - beats) <= tolerance * period
+        if i == iterations or np.sum(matched) < 2: break
+        period, phase = np.polyfit(np.flatnonzero(matched), nearest[matched], 1)
+    return np.where(matched, nearest, beats)
+
+def beats(audio: np.ndarray, sr: int, threshold: float = 0.1, hold: int = 7, bpm_range = (60, 200), prior: float = 120, fps: int = FPS) -> np.ndarray:
+    """Beat positions in samples"""
+    envelope = flux(audio, sr, fps)
+    frame_strength = strength(audio, sr, fps)[:len(envelope)]
+    # grid snaps to local maxima of the envelope and to transients from the `stunlocked` detector
+    maxima = np.flatnonzero((envelope[1:-1] > envelope[:-2]) & (envelope[1:-1] >= envelope[2:]) & (envelope[1:-1] > np.mean(envelope))) + 1
+    found = np.union1d(maxima, peak_frames(frame_strength, threshold, hold))
+    weights = np.maximum(envelope[found], envelope[np.minimum(found + 1, len(envelope) - 1)])
+    period = tempo(envelope, fps, bpm_range, prior)
+    return (grid(found, weights, period, len(envelope)) * (sr / fps)).astype(int)
@@ -1,6 +1,6 @@
 from .utils import C_SLICE, C_JOIN, C_MISC, C_MATH
 import numpy as np
-from . import io, utils, main
+from . import utils, instrument, assets
 def _getnum(pattern, cur, symbols = '+-*/'):
     number = ''
     while pattern[cur].isdecimal() or pattern[cur] in symbols:
@@ -8,30 +8,37 @@ def _getnum(pattern, cur, symbols = '+-*/'):
         cur+=1
     return number, cur-1
 
+def normalize(pattern: str, c_join: str = C_JOIN) -> str:
+    """Pattern without spaces and without repeated, leading and trailing separators, which `parse` ignores"""
+    if ' ' not in c_join: pattern = pattern.replace(' ', '') # ignore spaces
+    for i in c_join:
+        while i+i in pattern: pattern = pattern.replace(i+i, i) #double separator
+        while pattern.startswith(i): pattern = pattern[1:]
+        while pattern.endswith(i): pattern = pattern[:-1]
+    return pattern
+
 def parse(pattern:str, samples:dict, pattern_length:int = None,
         c_slice:str = C_SLICE,
         c_join:str = C_JOIN, 
         c_misc:str = C_MISC,
         log = True,
-        simple_mode = False):
-    """Returns (beats, operators, pattern_length, c_slice, c_misc, c_join)"""
+        simple_mode = False,
+        sr:int = None):
+    """Returns (beats, operators, pattern_length, c_slice, c_misc, c_join)
+
+    `sr` - samples and songs are resampled to it. `samples` is not changed, loaded samples are cached in `assets`."""
     if log is True: print(f'Beatswapping with `{pattern}`')
+    timer = instrument.start('parse')
     
     #load samples:
-    if isinstance(samples, str): samples = (samples,)
-    if not isinstance(samples, dict):
-        samples = {str(i+1):samples[i] for i in range(len(samples))}
+    samples = dict(assets._samples(samples))
 
     #preprocess pattern
     separator = c_join[0]
     #forgot separator
     if simple_mode is True:
         if c_join[0] not in pattern and c_join[1] not in pattern and c_join[2] not in pattern and c_join[3] not in pattern: pattern = pattern.replace(' ', separator)
-    if ' ' not in c_join: pattern = pattern.replace(' ', '') # ignore spaces
-    for i in c_join:
-        while i+i in pattern: pattern = pattern.replace(i+i, i) #double separator
-        while pattern.startswith(i): pattern = pattern[1:]
-        while pattern.endswith(i): pattern = pattern[:-1]
+    pattern = normalize(pattern, c_join)
 
     # Creates a list of beat strings so that I can later see if there is a `!` in the string
     separated = pattern
@@ -74,14 +81,10 @@ def parse(pattern:str, samples:dict, pattern_length:int = None,
             assert sample in samples, f"No sample named `{sample}` found in samples. Available samples: {samples.keys()}"
             
             # If sample is a song, it will be converted to a song if needed, and beatmap will be generated
-            if quote == c_misc[11]: 
-                if not isinstance(samples[sample], main.song): samples[sample] = main.song(samples[sample])
-                if samples[sample].beatmap is None: 
-                    samples[sample].beatmap_generate()
-                    samples[sample].beatmap_adjust()
+            if quote == c_misc[11]: samples[sample] = assets.song(samples[sample], sr)
 
             # Else sample is a sound file
-            elif not isinstance(samples[sample], np.ndarray): samples[sample] = io._load(samples[sample])[0] 
+            else: samples[sample] = assets.sample(samples[sample], sr)
 
             sample_toadd = [samples[sample], [], quote, None] # Creates the sample_toadd variable
             cur += 1
@@ -178,12 +181,15 @@ def parse(pattern:str, samples:dict, pattern_length:int = None,
     import math
     if pattern_length is None: pattern_length = int(math.ceil(length))
 
+    instrument.stop(timer)
     return beats, operators, pattern_length, shuffle_groups, shuffle_beats, c_slice, c_misc, c_join
 
 # I can't be bothered to annotate this one. It just works, okay?
-def _random(beat:str, length:int, rchar = C_MISC[4], schar = C_MISC[5]) -> str:
-    """Takes a string and replaces stuff like `@1_4_0.5` with randomly generated number where 1 - start, 4 - stop, 0.5 - step. Returns string."""
+def _random(beat:str, length:int, rchar = C_MISC[4], schar = C_MISC[5], rng = None) -> str:
+    """Takes a string and replaces stuff like `@1_4_0.5` with randomly generated number where 1 - start, 4 - stop, 0.5 - step. Returns string.
+    `rng` is a `random.Random`, the global one is used if it is None."""
     import random
+    if rng is None: rng = random
     beat+=' '
     while rchar in beat:
         rand_index = beat.find(rchar)+1
@@ -220,25 +226,58 @@ def _random(beat:str, length:int, rchar = C_MISC[4], schar = C_MISC[5]) -> str:
             choices.append(start)
             start+=step
         beat = list(beat)
-        beat[beat.index(rchar):rand_index] = list(str(random.choice(choices)))
+        beat[beat.index(rchar):rand_index] = list(str(rng.choice(choices)))
         beat = ''.join(beat)
     return beat
 
-def _shuffle(pattern: list, shuffle_beats: list, shuffle_groups: list) -> list:
+def _shuffle(pattern: list, shuffle_beats: list, shuffle_groups: list, rng = None) -> list:
     """Shuffles pattern according to shuffle_beats and shuffle_groups"""
     import random
+    if rng is None: rng = random
     done = []
     result = pattern.copy()
     for group in shuffle_groups:
         if group not in done:
             shuffled = [i for n, i in enumerate(shuffle_beats) if shuffle_groups[n] == group]
             unshuffled = shuffled.copy()
-            random.shuffle(shuffled)
+            rng.shuffle(shuffled)
             for i in range(len(shuffled)):
                 result[unshuffled[i]] = pattern[shuffled[i]]
             done.append(group)
     return result
 
+def random_pattern(rng = None) -> tuple:
+    """Generates the pattern that `random` special pattern uses. Returns (pattern, pattern_length)."""
+    import random, math
+    if rng is None: rng = random
+    pattern = ''
+    rand_length=0
+    limit = 10000
+    while True:
+        limit -= 1
+        rand_num = int(math.floor(rng.triangular(1, 16, rand_length-1)))
+        if rng.uniform(0, rand_num)>rand_length: rand_num = rand_length+1
+        rand_slice = rng.choices(['','>0.5','>0.25', '<0.5', '<0.25', '<1/3', '<2/3', '>1/3', '>2/3', '<0.75', '>0.75', 
+                                     f'>{rng.uniform(0.01,2)}', f'<{rng.uniform(0.01,2)}'], weights = [13,1,1,1,1,1,1,1,1,1,1,1,1], k=1)[0]
+        
+        rand_effect = rng.choices(['', 's0.5', 's2', f's{rng.triangular(0.1,1,4)}', 'r','v0.5', 'v2', 'v0', 
+                                      f'd{int(rng.triangular(1,8,16))}', 'g', 'c', 'c0', 'c1', f'b{int(rng.triangular(1,8,4))}'], 
+                                      weights=[30, 2, 2, 2, 2, 1, 1, 2, 2, 1, 2, 2, 2, 1], k=1)[0]
+        
+        rand_join = rng.choices([', ', ';'], weights = [5, 1], k=1)[0]
+        pattern += f'{rand_num}{rand_slice}{rand_effect}{rand_join}'
+        if rand_join == ',': rand_length+=1
+        if rand_length in [4, 8, 16]: 
+            if rng.uniform(rand_num,16)>14: break
+        else: 
+            if rng.uniform(rand_num,16)>15.5: break
+        if limit <= 0: break
+    pattern_length = 4
+    if rand_length > 6: pattern_length = 8
+    if rand_length > 12: pattern_length = 16
+    if rand_length > 24: pattern_length = 32
+    return pattern, pattern_length
+
 def _metric_get(v, beat, metrics, c_misc7 = C_MISC[7]):
     assert v[v.find(c_misc7)+1] in metrics, f'`%{v[v.find(c_misc7)+1]}`: No metric called `{v[v.find(c_misc7)+1]}` found in metrics. Available metrics: {metrics.keys()}'
     metric = metrics[v[v.find(c_misc7)+1]](beat)
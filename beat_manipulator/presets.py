@@ -1,10 +1,11 @@
 from . import main, utils
-BM_SAMPLES = {'cowbell' : 'beat_manipulator/samples/cowbell.flac',
+import os
+BM_SAMPLES = {'cowbell' : os.path.join(utils.PACKAGE_DIR, 'samples', 'cowbell.flac'),
               }
 
-presets = {}
+PRESETS_PATH = os.path.join(utils.PACKAGE_DIR, 'presets.yaml')
 
-def presets_load(path, mode = 'add'):
+def presets_load(path = PRESETS_PATH, mode = 'add'):
     global presets
     import yaml
     with open(path, 'r') as f:
@@ -14,16 +15,26 @@ def presets_load(path, mode = 'add'):
     #     presets = presets | yaml_presets
     # elif mode.lower() == 'replace':
         presets = yaml_presets
+    return presets
 
-presets_load('beat_manipulator/presets.yaml')
+def _presets() -> dict:
+    """Presets are loaded from `presets.yaml` the first time they are needed"""
+    if 'presets' not in globals(): presets_load()
+    return presets
+
+def __getattr__(name):
+    # `bm.presets.presets` still works before anything loaded them
+    if name == 'presets': return _presets()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 def _beatswap(song, pattern, pattern_name, scale = 1, shift = 0, output = '', modify = False):
-    if isinstance(scale, str):
-        if ',' in scale: scale = scale.replace(' ', '').split(',')
+    if isinstance(scale, str): scale = scale.replace(' ', '').split(',')
     elif not isinstance(scale, list): scale = [scale]
     if modify is False:
-        for i in scale:
-            main.beatswap(song, pattern = pattern, scale = i, shift = shift, output=output, suffix = f' ({pattern_name}{(" x"+str(round(utils._safer_eval(i), 4))) * (len(scale)>1)})', copy = True)
+        # song is decoded once, each scale is prepared from its beatmap and all scales render in parallel
+        if not isinstance(song, main.song): song = main.song(song)
+        scale = [utils._safer_eval(i) for i in scale]
+        song.beatswap_many(pattern, scale = scale, shift = shift, output = output, suffixes = [f' ({pattern_name}{(" x"+str(round(i, 4))) * (len(scale)>1)})' for i in scale])
     else:
         assert isinstance(song, main.song), f"In order to modify a song, it needs to be of a main.song type, but it is {type(song)}"
         song.beatswap(pattern, scale = scale[0], shift = shift)
@@ -31,26 +42,31 @@ def _beatswap(song, pattern, pattern_name, scale = 1, shift = 0, output = '', mo
 
 def get(preset):
     """returns (pattern, scale, shift)"""
-    global presets
+    presets = _presets()
     assert preset in presets, f"{preset} not found in presets."
     preset = presets[preset]
     return preset['pattern'], preset['scale'] if 'scale' in preset else 1, preset['shift'] if 'shift' in preset else 0
 
 def use(song, preset, output = '', scale = 1, shift = 0):
-    global presets
+    presets = _presets()
     assert preset in presets, f"{preset} not found in presets."
     preset_name = preset
     preset = presets[preset]
     if not isinstance(song, main.song): song = main.song(song)
     if isinstance(list(preset.values())[0], dict):
-        for i in preset.values():
-            if 'sample' in i:
-                pass
-            elif 'sidechain' in i:
-                pass
-            else:
-                song = _beatswap(song, pattern = i['pattern'], scale = scale*(i['scale'] if 'scale' in i else 1), shift = shift*(i['shift'] if 'shift' in i else 0), output = output, modify = True, pattern_name = preset_name)
-        song.write(output, suffix = f' ({preset})')
+        steps = [i for i in preset.values() if 'sample' not in i and 'sidechain' not in i]
+        # the whole chain is copied from the render cache if it was rendered before
+        from . import cache, io
+        if song.beatmap is None: song.beatmap_generate()
+        key = cache.digest(song)
+        for i in steps: key = cache.key(song, i['pattern'], scale*(i['scale'] if 'scale' in i else 1), shift*(i['shift'] if 'shift' in i else 0), source = key) if key is not None else None
+        filename = io._outputfilename(output, filename = song.path, suffix = f' ({preset_name})', ext = 'mp3')
+        if cache.fetch(key, filename) is not None: return filename
+        for i in steps:
+            song = _beatswap(song, pattern = i['pattern'], scale = scale*(i['scale'] if 'scale' in i else 1), shift = shift*(i['shift'] if 'shift' in i else 0), output = output, modify = True, pattern_name = preset_name)
+        song.write(filename, literal_output = True, caching = False)
+        cache.put(key, filename)
+        return filename
     else:
         if 'sample' in preset:
             pass
@@ -61,7 +77,7 @@ def use(song, preset, output = '', scale = 1, shift = 0):
 
 def use_all(song, output = ''):
     if not isinstance(song, main.song): song = main.song(song)
-    for key in presets.keys():
+    for key in _presets().keys():
         print(f'__ {key} __')
         use(song, key, output = output)
         print()
@@ -0,0 +1,359 @@
+"""Works out where every beat of a beatswap comes from before rendering anything.
+
+`build(beatmap, parsed, audio, rng)` turns a parsed pattern and a prepared beatmap into arrays shaped (loops, beats in pattern) -
+source, start, stop and direction of the audio range, which parsed beat's effects apply, and whether the reference render would skip the beat or hit an IndexError on it.
+Every loop of the pattern is computed at once, `@` random numbers and `#` shuffles for all loops are drawn in bulk from one numpy generator.
+
+`render(plan, ...)` then only does what depends on the order of beats - limits, join operators and effects - and gathers all beats without effects
+straight from the source audio into the output in one `np.concatenate`. The result is the same as `song._render_reference` except for random choices,
+which come from a different generator. Patterns with `%` metrics aren't scheduled, `build` returns None for them and `song._render` uses the reference render."""
+import numpy as np
+from . import utils, instrument, cancel
+
+class schedule:
+    """Every beat a render goes through, in order: `start`, `stop`, `direction`, `source`, `chain`, `valid`, `skip` are shaped (loops, beats in pattern).
+
+    `source` is an index in `sources`, 0 is the song. A beat is `source[:, start:stop]`, reversed where `direction` is -1. `chain` is the parsed beat whose effects apply, beats move around with `#`.
+    `valid` is False where the reference render gets an IndexError. `operator` is the index in `c_join` of the join operator before each beat in the pattern."""
+    def __init__(self, start, stop, direction, source, chain, valid, skip, operator, sources, beats, intro, c_misc, c_join):
+        self.start, self.stop, self.direction, self.source, self.chain = start, stop, direction, source, chain
+        self.valid, self.skip, self.operator = valid, skip, operator
+        self.sources = sources
+        self.beats = beats # parsed beats, for their effects
+        self.intro = intro # everything before the first beat
+        self.c_misc, self.c_join = c_misc, c_join
+
+    @property
+    def loops(self) -> int:
+        return self.start.shape[0]
+
+    def __repr__(self):
+        return f'schedule({self.loops} loops of {self.start.shape[1]} beats, {len(self.sources)} sources)'
+
+def _generator(rng = None) -> np.random.Generator:
+    """numpy generator from a `random.Random`, a seed or a generator. A `random.Random` seeds it, so seeded renders stay reproducible.
+    Without `rng` it is seeded from the global `random`, so `random.seed` makes renders reproducible, like it does for `parse._random`."""
+    import random
+    if isinstance(rng, np.random.Generator): return rng
+    if isinstance(rng, random.Random): return np.random.default_rng(rng.getrandbits(64))
+    if rng is None: return np.random.default_rng(random.getrandbits(64))
+    return np.random.default_rng(rng)
+
+class _replay:
+    """Stands in for `random.Random` in `parse._random`, picks given choices and records how many choices there were"""
+    def __init__(self, indexes = ()):
+        self.indexes = indexes
+        self.sizes = []
+
+    def choice(self, choices):
+        self.sizes.append(len(choices))
+        return choices[self.indexes[len(self.sizes) - 1] if len(self.indexes) >= len(self.sizes) else 0]
+
+def _values(beat: str, length: int, loops: int, generator: np.random.Generator, c_misc: str) -> np.ndarray:
+    """Value of a beat number in every loop. Every `@` is drawn for all loops at once, and each distinct combination is evaluated once."""
+    from . import parse
+    if c_misc[4] not in beat: return np.full(loops, float(utils._safer_eval(beat)))
+    probe = _replay()
+    parse._random(beat, rchar = c_misc[4], schar = c_misc[5], length = length, rng = probe)
+    indexes = np.stack([generator.integers(size, size = loops) for size in probe.sizes], axis = 1)
+    combinations, inverse = np.unique(indexes, axis = 0, return_inverse = True)
+    values = np.array([float(utils._safer_eval(parse._random(beat, rchar = c_misc[4], schar = c_misc[5], length = length, rng = _replay(tuple(i))))) for i in combinations.tolist()])
+    return values[inverse.reshape(-1)]
+
+def _positions(beatmap: np.ndarray, index: np.ndarray) -> tuple:
+    """Sample positions of beat indexes exactly like `song._slice`, including negative indexes. Returns (positions, valid), where valid is False if `song._slice` raises IndexError."""
+    size = len(beatmap)
+    fraction = index % 1
+    whole = np.trunc(index).astype(np.int64)
+    fractional = fraction != 0
+    valid = (whole >= -size) & (whole < size) & (~fractional | (whole + 1 < size))
+    if size == 0: return np.zeros(len(index), dtype = np.int64), valid
+    first = beatmap[np.where(valid, whole, 0)]
+    following = beatmap[np.where(valid & fractional, whole + 1, 0)]
+    return np.where(fractional, np.trunc(first + fraction * (following - first)), first).astype(np.int64), valid
+
+def _range(beatmap: np.ndarray, a: np.ndarray, b: np.ndarray, kind: str, offsets: np.ndarray, c_slice: str):
+    """Positions of a slice of beats, like `song[first:last]`. Returns (start, stop, valid, reversed), `song` slices reversed ranges from the lower to the higher position with step -1,
+    which is empty unless a negative index wrapped around."""
+    if kind == c_slice[0]: first, last = a + offsets, b + offsets
+    elif kind == c_slice[1]: first, last = a - 1 + offsets, a - 1 + b + offsets
+    else: first, last = a - b + offsets, a + offsets
+    start, valid_start = _positions(beatmap, np.minimum(first, last))
+    stop, valid_stop = _positions(beatmap, np.maximum(first, last))
+    return start, stop, valid_start & valid_stop, first > last
+
+def _wrap(index: np.ndarray, size: int) -> np.ndarray:
+    """Song used as a sample loops around: `while index > size-1: index = 1 + index - size`"""
+    over = index - (size - 1)
+    return np.where(over > 0, index - (size - 1) * np.ceil(over / max(size - 1, 1)), index)
+
+def _bounds(start: np.ndarray, stop: np.ndarray, length: int, reversed = False) -> tuple:
+    """`audio[:, start:stop]`, or `audio[:, start:stop:-1]` where `reversed`, as forward bounds after python's slicing rules. Stop is never before start."""
+    forward_start = np.where(start < 0, np.maximum(start + length, 0), np.minimum(start, length))
+    forward_stop = np.maximum(np.where(stop < 0, np.maximum(stop + length, 0), np.minimum(stop, length)), forward_start)
+    # with step -1, start is the last sample taken and stop is the first one that isn't
+    last = np.where(start < 0, start + length, start)
+    last = np.where(last < 0, -1, np.minimum(last, length - 1))
+    first = np.where(stop < 0, stop + length, stop)
+    first = np.where(first < 0, -1, np.minimum(first, length - 1)) + 1
+    return np.where(reversed, first, forward_start), np.where(reversed, np.maximum(last + 1, first), forward_stop)
+
+def build(beatmap: np.ndarray, parsed: tuple, audio: np.ndarray, rng = None):
+    """Schedule of a render of `parsed` on a beatmap that is already adjusted, shifted and scaled, or None if the pattern can't be scheduled"""
+    beats, operators, pattern_length, shuffle_groups, shuffle_beats, c_slice, c_misc, c_join = parsed
+    if pattern_length <= 0 or len(beats) == 0 or not isinstance(audio, np.ndarray): return None
+    timer = instrument.start('schedule')
+    beatmap = np.asarray(beatmap)
+    generator = _generator(rng)
+    # same number of loops as `while n*pattern_length <= len(beatmap)`
+    loops = len(beatmap) // pattern_length + 2
+    offsets = np.arange(loops, dtype = float) * pattern_length
+    sources = [audio]
+    source_ids = {id(audio): 0}
+    columns = []
+    for b in beats:
+        beat = b[3] if len(b) == 4 else b[0]
+        text = (''.join(beat) if isinstance(beat, list) else beat) or ''
+        effect_values = ''.join(str(e[1]) for e in b[1] if e[1] is not None)
+        # metrics are measured on rendered beats, so they can only be rendered beat by beat
+        if c_misc[7] in text or c_misc[7] in effect_values: return instrument.stop(timer)
+        skip = c_misc[9] in text
+        valid = np.ones(loops, dtype = bool)
+        reversed = np.zeros(loops, dtype = bool)
+        if len(b) == 4:
+            source = b[0]
+            # song
+            if b[2] == c_misc[11]:
+                song_beatmap, song_audio = np.asarray(source.beatmap), source.audio
+                size = len(song_beatmap)
+                if beat is None: start, stop = np.zeros(loops, dtype = np.int64), np.full(loops, song_audio.shape[-1])
+                elif size <= 1: return instrument.stop(timer)
+                elif isinstance(beat, str):
+                    index = _wrap(_values(beat, pattern_length, loops, generator, c_misc) + offsets, size)
+                    (start, valid_start), (stop, valid_stop) = _positions(song_beatmap, index - 1), _positions(song_beatmap, index)
+                    valid = valid_start & valid_stop
+                else:
+                    a = _wrap(_values(beat[0], pattern_length, loops, generator, c_misc) + offsets, size) - offsets
+                    b1 = _wrap(_values(beat[1], pattern_length, loops, generator, c_misc) + offsets, size) - offsets
+                    start, stop, valid, reversed = _range(song_beatmap, a, b1, beat[2], offsets, c_slice)
+                source = song_audio
+            # sample
+            else:
+                length = source.shape[-1]
+                if beat is None: start, stop = np.zeros(loops, dtype = np.int64), np.full(loops, length)
+                elif isinstance(beat, list):
+                    first, last = min(int(utils._safer_eval(beat[0])*length), length-1), min(int(utils._safer_eval(beat[1])*length), length-1)
+                    if first > last: first, last, reversed = last, first, np.ones(loops, dtype = bool)
+                    start, stop = np.full(loops, first), np.full(loops, last)
+                # a sample with a single beat number isn't something the reference render can render either
+                else: return instrument.stop(timer)
+            if id(source) not in source_ids:
+                source_ids[id(source)] = len(sources)
+                sources.append(source)
+            source = source_ids[id(source)]
+        else:
+            source = 0
+            if isinstance(beat, str):
+                index = _values(beat, pattern_length, loops, generator, c_misc) + offsets
+                (start, valid_start), (stop, valid_stop) = _positions(beatmap, index - 1), _positions(beatmap, index)
+                valid = valid_start & valid_stop
+            else:
+                start, stop, valid, reversed = _range(beatmap, _values(beat[0], pattern_length, loops, generator, c_misc), _values(beat[1], pattern_length, loops, generator, c_misc), beat[2], offsets, c_slice)
+        start, stop = _bounds(np.asarray(start, dtype = np.int64), np.asarray(stop, dtype = np.int64), sources[source].shape[-1], reversed)
+        columns.append((start, stop, np.where(reversed, -1, 1), np.full(loops, source), valid, np.full(loops, skip)))
+
+    start, stop, direction, source, valid, skip = (np.stack([c[i] for c in columns], axis = 1) for i in range(6))
+    # `#` - beats in each shuffle group change places in every loop
+    chain = np.tile(np.arange(len(beats)), (loops, 1))
+    groups = {}
+    for position, group in zip(shuffle_beats, shuffle_groups): groups.setdefault(group, []).append(position)
+    for positions in groups.values():
+        chain[:, positions] = generator.permuted(np.tile(positions, (loops, 1)), axis = 1)
+    if len(groups) > 0: start, stop, direction, source, valid, skip = (np.take_along_axis(i, chain, axis = 1) for i in (start, stop, direction, source, valid, skip))
+    operator = np.array([c_join.index(i) for i in operators[:len(beats)]])
+    intro = int(_bounds(np.array([0]), np.array([beatmap[0]]), audio.shape[-1])[1][0]) if len(beatmap) > 0 else audio.shape[-1]
+    instrument.stop(timer)
+    return schedule(start, stop, direction, source, chain, valid, skip, operator, sources, beats, intro, c_misc, c_join)
+
+def _view(plan: schedule, piece: tuple) -> np.ndarray:
+    source, start, stop, direction, clip = piece
+    return plan.sources[source][:, start:stop] if direction == 1 else plan.sources[source][:, start:stop][:, ::-1]
+
+def _partitions(plan: schedule, effect_free: list, limit_beats, workers: int = 1) -> list:
+    """Beats with effects as lists of (loop, beat) that have the same effects, split into `workers` ranges of loops.
+    Loops after the one where `limit_beats` is probably reached are left out, the render applies effects to any beat that isn't in a partition when it gets to it."""
+    lengths = plan.stop - plan.start
+    rendered = plan.valid & ~plan.skip & (lengths >= 1)
+    needed = rendered & ~np.array(effect_free)[plan.chain]
+    if limit_beats is not None:
+        appended = np.cumsum(np.sum(rendered & (plan.operator == 0)[None, :], axis = 1))
+        needed[np.searchsorted(appended, limit_beats) + 1:] = False
+    groups = {}
+    for n, num in zip(*np.nonzero(needed)):
+        key = tuple((e[0], e[1]) for e in plan.beats[plan.chain[n, num]][1])
+        groups.setdefault(key, []).append((int(n), int(num)))
+    return [part.tolist() for events in groups.values() for part in np.array_split(np.array(events), min(workers, len(events))) if len(part) > 0]
+
+def _apply(plan: schedule, events: list, effects: dict) -> dict:
+    """{(loop, beat): beat with effects, clipped}. All `events` have the same effects, so they are concatenated and every effect
+    that has a batched version in `effects.BM_BATCHED` is applied to all of them in one call. The rest are applied beat by beat."""
+    from .main import _apply_effects
+    from .effects import BM_BATCHED
+    events = [tuple(i) for i in events]
+    pieces = [_view(plan, (int(plan.source[n, num]), int(plan.start[n, num]), int(plan.stop[n, num]), int(plan.direction[n, num]), True)) for n, num in events]
+    chain = plan.beats[plan.chain[events[0]]][1]
+    audio, offsets = None, np.concatenate(([0], np.cumsum([i.shape[1] for i in pieces])))
+    done = 0
+    for e in chain:
+        if e[0] in effects:
+            batched = BM_BATCHED.get(effects[e[0]])
+            if batched is None: break
+            if audio is None: audio = np.concatenate(pieces, axis = 1)
+            v = utils._safer_eval(e[1]) if isinstance(e[1], str) else e[1]
+            batch = batched(audio, offsets, v)
+            if batch is None: break
+            audio, offsets = batch
+        done += 1
+    bounds = list(zip(offsets[:-1].tolist(), offsets[1:].tolist()))
+    if done == len(chain):
+        instrument.count('effects_batched', len(events))
+        audio = np.clip(audio, -1, 1)
+        return {event: audio[:, a:b] for event, (a, b) in zip(events, bounds)}
+    if audio is not None: pieces = [audio[:, a:b] for a, b in bounds]
+    return {event: np.clip(_apply_effects(piece, chain[done:], effects, None, plan.c_misc), -1, 1) for event, piece in zip(events, pieces)}
+
+def _concatenate(arrays: list, workers: int = None) -> np.ndarray:
+    """`np.concatenate(arrays, axis = 1)`, with `workers` threads copying parts of the output"""
+    if workers is None or workers <= 1 or len(arrays) < workers or len(set(i.shape[0] for i in arrays)) != 1: return np.concatenate(arrays, axis = 1)
+    from concurrent.futures import ThreadPoolExecutor
+    offsets = np.concatenate(([0], np.cumsum([i.shape[1] for i in arrays]))).tolist()
+    output = np.empty((arrays[0].shape[0], offsets[-1]), dtype = np.result_type(*arrays))
+    def copy(part):
+        for i in part: output[:, offsets[i]:offsets[i+1]] = arrays[i]
+    with ThreadPoolExecutor(max_workers = workers) as executor: list(executor.map(copy, np.array_split(np.arange(len(arrays)), workers)))
+    return output
+
+def render(plan: schedule, effects: dict = None, smoothing: int = 100, limit_beats = 10000, limit_length = 52920000, workers: int = None) -> np.ndarray:
+    """Renders a schedule. Beats without effects stay views of their source until they are all concatenated into the output.
+
+    Beats with the same effects get them applied together, see `_apply`.
+    `workers` - threads that apply effects to ranges of loops and copy beats into the output, numpy releases the GIL for both.
+    Random numbers are all drawn by `build`, and limits, retries and joins are applied in order afterwards, so the output doesn't depend on `workers`."""
+    from .main import _join
+    from .effects import BM_EFFECTS
+    if effects is None: effects = BM_EFFECTS
+    token, recorders = cancel.current(), instrument.current()
+    timer = instrument.start('render')
+    effect_free = [not any(e[0] in effects for e in b[1]) for b in plan.beats]
+    rendered = {}
+    partitions = _partitions(plan, effect_free, limit_beats, 1 if workers is None else workers)
+    def apply(events):
+        with cancel.scope(token), instrument.scope(recorders):
+            cancel.check()
+            return _apply(plan, events, effects)
+    if workers is not None and workers > 1 and len(partitions) > 1:
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(max_workers = workers) as executor:
+            for part in executor.map(apply, partitions): rendered.update(part)
+    else:
+        for events in partitions: rendered.update(apply(events))
+    # pieces are (source, start, stop, direction, clip) until something has to change them in place
+    def view(piece): return _view(plan, piece)
+    def materialize(piece):
+        if not isinstance(piece, tuple): return piece
+        return np.clip(view(piece), -1, 1) if piece[4] is True else view(piece).copy()
+
+    result = [(0, 0, plan.intro, 1, False)]
+    allocations = 0
+    tries = 0
+    total_length = 0
+    stop = False
+    starts, stops, directions, source_ids, chains, valid, skip = (i.tolist() for i in (plan.start, plan.stop, plan.direction, plan.source, plan.chain, plan.valid, plan.skip))
+    operators = plan.operator.tolist()
+    for n in range(plan.loops):
+        if token is not None: token.check('render', n, plan.loops)
+        for num in range(len(operators)):
+            if limit_beats is not None and len(result) >= limit_beats:
+                stop = True
+                break
+            if skip[n][num]: continue
+            if not valid[n][num]:
+                tries += 1
+                if tries > 30: break
+                continue
+            length = stops[n][num] - starts[n][num]
+            if length < 1: continue
+            chain = chains[n][num]
+            beat = (source_ids[n][num], starts[n][num], stops[n][num], directions[n][num], True)
+            if not effect_free[chain]:
+                beat = rendered.pop((n, num)) if (n, num) in rendered else _apply(plan, [(n, num)], effects)[(n, num)]
+                length = len(beat[0])
+                allocations += 1
+            if limit_length is not None:
+                total_length += length
+                if total_length >= limit_length:
+                    stop = True
+                    break
+            if operators[num] == 0: result.append(beat)
+            elif tries < 2:
+                result[-1] = materialize(result[-1])
+                _join(result, materialize(beat), plan.c_join[operators[num]], plan.c_join)
+                allocations += 2
+        if stop is True: break
+    del rendered
+    instrument.stop(timer)
+    instrument.count('beats_rendered', len(result) - 1)
+
+    timer = instrument.start('concatenate')
+    # sources that are already within -1, 1 don't need clipping
+    clipped = {}
+    arrays = []
+    for piece in result:
+        if isinstance(piece, tuple):
+            source, clip = piece[0], piece[4]
+            if clip is True and source not in clipped: clipped[source] = bool(np.max(np.abs(plan.sources[source])) > 1) if plan.sources[source].size > 0 else False
+            piece = materialize(piece) if clip is True and clipped[source] else view(piece)
+        arrays.append(piece)
+    output = _concatenate(arrays, workers)
+    instrument.stop(timer)
+    instrument.count('allocations', allocations + 1)
+
+    del result
+    timer = instrument.start('smoothing')
+    smooth(output, [i.shape[1] for i in arrays], smoothing)
+    instrument.stop(timer)
+    return output
+
+def smooth(output: np.ndarray, lengths: list, smoothing: int = 100, block: int = 4096):
+    """Same smoothing as `song._render_reference` does between beats, on the concatenated output, in place.
+    Every boundary reads samples that no other boundary changes, so they are all measured and smoothed at once, `block` boundaries at a time."""
+    lengths = np.asarray(lengths)
+    if len(lengths) < 2: return
+    ends = np.cumsum(lengths)[:-1]
+    # beats shorter than 2 samples aren't smoothed
+    keep = (lengths[:-1] >= 2) & (lengths[1:] >= 2)
+    ends, own = ends[keep], lengths[:-1][keep]
+    token = cancel.current()
+    for i in range(0, len(ends), block):
+        if token is not None: token.check('smoothing', i, len(ends))
+        _smooth(output, ends[i:i+block], own[i:i+block], smoothing)
+
+def _smooth(output: np.ndarray, ends: np.ndarray, own: np.ndarray, smoothing: int):
+    left = output[0]
+    current1, current2, following1, following2 = left[ends - 2], left[ends - 1], left[ends], left[ends + 1]
+    num = (np.abs(following1 - (current2 + (current2 - current1))) + np.abs(current2 - (following1 + (following1 - following2)))).astype(np.float64) / 2
+    num = np.where(num > 0, np.trunc(smoothing * num), 0).astype(np.int64)
+    # the reference render gets a ValueError and skips beats that are shorter than the smoothed part
+    apply = (num > 3) & (num <= own)
+    ends, counts, values = ends[apply], num[apply], following1[apply].astype(np.float64)
+    if len(counts) == 0: return
+    # smoothed parts don't overlap, so they are all done at once, sample k of a part that is `size` long is at `position`
+    local = np.arange(np.sum(counts)) - np.repeat(np.cumsum(counts) - counts, counts)
+    size = np.repeat(counts, counts)
+    position = np.repeat(ends - counts, counts) + local
+    # cubic spline from 0 to `value` with zero slope at both ends, and `np.linspace(1, 0, size)**0.5`
+    t = local / (size + 1)
+    line = np.repeat(values, counts) * t * t * (3 - 2 * t)
+    line2 = np.where(local == size - 1, 0., local * (-1 / np.maximum(size - 1, 1)) + 1)**0.5
+    # rounded to the output type in between, like `*=` and `+=` on each beat
+    output[:2, position] = (output[:2, position] * line2).astype(output.dtype, copy = False) + line
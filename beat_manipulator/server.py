@@ -0,0 +1,238 @@
+"""Long running worker that keeps beat detection models loaded, and songs, beatmaps and parsed patterns in memory between jobs.
+
+```
+python -m beat_manipulator.server --http 8765 --warm madmom.BeatDetectionProcessor
+python -m beat_manipulator.server --stdio
+```
+Jobs are JSON objects with `type` and its arguments, responses are `{"id": ..., "ok": true, "result": ..., "error": null, "time": 0.05}`.
+- `beatswap` - `audio` (path), `pattern`, `scale`, `shift`, `length`, `lib`, `output` (path to write to, if not given, result has base64 encoded wav in `wav`)
+- `image` - `audio`, `scale`, `shift`, `lib`, `output`
+- `osu` - `audio`, `lib`, `output`
+- `beatmap` - `audio`, `lib`, returns beat positions in samples
+- `warmup` - `libs`, `ping`, `stats`, `shutdown`
+
+Any job can have `deadline` - seconds after which it is stopped. A stopped job's response has `cancelled` with how far it got.
+
+Over HTTP jobs are POSTed to `/`, `GET /stats` returns cache statistics. Only listens on 127.0.0.1.
+Over stdio every line is a job and every response is a line.
+
+From python, `client('http://127.0.0.1:8765').call('beatswap', audio = 'song.mp3', pattern = '1, 3, 2, 4', output = 'out.wav')`
+or `stdio_client()`, which starts the worker as a subprocess."""
+import os, sys, json, time, copy
+import numpy as np
+from . import utils
+
+class worker:
+    """Runs jobs, caching songs by path, modification time and size, beatmaps by song and lib, and parsed patterns.
+
+    Cache sizes are numbers of items; songs are the only big ones."""
+    def __init__(self, songs: int = 8, beatmaps: int = 64, patterns: int = 256, log = False):
+        self.songs = utils._lru(songs)
+        self.beatmaps = utils._lru(beatmaps)
+        self.patterns = utils._lru(patterns)
+        self.log = log
+        self.jobs = 0
+        self.running = True
+
+    def warmup(self, libs = ('madmom.BeatDetectionProcessor',)):
+        from . import beatmap
+        beatmap.warmup(libs)
+
+    def _song_key(self, path: str) -> tuple:
+        assert isinstance(path, str), f'audio must be a path, not {type(path)}'
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        return (path, stat.st_mtime_ns, stat.st_size)
+
+    def decoded(self, path: str):
+        """Returns a copy of the cached song without a beatmap, for jobs that detect beats themselves"""
+        from . import main
+        key = self._song_key(path)
+        return copy.copy(self.songs.get_or_set(key, lambda: main.song(key[0], log = self.log)))
+
+    def song(self, path: str, lib: str = 'madmom.BeatDetectionProcessor'):
+        """Returns a copy of the cached song with its beatmap from `lib`. The copy shares audio with the cache, so it shouldn't be changed in place."""
+        key = self._song_key(path)
+        cached = self.decoded(path)
+        def generate():
+            result = copy.copy(cached)
+            result.beatmap_generate(lib = lib)
+            return result.beatmap, result.normalized
+        beatmap, normalized = self.beatmaps.get_or_set((key, lib), generate)
+        result = copy.copy(cached)
+        result.beatmap, result.beatmap_default, result.normalized, result.lib = beatmap.copy(), beatmap.copy(), normalized, lib
+        return result
+
+    def pattern(self, pattern: str, length = None, sr: int = None):
+        """Returns parsed pattern with samples at `sr`, special patterns like `reverse` and `random` aren't parsed"""
+        if pattern.lower() in ('reverse', 'shuffle', 'test', 'random'): return pattern
+        from . import parse
+        from .presets import BM_SAMPLES
+        from . import assets
+        return self.patterns.get_or_set((pattern, length, sr), lambda: parse.parse(pattern = pattern, samples = assets.resolve(pattern, BM_SAMPLES, sr), pattern_length = length, log = False, sr = sr))
+
+    def beatswap(self, audio: str, pattern: str, scale = 1, shift = 0, length = None, lib = 'madmom.BeatDetectionProcessor', output: str = None) -> dict:
+        from . import io
+        song = self.song(audio, lib)
+        result = song.beatswap(self.pattern(pattern, length, song.sr), scale = utils._safer_eval(scale), shift = utils._safer_eval(shift), return_audio = True)
+        if output is not None:
+            io.write_audio(result, song.sr, output, log = self.log)
+            return {'output': output, 'sr': song.sr, 'length': result.shape[1]}
+        import base64
+        from . import writer
+        return {'wav': base64.b64encode(writer.encode(result, song.sr, 'wav')['wav']).decode('ascii'), 'sr': song.sr, 'length': result.shape[1]}
+
+    def image(self, audio: str, output: str, scale = 1, shift = 0, lib = 'madmom.BeatDetectionProcessor', mode = 'median', max_size = 4096) -> dict:
+        from . import beatmap as bm_beatmap
+        from .image import generate, write
+        song = self.song(audio, lib)
+        beatmap = bm_beatmap.scale(bm_beatmap.shift(song.beatmap, utils._safer_eval(shift), log = False), utils._safer_eval(scale), log = False)
+        image = generate(song, beatmap = beatmap, mode = mode, log = self.log)
+        write(image, output = output, mode = 'color', max_size = max_size)
+        return {'output': output}
+
+    def osu(self, audio: str, output: str, lib = 'madmom.MultiModelSelectionProcessor') -> dict:
+        from . import osu
+        # osu.generate runs its own beat detection, so the song's beatmap isn't generated here
+        return {'output': osu.generate(self.decoded(audio), lib = lib, log = self.log, output = output)}
+
+    def beatmap(self, audio: str, lib = 'madmom.BeatDetectionProcessor') -> list:
+        return self.song(audio, lib).beatmap.tolist()
+
+    def stats(self) -> dict:
+        from . import assets
+        return {'jobs': self.jobs, 'songs': self.songs.stats(), 'beatmaps': self.beatmaps.stats(), 'patterns': self.patterns.stats(), 'assets': assets.stats()}
+
+    def handle(self, job: dict) -> dict:
+        """Runs one job, never raises. Errors are returned in `error`."""
+        from . import cancel
+        start = time.perf_counter()
+        job = dict(job)
+        job_id = job.pop('id', None)
+        job_type = job.pop('type', None)
+        deadline = job.pop('deadline', None)
+        try:
+            with cancel.scope(cancel.token(deadline) if deadline is not None else cancel.current()):
+                if job_type == 'ping': result = 'pong'
+                elif job_type == 'stats': result = self.stats()
+                elif job_type == 'warmup': result = self.warmup(**job)
+                elif job_type == 'shutdown':
+                    self.running = False
+                    result = None
+                elif job_type in ('beatswap', 'image', 'osu', 'beatmap'): result = getattr(self, job_type)(**job)
+                else: raise ValueError(f'Unknown job type `{job_type}`, available types: beatswap, image, osu, beatmap, warmup, ping, stats, shutdown')
+            self.jobs += 1
+            return {'id': job_id, 'ok': True, 'result': result, 'error': None, 'time': time.perf_counter() - start}
+        except cancel.Cancelled as e:
+            cancel.release(e)
+            return {'id': job_id, 'ok': False, 'result': None, 'error': f'Cancelled: {e}', 'cancelled': e.progress, 'time': time.perf_counter() - start}
+        except Exception as e:
+            return {'id': job_id, 'ok': False, 'result': None, 'error': f'{type(e).__name__}: {e}', 'time': time.perf_counter() - start}
+
+def serve_stdio(w: worker = None, stdin = None, stdout = None):
+    """Reads one JSON job per line from stdin, writes one JSON response per line to stdout, until `shutdown` or end of input"""
+    if w is None: w = worker()
+    stdin = stdin or sys.stdin
+    stdout = stdout or sys.stdout
+    # anything the library prints goes to stderr, so that stdout only has responses
+    sys_stdout, sys.stdout = sys.stdout, sys.stderr
+    try:
+        for line in stdin:
+            if line.strip() == '': continue
+            try: job = json.loads(line)
+            except ValueError as e: response = {'id': None, 'ok': False, 'result': None, 'error': f'Invalid JSON: {e}', 'time': 0}
+            else: response = w.handle(job)
+            stdout.write(json.dumps(response) + '\n')
+            stdout.flush()
+            if w.running is False: break
+    finally: sys.stdout = sys_stdout
+
+def serve_http(w: worker = None, port: int = 8765, host: str = '127.0.0.1'):
+    """Serves jobs over HTTP until `shutdown`. Each request runs in its own thread."""
+    from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+    import threading
+    if w is None: w = worker()
+
+    class handler(BaseHTTPRequestHandler):
+        def _send(self, code: int, response):
+            body = json.dumps(response).encode('utf-8')
+            self.send_response(code)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path.rstrip('/') in ('/stats', ''): self._send(200, w.handle({'type': 'stats'}))
+            elif self.path.rstrip('/') == '/ping': self._send(200, w.handle({'type': 'ping'}))
+            else: self._send(404, {'id': None, 'ok': False, 'result': None, 'error': f'Not found: {self.path}', 'time': 0})
+
+        def do_POST(self):
+            try: job = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+            except ValueError as e: return self._send(400, {'id': None, 'ok': False, 'result': None, 'error': f'Invalid JSON: {e}', 'time': 0})
+            self._send(200, w.handle(job))
+            if w.running is False: threading.Thread(target = server.shutdown, daemon = True).start()
+
+        def log_message(self, *args):
+            if w.log is True: super().log_message(*args)
+
+    server = ThreadingHTTPServer((host, port), handler)
+    if w.log is True: print(f'Listening on http://{host}:{server.server_address[1]}')
+    try: server.serve_forever()
+    finally: server.server_close()
+
+class client:
+    """Sends jobs to a worker served over HTTP. `call` returns the result or raises RuntimeError with the error."""
+    def __init__(self, url: str = 'http://127.0.0.1:8765', timeout: float = None):
+        self.url = url.rstrip('/')
+        self.timeout = timeout
+
+    def request(self, job: dict) -> dict:
+        import urllib.request
+        request = urllib.request.Request(self.url + '/', data = json.dumps(job).encode('utf-8'), headers = {'Content-Type': 'application/json'})
+        with urllib.request.urlopen(request, timeout = self.timeout) as response: return json.loads(response.read())
+
+    def call(self, type: str, **arguments):
+        response = self.request(dict(arguments, type = type))
+        if response['ok'] is not True: raise RuntimeError(response['error'])
+        return response['result']
+
+class stdio_client(client):
+    """Starts a worker as a subprocess and talks to it over stdin and stdout"""
+    def __init__(self, python: str = sys.executable, warm: list = ()):
+        import subprocess
+        command = [python, '-m', 'beat_manipulator.server', '--stdio']
+        if len(warm) > 0: command += ['--warm', *warm]
+        self.process = subprocess.Popen(command, stdin = subprocess.PIPE, stdout = subprocess.PIPE, text = True, bufsize = 1)
+        self.ids = 0
+
+    def request(self, job: dict) -> dict:
+        self.ids += 1
+        self.process.stdin.write(json.dumps(dict(job, id = self.ids)) + '\n')
+        self.process.stdin.flush()
+        line = self.process.stdout.readline()
+        if line == '': raise RuntimeError(f'Worker exited with code {self.process.wait()}')
+        return json.loads(line)
+
+    def close(self):
+        if self.process.poll() is None:
+            try: self.request({'type': 'shutdown'})
+            except (RuntimeError, OSError): pass
+            self.process.wait()
+
+    def __enter__(self): return self
+    def __exit__(self, *args): self.close()
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(prog = 'python -m beat_manipulator.server', description = 'Worker that keeps models, songs and beatmaps in memory between jobs')
+    parser.add_argument('--http', type = int, metavar = 'PORT', help = 'serve over HTTP on 127.0.0.1:PORT')
+    parser.add_argument('--stdio', action = 'store_true', help = 'read JSON jobs from stdin, one per line')
+    parser.add_argument('--warm', nargs = '*', default = (), metavar = 'LIB', help = 'beat detection libs to load before serving')
+    parser.add_argument('--songs', type = int, default = 8, help = 'how many songs to keep in memory')
+    parser.add_argument('--log', action = 'store_true')
+    args = parser.parse_args()
+    w = worker(songs = args.songs, log = args.log)
+    if len(args.warm) > 0: w.warmup(args.warm)
+    if args.stdio or args.http is None: serve_stdio(w)
+    else: serve_http(w, port = args.http)
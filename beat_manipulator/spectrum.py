@@ -0,0 +1,86 @@
+"""Short-time spectrum of a song, computed once per song and shared by spectral images, spectral metrics and anything else that needs it.
+
+```
+spec = your_song.spectrogram(hop = 512)     # cached on the song until its audio changes
+spec.band(30, 150)                          # low band energy in every frame
+spec.beats(your_song.beatmap, bands = 128)  # average spectrum of every beat in log-spaced bands
+```
+Magnitudes are float32 shaped (channels, frames, bins), frame i is centered on sample `i * hop`. FFT functions and windows come from `effects`,
+so pyfftw is used when it is installed."""
+import functools
+import numpy as np
+from . import instrument, cancel
+
+HOP = 512
+N_FFT = 2048
+
+@functools.lru_cache(maxsize = 8)
+def _window(n_fft: int) -> np.ndarray:
+    return np.hanning(n_fft + 1)[:-1].astype(np.float32)
+
+def stft(audio: np.ndarray, n_fft: int = N_FFT, hop: int = HOP) -> np.ndarray:
+    """Magnitude spectrum of every channel, shaped (channels, frames, bins). All frames of a channel go through one FFT call."""
+    from .effects import _fft
+    audio = np.asarray(audio, dtype = np.float32)
+    if audio.ndim == 1: audio = audio[np.newaxis]
+    window = _window(n_fft)
+    padded = np.pad(audio, ((0, 0), (n_fft // 2, n_fft // 2)))
+    frames = np.lib.stride_tricks.sliding_window_view(padded, n_fft, axis = 1)[:, ::hop]
+    result = np.empty((audio.shape[0], frames.shape[1], n_fft // 2 + 1), dtype = np.float32)
+    # a channel at a time, so that only one channel of windowed frames is in memory
+    for channel in range(audio.shape[0]):
+        cancel.check()
+        result[channel] = np.abs(_fft()[0](frames[channel] * window, axis = -1))
+    return result
+
+class spectrogram:
+    def __init__(self, magnitude: np.ndarray, sr: int, hop: int = HOP, n_fft: int = N_FFT):
+        self.magnitude = magnitude
+        self.sr = sr
+        self.hop = hop
+        self.n_fft = n_fft
+
+    @property
+    def frequencies(self) -> np.ndarray:
+        return np.arange(self.magnitude.shape[-1]) * self.sr / self.n_fft
+
+    def frame(self, samples) -> np.ndarray:
+        """Frames that sample positions fall in"""
+        return np.clip(np.rint(np.asarray(samples) / self.hop).astype(int), 0, self.magnitude.shape[1])
+
+    def band(self, low: float = 0, high: float = None, channel = None) -> np.ndarray:
+        """Energy between `low` and `high` hz in every frame, averaged over channels unless `channel` is given"""
+        frequencies = self.frequencies
+        mask = (frequencies >= low) & (frequencies < (high if high is not None else np.inf))
+        magnitude = self.magnitude if channel is None else self.magnitude[channel:channel+1]
+        return np.mean(np.sum(magnitude[:, :, mask]**2, axis = 2), axis = 0)
+
+    def bands(self, count: int = 128, low: float = 30) -> np.ndarray:
+        """Magnitude summed into `count` log-spaced bands from `low` hz up, shaped (channels, frames, bands)"""
+        edges = np.unique(np.searchsorted(self.frequencies, np.geomspace(low, self.sr / 2, count + 1)[:-1]))
+        return np.add.reduceat(self.magnitude, edges, axis = 2)
+
+    def beats(self, beatmap: np.ndarray, bands: int = 128, low: float = 30) -> np.ndarray:
+        """Average spectrum of every beat between beatmap positions in log-spaced bands, shaped (channels, beats, bands)"""
+        banded = self.bands(bands, low)
+        cumulative = np.concatenate((np.zeros_like(banded[:, :1]), np.cumsum(banded, axis = 1)), axis = 1)
+        frames = self.frame(beatmap)
+        starts, stops = frames[:-1], np.maximum(frames[1:], frames[:-1] + 1)
+        stops = np.minimum(stops, banded.shape[1])
+        return (cumulative[:, stops] - cumulative[:, starts]) / np.maximum(stops - starts, 1)[None, :, None]
+
+    def __repr__(self):
+        return f'spectrogram({self.magnitude.shape[1]} frames, {self.magnitude.shape[2]} bins, hop = {self.hop}, sr = {self.sr})'
+
+def get(song, hop: int = HOP, n_fft: int = N_FFT) -> spectrogram:
+    """Spectrogram of a song, cached on it. The cache is keyed by hop and FFT size, and dropped when `song.audio` is replaced."""
+    cache = song.__dict__.setdefault('_spectrograms', {})
+    key = (hop, n_fft)
+    if key in cache and cache[key][0] is song.audio: return cache[key][1]
+    timer = instrument.start('spectrum')
+    result = spectrogram(stft(song.audio, n_fft, hop), song.sr, hop, n_fft)
+    instrument.stop(timer)
+    # stale entries for old audio are dropped
+    for i in [i for i, (audio, _) in cache.items() if audio is not song.audio]: del cache[i]
+    cache[key] = (song.audio, result)
+    return result
@@ -0,0 +1,151 @@
+"""Beatmap as a piecewise constant tempo grid, with scale and shift that don't rebuild anything.
+
+```
+grid = bm.tempogrid.fit(song.beatmap)
+grid.positions([1, 4.5, 8.25]) # beat indexes to samples
+grid.beats([44100, 88200])      # samples to beat indexes
+half = grid.scale(0.5).shift(1) # new grid, same segments
+half.array()                     # integer beatmap like `beatmap.scale(beatmap.shift(...))` returns
+```
+A grid is a few tempo segments, each with the beat it starts on, the sample position of that beat and samples per beat,
+plus the residual of every detected beat from the grid. With `exact = True` (the default) lookups interpolate between detected beats,
+just like fractional indexes in `song`, with `exact = False` they follow the regular grid.
+
+Scale and shift only change how new beat indexes map to beat indexes of the fitted beatmap (`index = step * beat + offset`),
+so they take the same time for any length of audio. Fractional shift followed by fractional scale interpolates once between detected beats,
+while `beatmap.scale` of a shifted beatmap interpolates between already interpolated beats, so those can differ by a fraction of a beat. Near the start, where a beatmap made by `beatmap.shift` with negative shift would
+have beats inserted in between the first two beats, a grid extrapolates the first segment instead.
+A grid has as many beats as the beatmap shifted by `offset` and then scaled by `step` (`beatmap.scale(beatmap.shift(beatmap, offset), step)`)."""
+import numpy as np
+
+# arrays a grid is made of, in the order `tempogrid` takes them
+ARRAYS = ('starts', 'offsets', 'periods', 'residuals')
+
+class tempogrid:
+    def __init__(self, starts: np.ndarray, offsets: np.ndarray, periods: np.ndarray, residuals: np.ndarray, step: float = 1, offset: float = 0):
+        self.starts = np.asarray(starts, dtype = int) # beat index where each segment starts
+        self.offsets = np.asarray(offsets, dtype = float) # sample position of that beat on the grid
+        self.periods = np.asarray(periods, dtype = float) # samples per beat in each segment
+        self.residuals = np.asarray(residuals, dtype = np.float32) # detected beat - grid beat
+        self.step = step
+        self.offset = offset
+
+    @property
+    def size(self) -> int:
+        """Number of beats in the fitted beatmap"""
+        return len(self.residuals)
+
+    def __len__(self) -> int:
+        """Same number of beats as `beatmap.scale(beatmap.shift(beatmap, offset), step)`"""
+        # positive shift removes whole beats, negative shift inserts them
+        size = max(self.size - int(np.floor(self.offset)) if self.offset >= 0 else self.size + int(-self.offset // 1), 0)
+        if self.step == 1: return size
+        if self.step % 1 == 0: return -(-size // int(self.step))
+        # fractional steps stop before the last beat, `beatmap.scale` adds them up one by one, so they are added up the same way
+        count = int(np.ceil((size - 1) / self.step)) + 2 if size > 1 else 0
+        return int(np.count_nonzero(np.concatenate(([0.], np.add.accumulate(np.full(count, self.step)))) + 1 < size))
+
+    def _index(self, beats) -> np.ndarray:
+        return np.asarray(beats, dtype = float) * self.step + self.offset
+
+    def _grid(self, index: np.ndarray) -> np.ndarray:
+        segment = np.clip(np.searchsorted(self.starts, index, side = 'right') - 1, 0, len(self.starts) - 1)
+        return self.offsets[segment] + (index - self.starts[segment]) * self.periods[segment]
+
+    def _detected(self, index: np.ndarray) -> np.ndarray:
+        """Positions of integer beat indexes of the fitted beatmap"""
+        return self._grid(index) + self.residuals[np.clip(index, 0, self.size - 1)]
+
+    def _positions(self, index: np.ndarray, exact = True) -> np.ndarray:
+        if exact is False or self.size < 2: return self._grid(index)
+        first = np.clip(np.floor(index).astype(int), 0, self.size - 2)
+        fraction = index - first
+        start = self._detected(first)
+        result = start + fraction * (self._detected(first + 1) - start)
+        # outside of the fitted beatmap, the grid is extended from the first and last beats
+        result = np.where(index < 0, self._grid(index) + self.residuals[0], result)
+        return np.where(index > self.size - 1, self._grid(index) + self.residuals[-1], result)
+
+    def positions(self, beats, exact = True) -> np.ndarray:
+        """Sample positions of (fractional) beat indexes"""
+        return self._positions(self._index(beats), exact)
+
+    def __getitem__(self, beats):
+        """Integer sample positions, so that a grid can be indexed like a beatmap"""
+        result = np.rint(self.positions(beats))
+        return int(result) if np.ndim(result) == 0 else result.astype(int)
+
+    def beats(self, samples, exact = True) -> np.ndarray:
+        """Fractional beat indexes of sample positions"""
+        samples = np.asarray(samples, dtype = float)
+        segment = np.clip(np.searchsorted(self.offsets, samples, side = 'right') - 1, 0, len(self.starts) - 1)
+        index = self.starts[segment] + (samples - self.offsets[segment]) / self.periods[segment]
+        if exact is True and self.size >= 2:
+            # residuals are small compared to a beat, so the grid guess is at most a beat or two away
+            first = np.clip(np.floor(index).astype(int), 0, self.size - 2)
+            for _ in range(3):
+                first = np.clip(first - (samples < self._detected(first)) + (samples >= self._detected(first + 1)), 0, self.size - 2)
+            start, stop = self._detected(first), self._detected(first + 1)
+            inside = first + (samples - start) / np.maximum(stop - start, 1e-9)
+            low, high = self._detected(np.array([0, self.size - 1]))
+            index = np.where((samples >= low) & (samples <= high), inside, index)
+        return (index - self.offset) / self.step
+
+    def scale(self, scale: float) -> 'tempogrid':
+        """Same as `beatmap.scale` - `scale = 0.5` puts a beat between every two beats, `scale = 2` keeps every second beat"""
+        from . import utils
+        if isinstance(scale, str): scale = utils._safer_eval(scale)
+        assert scale > 0, f"scale should be > 0, your scale is {scale}"
+        return tempogrid(self.starts, self.offsets, self.periods, self.residuals, self.step * scale, self.offset)
+
+    def shift(self, shift: float) -> 'tempogrid':
+        """Same as `beatmap.shift` - positive shift removes beats from the beginning, fractional shift moves every beat by part of a beat"""
+        from . import utils
+        if isinstance(shift, str): shift = utils._safer_eval(shift)
+        return tempogrid(self.starts, self.offsets, self.periods, self.residuals, self.step, self.offset + self.step * shift)
+
+    def tempo(self, sr: int) -> np.ndarray:
+        """Beats per minute of every segment, in beats of this grid"""
+        return 60 * sr / (self.periods * self.step)
+
+    def array(self, exact = True) -> np.ndarray:
+        """Integer beatmap with every beat of the grid. Like `beatmap.shift`, beats past the last fitted beat stay on it"""
+        return np.rint(self._positions(np.minimum(self._index(np.arange(len(self))), self.size - 1), exact)).astype(int)
+
+    def __array__(self, dtype = None, copy = None):
+        result = self.array()
+        return result if dtype is None else result.astype(dtype)
+
+    def __repr__(self):
+        return f'tempogrid({len(self)} beats, {len(self.starts)} tempo segments, step = {self.step}, offset = {self.offset})'
+
+def fit(beatmap: np.ndarray, tolerance: float = 0.03, window: int = 5, min_beats: int = 4) -> tempogrid:
+    """Fits tempo segments to a beatmap. A new segment starts where the median beat length over `window` beats
+    differs from the median at the start of the segment by more than `tolerance` (relative). Segments are at least `min_beats` long."""
+    beatmap = np.sort(np.asarray(beatmap, dtype = float))
+    size = len(beatmap)
+    assert size >= 2, f'beatmap needs at least 2 beats to fit a tempo grid, it has {size}'
+    intervals = np.diff(beatmap)
+    half = min(window // 2, len(intervals) - 1)
+    padded = np.pad(intervals, half, mode = 'edge')
+    smooth = np.median(np.lib.stride_tricks.sliding_window_view(padded, 2 * half + 1), axis = 1)
+    log_smooth = np.log(np.maximum(smooth, 1e-9))
+
+    starts = [0]
+    while True:
+        changes = np.flatnonzero(np.abs(log_smooth[starts[-1]:] - log_smooth[starts[-1]]) > tolerance)
+        if len(changes) == 0: break
+        start = starts[-1] + max(int(changes[0]), min_beats)
+        if size - 1 - start < min_beats: break
+        starts.append(start)
+
+    bounds = starts + [size - 1]
+    offsets, periods = [], []
+    for first, last in zip(bounds[:-1], bounds[1:]):
+        index = np.arange(first, last + 1)
+        period, intercept = np.polyfit(index, beatmap[first : last + 1], 1)
+        offsets.append(intercept + period * first)
+        periods.append(period)
+    grid = tempogrid(starts, offsets, periods, np.zeros(size))
+    grid.residuals = (beatmap - grid._grid(np.arange(size))).astype(np.float32)
+    return grid
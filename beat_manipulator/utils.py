@@ -1,3 +1,8 @@
+import os
+PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))
+BEATMAPS_DIR = os.path.join(PACKAGE_DIR, 'beatmaps') # cached beatmaps and their settings
+RENDERS_DIR = os.path.join(PACKAGE_DIR, 'renders') # cached encoded renders, see `cache`
+
 C_SLICE = ":><"  # 0 - range, 1 - first, 2 - last
 C_JOIN = ",;~&^$}" # 0 - append, 1 - first length, 2 - cut, 3 - maximum, 4 - sidechain
 C_MISC = "'\"`i@_?%#![]"
@@ -7,6 +12,11 @@ C_MISC = "'\"`i@_?%#![]"
 C_MATH = '+-*/.'
 C_MATH_STRICT = '.+-*/'
 
+def _makedirs(path:str):
+    """Creates the folder that file `path` goes into, if it doesn't exist"""
+    folder = os.path.dirname(path)
+    if folder != '' and not os.path.isdir(folder): os.makedirs(folder, exist_ok=True)
+
 def _safer_eval(string:str) -> float:
     if isinstance(string, str): 
         try:
@@ -23,3 +33,47 @@ def _safer_eval_strict(string:str) -> float:
             assert v in C_MATH_STRICT or v == ' ' or v.isdecimal, f"_safer_eval_strict error: {string}[{n}] = {v}, which isn't a decimal, isn't in {C_MATH_STRICT} and isn't a space"
         string = eval(''.join([i for i in string if i.isdecimal() or i in C_MATH_STRICT]))
     return string
+
+class _lru:
+    """Thread safe dict that keeps at most `size` most recently used items. `size = None` keeps everything."""
+    def __init__(self, size: int = 16):
+        from collections import OrderedDict
+        import threading
+        self.size = size
+        self.items = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.RLock()
+
+    def get(self, key, default = None):
+        with self._lock:
+            if key in self.items:
+                self.items.move_to_end(key)
+                self.hits += 1
+                return self.items[key]
+            self.misses += 1
+            return default
+
+    def set(self, key, value):
+        with self._lock:
+            self.items[key] = value
+            self.items.move_to_end(key)
+            while self.size is not None and len(self.items) > self.size: self.items.popitem(last = False)
+
+    def get_or_set(self, key, function):
+        """Returns cached value of `key`, or calls `function()`, caches and returns its result. `function` runs outside of the lock."""
+        sentinel = object()
+        value = self.get(key, sentinel)
+        if value is sentinel:
+            value = function()
+            self.set(key, value)
+        return value
+
+    def clear(self):
+        with self._lock: self.items.clear()
+
+    def __contains__(self, key): return key in self.items
+    def __len__(self): return len(self.items)
+
+    def stats(self) -> dict:
+        return {'items': len(self.items), 'size': self.size, 'hits': self.hits, 'misses': self.misses}
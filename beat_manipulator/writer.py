@@ -0,0 +1,175 @@
+"""Encodes rendered audio on a background thread, so that the next render can start while the previous one is written.
+
+```
+with bm.writer.writer() as w:
+    for pattern in patterns:
+        audio = song.beatswap(pattern, return_audio = True)
+        w.submit(audio, song.sr, [f'{pattern}.mp3', f'{pattern}.flac'])
+```
+One render can be encoded into several outputs - file paths, where the format comes from the extension, and `pcm16` or `wav` for bytes in memory.
+Audio is converted to 16 bit once and shared by every 16 bit output (wav, flac, `pcm16`); mp3 and ogg are encoded from the float audio.
+
+The library used for each format is picked once, from the first library in `BACKENDS` that is installed and supports it."""
+import os, threading
+import numpy as np
+from . import instrument, utils
+
+# libraries to try for each format, in order of preference. `wave` is python's built in wav writer.
+BACKENDS = {'wav': ('soundfile', 'pedalboard.io', 'wave'),
+            'flac': ('soundfile', 'pedalboard.io'),
+            'mp3': ('pedalboard.io', 'soundfile'),
+            'ogg': ('soundfile', 'pedalboard.io'),
+            }
+DEFAULT_BACKENDS = ('pedalboard.io', 'soundfile')
+# outputs that are returned as bytes instead of written to a file
+BYTES_FORMATS = ('pcm16', 'wav')
+# formats that are written from 16 bit audio when the library allows it
+PCM16_FORMATS = ('wav', 'flac', 'aiff')
+
+_backends = {} # (format, libs): chosen library
+_lock = threading.Lock()
+
+def pcm16(audio: np.ndarray) -> np.ndarray:
+    """Interleaved 16 bit audio, shaped (samples, channels)"""
+    return (np.clip(np.asarray(audio, dtype = np.float32), -1, 1).T * 32767).astype('<i2')
+
+def wav_bytes(pcm: np.ndarray, sr: int) -> bytes:
+    """16 bit wav file in memory, from `pcm16` audio"""
+    import wave, io as _io
+    buffer = _io.BytesIO()
+    with wave.open(buffer, 'wb') as f:
+        f.setnchannels(pcm.shape[1])
+        f.setsampwidth(2)
+        f.setframerate(int(sr))
+        f.writeframes(np.ascontiguousarray(pcm).tobytes())
+    return buffer.getvalue()
+
+def _format(output: str) -> str:
+    return os.path.splitext(output)[1].lstrip('.').lower()
+
+def _supports(lib: str, format: str) -> bool:
+    try:
+        if lib == 'wave': return format == 'wav'
+        if lib == 'soundfile':
+            import soundfile
+            return format.upper() in soundfile.available_formats()
+        if lib == 'pedalboard.io':
+            import pedalboard.io
+            formats = getattr(pedalboard.io, 'get_supported_write_formats', None)
+            return formats is None or f'.{format}' in formats()
+    except ImportError: return False
+    return False
+
+def backend(format: str, libs: tuple = None) -> str:
+    """Library that writes `format`, chosen the first time it is needed"""
+    if libs is None: libs = BACKENDS.get(format, DEFAULT_BACKENDS)
+    key = (format, tuple(libs))
+    with _lock:
+        if key not in _backends:
+            for lib in libs:
+                if _supports(lib, format):
+                    _backends[key] = lib
+                    break
+            else: raise ValueError(f'None of {libs} can write `.{format}` files')
+        return _backends[key]
+
+def _write(lib: str, audio: np.ndarray, sr: int, output: str, pcm: np.ndarray = None):
+    """Writes a file with `lib`. `pcm` is the 16 bit version of `audio`, used for 16 bit formats if given."""
+    format = _format(output)
+    utils._makedirs(output)
+    timer = instrument.start('encode')
+    if lib == 'wave':
+        with open(output, 'wb') as f: f.write(wav_bytes(pcm if pcm is not None else pcm16(audio), sr))
+    elif lib == 'soundfile':
+        import soundfile
+        if format in PCM16_FORMATS and pcm is not None: soundfile.write(output, pcm, sr, subtype = 'PCM_16')
+        else: soundfile.write(output, np.asarray(audio).T, sr)
+    elif lib == 'pedalboard.io':
+        import pedalboard.io
+        with pedalboard.io.AudioFile(output, 'w', sr, audio.shape[0]) as f:
+            f.write(np.asarray(audio, dtype = np.float32))
+    else: raise ValueError(f'Unknown library `{lib}`, available: wave, soundfile, pedalboard.io')
+    instrument.stop(timer)
+    instrument.count('samples_encoded', audio.shape[-1])
+
+def encode(audio: np.ndarray, sr: int, outputs, libs: tuple = None) -> dict:
+    """Encodes one render into every output in `outputs` - file paths, `pcm16` and `wav`. Returns a dict of output: path or bytes.
+
+    `libs` - libraries to choose from instead of `BACKENDS`. If the chosen library fails on a file, the others are tried."""
+    if isinstance(outputs, str): outputs = [outputs]
+    audio = np.asarray(audio)
+    sr = int(sr)
+    pcm = None
+    result = {}
+    for output in outputs:
+        if output.lower() in BYTES_FORMATS: format = output.lower()
+        else: format = _format(output)
+        # 16 bit audio is made once and shared by every 16 bit output
+        if pcm is None and format in BYTES_FORMATS + PCM16_FORMATS: pcm = pcm16(audio)
+        if output.lower() == 'pcm16': result[output] = pcm.tobytes()
+        elif output.lower() == 'wav': result[output] = wav_bytes(pcm, sr)
+        else:
+            format_libs = libs if libs is not None else BACKENDS.get(format, DEFAULT_BACKENDS)
+            lib = backend(format, format_libs)
+            try: _write(lib, audio, sr, output, pcm)
+            except Exception:
+                for other in format_libs:
+                    if other == lib or not _supports(other, format): continue
+                    try:
+                        _write(other, audio, sr, output, pcm)
+                        break
+                    except Exception: pass
+                else: raise
+            result[output] = output
+    return result
+
+class writer:
+    """Background thread that encodes submitted renders in order. At most `max_pending` renders wait to be encoded,
+    `submit` blocks when there are more, so that rendering can't run away from encoding and fill up memory.
+
+    `atomic = True` writes every file under a `.partial` name first and renames it when it is done."""
+    def __init__(self, max_pending: int = 4, atomic = False, log = False):
+        from concurrent.futures import ThreadPoolExecutor
+        self._pool = ThreadPoolExecutor(max_workers = 1, thread_name_prefix = 'beat_manipulator_writer')
+        self._pending = threading.BoundedSemaphore(max_pending)
+        self.atomic = atomic
+        self.log = log
+
+    def _encode(self, audio, sr, outputs, key = None, recorders = ()):
+        try:
+            with instrument.scope(recorders): return self._write(audio, sr, outputs, key)
+        finally: self._pending.release()
+
+    def _write(self, audio, sr, outputs, key = None):
+        names = {}
+        for output in outputs:
+            if self.atomic is False or output.lower() in BYTES_FORMATS: names[output] = output
+            else:
+                root, ext = os.path.splitext(output)
+                names[output] = f'{root}.partial{ext}'
+        encoded = encode(audio, sr, list(names.values()))
+        for output, name in names.items():
+            if name != output: os.replace(name, output)
+        if key is not None:
+            from . import cache
+            for output in outputs:
+                if output.lower() == 'wav': cache.put(key, encoded[output], 'wav')
+                elif output.lower() not in BYTES_FORMATS: cache.put(key, output)
+        if self.log is True: print(f'Wrote {", ".join(i for i in outputs if i.lower() not in BYTES_FORMATS)}')
+        return {output: (encoded[name] if name == output else output) for output, name in names.items()}
+
+    def submit(self, audio: np.ndarray, sr: int, outputs, key: str = None):
+        """Queues one render to be encoded into `outputs`. Returns a future with the dict that `encode` returns.
+        `key` - key of the render in `cache`, files are added to the cache when they are written."""
+        if isinstance(outputs, str): outputs = [outputs]
+        self._pending.acquire()
+        try: return self._pool.submit(self._encode, audio, sr, list(outputs), key, instrument.current())
+        except Exception:
+            self._pending.release()
+            raise
+
+    def close(self, wait = True):
+        self._pool.shutdown(wait = wait)
+
+    def __enter__(self): return self
+    def __exit__(self, *args): self.close()
@@ -5,39 +5,73 @@
 # if output not specified, it just goes to output folder
 # if input is not specified it opens a file selector
 # just "py -m beatman" will bring up a file selector and ask for pattern
+#
+# batch mode:
+# py -m beatman -i "songs/*.mp3" "other song.mp3" -l "list of songs.txt" -p "1, 3, 2, 4" "1, 2, 3, 4!" -preset "2x speed" -j 4
+# runs every input with every pattern and preset in 4 processes. List files have one path or glob per line.
+# outputs that already exist are skipped, and progress goes to a manifest (`-manifest`, by default `output/beatman manifest.json`),
+# so running the same command again after an interruption continues where it stopped. `-force` overwrites existing outputs.
 import beat_manipulator as bm, sys
 args = sys.argv
 #args=['whatevr', '-i', r'"F:\Stuff\Music\Tracks\e-veryday - e-verynight.mp3"', '--pattern', '1,3,2,4']
 args=[i.replace('--', '-') if i.startswith('-') else i for i in args]
 args=[i[1:-1] if (i.startswith('"') and i.endswith('"')) else i for i in args]
 def arg(a, args:list=args):
-    if a in args and len(args)>args.index(a):return args[args.index(a)+1]
+    if a in args and len(args)>args.index(a)+1:return args[args.index(a)+1]
 
-#input
-inp = arg('-i')
-if inp is None: inp = arg('-in')
-if inp is None: inp = arg('-input')
-if inp is None:
-    from tkinter import filedialog
-    inp=filedialog.askopenfilename(title='Open a song for beatswapping')
+def arg_all(*names, args:list=args):
+    """All values after any of the names, until the next argument that starts with `-`. Names can be repeated."""
+    values = []
+    for n, a in enumerate(args):
+        if a in names:
+            for v in args[n+1:]:
+                if v.startswith('-') and not v[1:2].isdecimal(): break
+                values.append(v)
+    return values
 
-#output
-output= arg('-o')
-if output is None: output = arg('-out')
-if output is None: output = arg('-output')
-if output is None: output = 'output'
-#pattern
-pattern= arg('-p')
-if pattern is None: pattern = arg('-pat')
-if pattern is None: pattern = arg('-pattern')
-if pattern is None: pattern = input('Write the beatswapping pattern: ')
+# process pool workers import this file again, this makes sure they don't run it
+if __name__ == '__main__':
+    inputs = arg_all('-i', '-in', '-input')
+    lists = arg_all('-l', '-list')
+    patterns = arg_all('-p', '-pat', '-pattern')
+    presets = arg_all('-preset')
+    batch = ('-batch' in args or len(inputs) > 1 or len(patterns) > 1 or len(lists) > 0 or len(presets) > 0
+             or any(c in i for i in inputs for c in '*?[') or any(i in args for i in ('-j', '-jobs')))
 
-scale= arg('-s')
-if scale is None: scale = arg('-sc')
-if scale is None: scale = arg('-scale')
-if scale is None: scale = 1
-shift= arg('-h')
-if shift is None: shift = arg('-shift')
-if shift is None: shift = 0
+    #input
+    inp = inputs[0] if len(inputs) > 0 else None
+    if inp is None and not batch:
+        from tkinter import filedialog
+        inp=filedialog.askopenfilename(title='Open a song for beatswapping')
 
-bm.beatswap(audio=inp, output=output, pattern=pattern, scale = scale, shift = shift)
+    #output
+    output= arg('-o')
+    if output is None: output = arg('-out')
+    if output is None: output = arg('-output')
+    if output is None: output = 'output'
+    #pattern
+    pattern = patterns[0] if len(patterns) > 0 else None
+    if pattern is None and not batch: pattern = input('Write the beatswapping pattern: ')
+
+    scale= arg('-s')
+    if scale is None: scale = arg('-sc')
+    if scale is None: scale = arg('-scale')
+    if scale is None: scale = 1
+    shift= arg('-h')
+    if shift is None: shift = arg('-shift')
+    if shift is None: shift = 0
+
+    if not batch:
+        bm.beatswap(audio=inp, output=output, pattern=pattern, scale = scale, shift = shift)
+    else:
+        jobs = arg('-j')
+        if jobs is None: jobs = arg('-jobs')
+        if jobs is not None: jobs = int(jobs)
+        manifest = arg('-manifest')
+        if manifest is None: manifest = f'{output}/beatman manifest.json'
+        ext = arg('-ext')
+        if ext is None: ext = 'mp3'
+        from beat_manipulator import batch as bm_batch
+        jobs_list = bm_batch.plan(inputs = inputs, lists = lists, patterns = patterns, presets = presets, output = output, scale = scale, shift = shift, ext = ext)
+        done = bm_batch.run(jobs_list, workers = jobs, manifest = manifest, skip_existing = '-force' not in args)
+        sys.exit(1 if any(i['status'] == 'failed' for i in done.values()) else 0)
@@ -0,0 +1,6 @@
+"""Reproducible performance benchmarks for beat_manipulator.
+
+Everything runs on synthetic audio from `benchmarks.synth`, so no real songs are needed.
+
+`python -m benchmarks run -o results.json` times the hot paths, `python -m benchmarks compare old.json new.json` flags regressions."""
+from . import synth
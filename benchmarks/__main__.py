@@ -0,0 +1,63 @@
+# py -m benchmarks run -o results.json
+# py -m benchmarks run --lengths 30 60 120 --only beatswap -o after.json
+# py -m benchmarks compare results.json after.json
+# py -m benchmarks import
+# py -m benchmarks golden check
+import argparse, json, os, sys
+from . import suite, golden as golden_outputs
+
+parser = argparse.ArgumentParser(prog = 'benchmarks', description = 'beat_manipulator benchmarks on synthetic audio')
+commands = parser.add_subparsers(dest = 'command', required = True)
+
+run = commands.add_parser('run', help = 'run benchmarks and write JSON results')
+run.add_argument('-o', '--output', help = 'JSON file to write, prints to stdout if not specified')
+run.add_argument('--lengths', type = float, nargs = '+', default = [15, 30, 60], help = 'synthetic track lengths in seconds')
+run.add_argument('--bpm', type = float, default = 120)
+run.add_argument('--sr', type = int, default = 44100)
+run.add_argument('--kind', choices = ('drums', 'clicks'), default = 'drums')
+run.add_argument('--repeat', type = int, default = 3)
+run.add_argument('--seed', type = int, default = 0)
+run.add_argument('--only', nargs = '+', help = 'only run benchmarks whose name contains any of those strings')
+run.add_argument('--no-mallopt', action = 'store_true', help = "don't change how glibc allocates, peak memory is then measured with the slower tracemalloc")
+
+imports = commands.add_parser('import', help = 'time `import beat_manipulator` in a fresh interpreter')
+imports.add_argument('--repeat', type = int, default = 5)
+
+compare = commands.add_parser('compare', help = 'compare two result files, exits with 1 if there are regressions')
+compare.add_argument('old')
+compare.add_argument('new')
+compare.add_argument('--tolerance', type = float, default = 0.2, help = 'allowed relative slowdown')
+compare.add_argument('--memory-tolerance', type = float, default = 0.2, help = 'allowed relative peak memory increase')
+compare.add_argument('--superlinear', type = float, default = 1.25, help = 'flag benchmarks where time grows faster than length^this')
+
+golden = commands.add_parser('golden', help = 'record or check golden outputs, exits with 1 if any are different')
+golden.add_argument('action', choices = ('record', 'check', 'reference'), help = '`reference` compares the fast renderer with the beat by beat one')
+golden.add_argument('path', nargs = '?', default = os.path.join(os.path.dirname(__file__), 'golden.json'))
+golden.add_argument('--tolerance', type = float, default = 1e-5, help = 'largest allowed difference of fingerprints or samples')
+golden.add_argument('--only', nargs = '+', help = 'only cases whose name contains any of those strings')
+
+args = parser.parse_args()
+if args.command == 'run':
+    if args.no_mallopt is False: suite.mallopt()
+    results = suite.run(lengths = args.lengths, bpm = args.bpm, sr = args.sr, kind = args.kind, repeat = args.repeat, seed = args.seed, only = args.only, log = args.output is not None)
+    if args.output is None: print(json.dumps(results, indent = 1))
+    else:
+        with open(args.output, 'w') as f: json.dump(results, f, indent = 1)
+        if len(results['superlinear']) > 0: print(f"super-linear scaling: {', '.join(results['superlinear'])}")
+elif args.command == 'import':
+    result = suite.import_time(repeat = args.repeat)
+    print(json.dumps(result, indent = 1))
+    sys.exit(0 if result['status'] == 'ok' else 1)
+elif args.command == 'golden':
+    if args.action == 'record': golden_outputs.record(args.path, only = args.only)
+    else:
+        if args.action == 'check': result = golden_outputs.check(args.path, tolerance = args.tolerance, only = args.only)
+        else: result = {name: 'identical' if diff == 0 else 'close' if diff <= args.tolerance else 'different' for name, diff in golden_outputs.reference(tolerance = args.tolerance).items()}
+        different = [name for name, status in result.items() if status.startswith('different')]
+        print(f'{len(different)} of {len(result)} cases are different' + (f": {', '.join(different)}" if len(different) > 0 else '.'))
+        sys.exit(1 if len(different) > 0 else 0)
+else:
+    problems = suite.compare(args.old, args.new, tolerance = args.tolerance, memory_tolerance = args.memory_tolerance, superlinear = args.superlinear)
+    for i in problems: print(i)
+    if len(problems) == 0: print('No regressions.')
+    sys.exit(1 if len(problems) > 0 else 0)
@@ -0,0 +1,126 @@
+"""Golden outputs - digests of what beatswapping, beatmap scale and shift, effects and images produce now, so that faster code can be checked against them.
+
+```
+py -m benchmarks golden record benchmarks/golden.json
+py -m benchmarks golden check benchmarks/golden.json
+py -m benchmarks golden reference
+```
+Every case runs on short synthetic audio with fixed beatmaps, random patterns use fixed seeds. For each output the corpus stores the shape,
+a sha256 of the exact bytes, and a fingerprint - mean and RMS of 64 blocks of every channel, and the first and last samples.
+`check` reports cases that are identical, close (fingerprint within `tolerance`) or different.
+`reference` renders every pattern without random parts with both `song._render` and `song._render_reference` and compares whole outputs."""
+import hashlib, json, random
+import numpy as np
+from . import synth
+
+# pattern, render arguments, and whether the result doesn't depend on random numbers
+PATTERNS = {
+    'slices': ('1, 3:4, 5>0.5, 6<0.5, 2.5, 0:0.5, -1, 7', {}, True),
+    'index': ('i, i+2, i*2>0.5, i-0.5', {}, True),
+    'length': ('i, 8?, 2, 4', {}, True),
+    'skip': ('1!, 2, 3!, 4', {}, True),
+    'metrics': ('1v%v, 2, 3v%h, 4', {}, True),
+    'spectral metrics': ('1%kv%, 2%bv%*10, 3, 4', {}, True),
+    'random': ('@1_8_1, 2, @1_4_0.5>0.5, 4', {'seed': 0}, False),
+    'shuffle': ('1#1, 2#1, 3#2, 4#2, 5#1, 6', {'seed': 1}, False),
+    'joins': ('1;2, 3~4, 5&6, 7^8, 9$10, 11}12', {}, True),
+    'effects': ('1s2, 2r, 3v0.5, 4d8, 5g, 6b4, 7c0, 8c1s0.5', {}, True),
+    'samples': ('1;"click", 2, "click">0.5, 3;"click"s2', {}, True),
+    'song': ('1, [mix]2, [mix]3:4, [mix], 5', {}, True),
+    'scale': ('1, 3, 2, 4', {'scale': 0.5, 'shift': -1.5}, True),
+    'limits': ('1, 2, 3, 4', {'limit_beats': 20, 'limit_length': 44100 * 4}, True),
+    'no smoothing': ('1, 3, 2, 4', {'smoothing': 0}, True),
+}
+
+# effect letter and value, applied to one beat
+EFFECTS = [('s', '2'), ('s', '0.5'), ('s', '1/3'), ('c', '0'), ('c', None), ('b', '4'), ('v', '0.5'), ('d', '8'), ('g', None), ('r', None), ('t', '0.8'), ('t', '1.5'), ('p', '3'), ('p', '-12')]
+
+SCALES = (0.5, 2, 1/3, 1.5)
+SHIFTS = (-1.5, 0.5, 2, -0.25)
+
+def context(length: float = 12, bpm: float = 120, sr: int = 44100, seed: int = 0) -> dict:
+    """Song with an exact beatmap and samples for every case. Only depends on the arguments."""
+    song = synth.song(length, bpm, sr, 'drums', seed)
+    mix = synth.song(length, bpm * 1.5, sr, 'clicks', seed + 1)
+    return {'song': song, 'sr': sr, 'samples': {'click': synth.click_track(60 / bpm, bpm, sr), 'mix': mix}}
+
+def _render(ctx, pattern: str, seed = None, scale = 1, shift = 0, reference = False, **kwargs) -> np.ndarray:
+    """Renders like `song.beatswap_many` does, with `reference = True` with the beat by beat renderer"""
+    from beat_manipulator import parse, assets
+    song = ctx['song']._prepare(scale, shift)
+    parsed = parse.parse(pattern, samples = assets.resolve(pattern, ctx['samples'], song.sr), log = False, sr = song.sr)
+    render = song._render_reference if reference is True else song._render
+    return render(parsed, rng = random.Random(seed), **kwargs)
+
+def cases(ctx) -> dict:
+    """{name: function that returns the output}"""
+    from beat_manipulator import beatmap, main, effects
+    from beat_manipulator.image import generate
+    song = ctx['song']
+    result = {f'beatswap[{name}]': (lambda p = p, k = k: _render(ctx, p, **k)) for name, (p, k, _) in PATTERNS.items()}
+    result.update({f'beatmap.scale[{i:.4g}]': (lambda i = i: beatmap.scale(song.beatmap.copy(), i, log = False)) for i in SCALES})
+    result.update({f'beatmap.shift[{i}]': (lambda i = i: beatmap.shift(song.beatmap.copy(), i, log = False)) for i in SHIFTS})
+    beat = song[5]
+    result.update({f'effects[{letter}{value or ""}]': (lambda letter = letter, value = value: main._apply_effects(beat, [[letter, value]], effects.BM_EFFECTS))
+                   for letter, value in EFFECTS})
+    for mode in ('median', 'max'):
+        result[f'image.generate[{mode}]'] = lambda mode = mode: generate(main.song(song.audio.copy(), sr = song.sr, log = False), beatmap = song.beatmap.copy(), mode = mode, log = False)
+    result['image.generate[spectral]'] = lambda: generate(main.song(song.audio.copy(), sr = song.sr, log = False), beatmap = song.beatmap.copy(), spectral = True, log = False)
+    return result
+
+def fingerprint(output, blocks: int = 64) -> dict:
+    """Shape, sha256 and a fingerprint that small numeric changes only change a little"""
+    output = np.asarray(output)
+    data = np.nan_to_num(np.asarray(output, dtype = np.float64))
+    data = data.reshape(1, -1) if data.ndim < 2 else data.reshape(data.shape[0], -1)
+    edges = np.linspace(0, data.shape[1], min(blocks, data.shape[1]) + 1).astype(int)
+    means = [np.add.reduceat(channel, edges[:-1]) / np.diff(edges) for channel in data] if data.shape[1] > 0 else []
+    rms = [np.sqrt(np.add.reduceat(channel**2, edges[:-1]) / np.diff(edges)) for channel in data] if data.shape[1] > 0 else []
+    return {'shape': list(output.shape), 'dtype': str(output.dtype),
+            'sha256': hashlib.sha256(np.ascontiguousarray(output).tobytes()).hexdigest(),
+            'mean': np.round(means, 8).tolist(), 'rms': np.round(rms, 8).tolist(),
+            'head': np.round(data[:, :16], 8).tolist(), 'tail': np.round(data[:, -16:], 8).tolist()}
+
+def difference(old: dict, new: dict) -> float:
+    """Largest difference between two fingerprints, inf if shapes differ"""
+    if old['shape'] != new['shape']: return float('inf')
+    if old['sha256'] == new['sha256']: return 0.
+    return max((float(np.max(np.abs(np.asarray(old[i]) - np.asarray(new[i])), initial = 0)) for i in ('mean', 'rms', 'head', 'tail')), default = 0.)
+
+def record(path: str = None, only: list = None, log = True) -> dict:
+    """Runs every case and returns the corpus, writes it to `path` if given"""
+    ctx = context()
+    corpus = {'meta': {'numpy': np.__version__, 'sr': ctx['sr']}, 'cases': {}}
+    for name, function in cases(ctx).items():
+        if only is not None and not any(i in name for i in only): continue
+        corpus['cases'][name] = fingerprint(function())
+        if log is True: print(f"{name}: {corpus['cases'][name]['shape']}")
+    if path is not None:
+        with open(path, 'w') as f: json.dump(corpus, f)
+    return corpus
+
+def check(path: str, tolerance: float = 1e-5, only: list = None, log = True) -> dict:
+    """Compares every case with the corpus in `path`. Returns {name: 'identical', 'close' or 'different: ...'}."""
+    with open(path) as f: corpus = json.load(f)
+    new = record(only = only, log = False)['cases']
+    result = {}
+    for name, old in corpus['cases'].items():
+        if name not in new: continue
+        diff = difference(old, new[name])
+        if diff == 0: result[name] = 'identical'
+        elif diff <= tolerance: result[name] = 'close'
+        elif diff == float('inf'): result[name] = f"different: shape {tuple(old['shape'])} -> {tuple(new[name]['shape'])}"
+        else: result[name] = f'different: fingerprint differs by {diff:.3g}'
+        if log is True: print(f'{name}: {result[name]}')
+    return result
+
+def reference(tolerance: float = 1e-5, log = True) -> dict:
+    """Compares `song._render` with `song._render_reference` on every pattern that doesn't use random numbers. Returns {name: largest difference, inf if lengths differ}."""
+    ctx = context()
+    result = {}
+    for name, (pattern, kwargs, deterministic) in PATTERNS.items():
+        if deterministic is False: continue
+        fast, slow = _render(ctx, pattern, **kwargs), _render(ctx, pattern, reference = True, **kwargs)
+        result[name] = float(np.max(np.abs(fast - slow), initial = 0)) if fast.shape == slow.shape else float('inf')
+        if log is True: print(f"{name}: {'identical' if result[name] == 0 else 'close' if result[name] <= tolerance else 'different'} ({result[name]:.3g})")
+    return result
@@ -0,0 +1,238 @@
+import json, os, platform, sys, time, tempfile, tracemalloc
+import numpy as np
+from . import synth
+
+# beatswap pattern families, each one stresses a different part of the renderer
+PATTERNS = {
+    'slices': '1, 3, 2, 4>0.5, 0:0.5, 5<1/3, 6>2/3, 7, 8<0.25',
+    'effects': '1s2, 2r, 3v0.5, 4d8, 5g, 6b4, 7c, 8c0s0.5',
+    'overlays': '1;2, 3~4, 5&6, 7^8, 1$2, 3}4',
+    'samples': '1;"click", 2, 3;"click"s2, 4, 5, [mix]2, 7;[mix]8, [mix]4:5',
+    'random': 'random',
+    'shuffle': '1#1, 2#2, 3#1, 4#2, @1_8_1, 6, @1_8_0.5>0.5, 8',
+}
+
+# detectors that don't need the slow madmom neural networks
+DETECTORS = ('stunlocked', 'librosa')
+
+def context(length: float = 30, bpm: float = 120, sr: int = 44100, kind: str = 'drums', seed: int = 0, folder: str = None) -> dict:
+    """Prepares everything a benchmark needs: a song with an exact beatmap, its audio, and the same audio written to a wav file."""
+    import soundfile
+    if folder is None: folder = tempfile.mkdtemp(prefix = 'bm_bench_')
+    song = synth.song(length, bpm, sr, kind, seed)
+    path = os.path.join(folder, f'{kind} {bpm}bpm {length}s.wav')
+    soundfile.write(path, song.audio.T, sr)
+    mix = synth.song(length, bpm * 1.5, sr, 'clicks' if kind == 'drums' else 'drums', seed + 1)
+    return {'song': song, 'audio': song.audio, 'sr': sr, 'path': path, 'folder': folder,
+            'samples': {'click': synth.click_track(60 / bpm, bpm, sr), 'mix': mix}}
+
+def _song(ctx):
+    import beat_manipulator as bm
+    song = bm.song(audio = ctx['audio'].copy(), sr = ctx['sr'], log = False)
+    song.beatmap = ctx['song'].beatmap.copy()
+    song.path = ctx['song'].path
+    return song
+
+# Each benchmark takes the context, does all untimed setup, and returns the function to time.
+def bench_open_audio(ctx, lib = 'soundfile'):
+    from beat_manipulator import io
+    return lambda: io.open_audio(ctx['path'], lib = lib)
+
+def bench_write_audio(ctx, lib = 'soundfile'):
+    from beat_manipulator import io
+    output = os.path.join(ctx['folder'], 'write_audio.wav')
+    return lambda: io.write_audio(ctx['audio'], ctx['sr'], output, lib = lib, log = False)
+
+def bench_beatmap_scale(ctx, scale = 0.5):
+    from beat_manipulator import beatmap
+    return lambda: beatmap.scale(ctx['song'].beatmap.copy(), scale, log = False)
+
+def bench_beatmap_shift(ctx, shift = -1.5):
+    from beat_manipulator import beatmap
+    return lambda: beatmap.shift(ctx['song'].beatmap.copy(), shift, log = False)
+
+def bench_parse(ctx, pattern = PATTERNS['samples']):
+    from beat_manipulator import parse
+    return lambda: parse.parse(pattern, samples = dict(ctx['samples']), log = False)
+
+def bench_image(ctx):
+    from beat_manipulator.image import generate
+    song = _song(ctx)
+    return lambda: generate(song, beatmap = song.beatmap, log = False)
+
+def bench_osu(ctx):
+    import madmom
+    from beat_manipulator import osu
+    song = _song(ctx)
+    song.path = ctx['path']
+    def run():
+        output = osu.generate(song, caching = False, log = False, output = ctx['folder'])
+        os.remove(output)
+    return run
+
+def _bench_beatswap(pattern):
+    def bench(ctx):
+        import random
+        song = _song(ctx)
+        def run():
+            random.seed(0)
+            return song.beatswap(pattern, samples = dict(ctx['samples']), return_audio = True)
+        return run
+    return bench
+
+def _bench_generate(lib):
+    def bench(ctx):
+        from beat_manipulator import beatmap
+        if lib == 'librosa': import librosa
+        return lambda: beatmap.generate(ctx['audio'], ctx['sr'], lib = lib, caching = False, load_settings = False, log = False)
+    return bench
+
+BENCHMARKS = {
+    'io.open_audio': bench_open_audio,
+    'io.write_audio': bench_write_audio,
+    'beatmap.scale': bench_beatmap_scale,
+    'beatmap.shift': bench_beatmap_shift,
+    'parse.parse': bench_parse,
+    'image.generate': bench_image,
+    'osu.generate': bench_osu,
+}
+BENCHMARKS.update({f'beatmap.generate[{lib}]': _bench_generate(lib) for lib in DETECTORS})
+BENCHMARKS.update({f'song.beatswap[{family}]': _bench_beatswap(pattern) for family, pattern in PATTERNS.items()})
+
+_libc = None
+
+def mallopt():
+    """Changes how glibc allocates for the whole process, so `run` can measure peak memory from the resident set. Without it peak memory comes from tracemalloc."""
+    # a fixed mmap threshold makes glibc return big numpy buffers to the OS when they are freed,
+    # otherwise they get recycled from the heap and don't show up in the high water mark on the next run
+    global _libc
+    if _libc is not None: return
+    import ctypes, ctypes.util
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'))
+        libc.mallopt(-3, 128 * 1024) # M_MMAP_THRESHOLD
+        libc.malloc_trim
+        _libc = libc
+    except (OSError, AttributeError, TypeError): pass
+
+def _status(field):
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith(field): return int(line.split()[1]) * 1024
+
+def _peak_memory(function) -> int:
+    """Peak memory in bytes that `function` allocated on top of what was already allocated.
+    
+    On linux this resets and reads the resident set high water mark, which is exact and free. 
+    Elsewhere it falls back to tracemalloc, which can be a hundred times slower on code that creates many python objects."""
+    try:
+        if _libc is None: raise OSError('not glibc')
+        _libc.malloc_trim(0)
+        with open('/proc/self/clear_refs', 'w') as f: f.write('5')
+        before = _status('VmRSS:')
+        function()
+        return max(_status('VmHWM:') - before, 0)
+    except OSError: pass
+    tracemalloc.start()
+    try: function()
+    finally:
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return peak
+
+def measure(function, repeat: int = 3) -> dict:
+    """Runs `function` once to get peak memory, then `repeat` more times to get wall times in seconds."""
+    peak = _peak_memory(function)
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return {'time': min(times), 'times': times, 'peak_memory': peak}
+
+def scaling(results: list) -> dict:
+    """Fits `time ~ length ** exponent` for every benchmark that ran at more than one length, returns {name: exponent}."""
+    exponents = {}
+    for name in dict.fromkeys(r['name'] for r in results):
+        points = [(r['length'], r['time']) for r in results if r['name'] == name and r['status'] == 'ok' and r['time'] > 0]
+        if len(set(p[0] for p in points)) < 2: continue
+        x, y = np.log([p[0] for p in points]), np.log([p[1] for p in points])
+        exponents[name] = round(float(np.polyfit(x, y, 1)[0]), 3)
+    return exponents
+
+IMPORT_TARGET = 0.1 # seconds, not counting numpy
+
+def import_time(repeat: int = 5, module: str = 'beat_manipulator') -> dict:
+    """Times `import beat_manipulator` in fresh interpreters started outside of the repo folder, so it also checks that importing doesn't depend on the working directory.
+
+    numpy is imported first and timed separately, `time` is the import time of the package itself."""
+    import subprocess
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    code = f"import time; t=time.perf_counter(); import numpy; t1=time.perf_counter(); import {module}; t2=time.perf_counter(); import sys; print(t1-t, t2-t1, sorted(i for i in ('scipy', 'cv2', 'madmom', 'yaml', 'librosa', 'pedalboard', 'soundfile') if i in sys.modules))"
+    env = dict(os.environ, PYTHONPATH = root + os.pathsep + os.environ.get('PYTHONPATH', ''))
+    times, numpy_times = [], []
+    with tempfile.TemporaryDirectory(prefix = 'bm_import_') as folder:
+        for _ in range(repeat):
+            output = subprocess.run([sys.executable, '-c', code], cwd = folder, env = env, capture_output = True, text = True)
+            if output.returncode != 0: return {'name': f'import {module}', 'length': None, 'time': None, 'peak_memory': None, 'status': f'error: {output.stderr.strip().splitlines()[-1]}'}
+            numpy_time, package_time, heavy = output.stdout.split(maxsplit = 2)
+            numpy_times.append(float(numpy_time))
+            times.append(float(package_time))
+            side_effects = os.listdir(folder)
+    return {'name': f'import {module}', 'length': None, 'time': min(times), 'times': times, 'numpy_time': min(numpy_times), 'peak_memory': None,
+            'heavy_modules': eval(heavy), 'created_files': side_effects, 'target': IMPORT_TARGET, 'status': 'ok' if min(times) < IMPORT_TARGET else f'over target of {IMPORT_TARGET}s'}
+
+def run(lengths = (15, 30, 60), bpm: float = 120, sr: int = 44100, kind: str = 'drums', repeat: int = 3, seed: int = 0, only: list = None, superlinear: float = 1.25, log = True) -> dict:
+    """Runs all benchmarks (or those whose names contain any of `only`) for each track length in seconds. Returns JSON-serializable results."""
+    import beat_manipulator as bm
+    names = [name for name in BENCHMARKS if only is None or any(i in name for i in only)]
+    results = []
+    if only is None or any(i in 'import' for i in only):
+        result = import_time(repeat = max(repeat, 3))
+        if log is True: print(f"import beat_manipulator... {result['time']}s (+ numpy {result.get('numpy_time')}s), {result['status']}")
+        results.append(result)
+    with tempfile.TemporaryDirectory(prefix = 'bm_bench_') as folder:
+        for length in lengths:
+            ctx = context(length, bpm, sr, kind, seed, folder)
+            for name in names:
+                if log is True: print(f'{name} @ {length}s...', end = ' ', flush = True)
+                result = {'name': name, 'length': length}
+                try:
+                    result.update(measure(BENCHMARKS[name](ctx), repeat = repeat), status = 'ok')
+                except ImportError as e: result.update(time = None, peak_memory = None, status = f'skipped: {e}')
+                except Exception as e: result.update(time = None, peak_memory = None, status = f'error: {type(e).__name__}: {e}')
+                if log is True: print(f"{result['time']:.4f}s, {result['peak_memory']/2**20:.1f} MiB" if result['status'] == 'ok' else result['status'])
+                results.append(result)
+    exponents = scaling(results)
+    return {
+        'meta': {'python': sys.version.split()[0], 'numpy': np.__version__, 'platform': platform.platform(), 'machine': platform.machine(),
+                 'lengths': list(lengths), 'bpm': bpm, 'sr': sr, 'kind': kind, 'repeat': repeat, 'seed': seed, 'time': time.time()},
+        'results': results,
+        'scaling': exponents,
+        'superlinear': sorted(name for name, exponent in exponents.items() if exponent > superlinear),
+    }
+
+def compare(old: dict, new: dict, tolerance: float = 0.2, memory_tolerance: float = 0.2, superlinear: float = 1.25) -> list:
+    """Compares two `run` results. Returns a list of human-readable problems: slower or heavier benchmarks, new failures, and super-linear scaling."""
+    if isinstance(old, str):
+        with open(old) as f: old = json.load(f)
+    if isinstance(new, str):
+        with open(new) as f: new = json.load(f)
+    problems = []
+    before = {(r['name'], r['length']): r for r in old['results']}
+    for r in new['results']:
+        key = (r['name'], r['length'])
+        if key not in before: continue
+        b = before[key]
+        if b['status'] == 'ok' and r['status'] != 'ok' and r['time'] is None:
+            problems.append(f"{r['name']} @ {r['length']}s: was ok, now {r['status']}")
+        if b['time'] is None or r['time'] is None: continue
+        if b['time'] > 0 and r['time'] > b['time'] * (1 + tolerance):
+            problems.append(f"{r['name']} @ {r['length']}s: time {b['time']:.4f}s -> {r['time']:.4f}s (x{r['time']/b['time']:.2f})")
+        if b['peak_memory'] is not None and r['peak_memory'] is not None and b['peak_memory'] > 0 and r['peak_memory'] > b['peak_memory'] * (1 + memory_tolerance):
+            problems.append(f"{r['name']} @ {r['length']}s: peak memory {b['peak_memory']/2**20:.1f} MiB -> {r['peak_memory']/2**20:.1f} MiB (x{r['peak_memory']/b['peak_memory']:.2f})")
+    for name, exponent in new.get('scaling', {}).items():
+        if exponent > superlinear:
+            was = old.get('scaling', {}).get(name)
+            problems.append(f"{name}: super-linear scaling, time ~ length^{exponent}" + (f" (was ^{was})" if was is not None else ''))
+    return problems
@@ -0,0 +1,64 @@
+import numpy as np
+
+def beats(length: float = 30, bpm: float = 120, sr: int = 44100, offset: float = 0) -> np.ndarray:
+    """Returns ground truth beat positions in samples for a track of `length` seconds."""
+    period = 60 / bpm
+    return (np.arange(offset, length, period) * sr).astype(int)
+
+def _click(sr, freq = 1000, duration = 0.02):
+    t = np.arange(int(sr * duration)) / sr
+    return np.sin(2 * np.pi * freq * t) * np.exp(-t * 200)
+
+def _kick(sr, duration = 0.25):
+    t = np.arange(int(sr * duration)) / sr
+    # pitch sweep from 150 hz down to 45 hz
+    phase = 2 * np.pi * (45 * t + (105 / 30) * (1 - np.exp(-30 * t)))
+    return np.sin(phase) * np.exp(-t * 12)
+
+def _snare(sr, rng, duration = 0.18):
+    t = np.arange(int(sr * duration)) / sr
+    return (0.7 * rng.uniform(-1, 1, len(t)) + 0.3 * np.sin(2 * np.pi * 190 * t)) * np.exp(-t * 25)
+
+def _hat(sr, rng, duration = 0.05):
+    t = np.arange(int(sr * duration)) / sr
+    return np.diff(rng.uniform(-1, 1, len(t) + 1)) * 0.5 * np.exp(-t * 80)
+
+def _place(track, sound, position, gain = 1, pan = 0):
+    end = min(position + len(sound), track.shape[1])
+    if end <= position: return
+    track[0, position:end] += sound[:end - position] * gain * (1 - pan) 
+    track[1, position:end] += sound[:end - position] * gain * (1 + pan)
+
+def click_track(length: float = 30, bpm: float = 120, sr: int = 44100, beats_per_bar: int = 4) -> np.ndarray:
+    """Stereo metronome, first beat of every bar is accented. Returns a (2, samples) float32 array."""
+    track = np.zeros((2, int(length * sr)))
+    accent, click = _click(sr, 1500), _click(sr, 1000)
+    for n, position in enumerate(beats(length, bpm, sr)):
+        _place(track, accent if n % beats_per_bar == 0 else click, position, gain = 0.8)
+    return track.astype(np.float32)
+
+def drum_track(length: float = 30, bpm: float = 120, sr: int = 44100, seed: int = 0) -> np.ndarray:
+    """Stereo kick/snare/hi-hat loop with a bass tone, deterministic for a given seed. Returns a (2, samples) float32 array."""
+    rng = np.random.default_rng(seed)
+    track = np.zeros((2, int(length * sr)))
+    kick, snare = _kick(sr), _snare(sr, rng)
+    positions = beats(length, bpm, sr)
+    half = int(sr * 30 / bpm)
+    for n, position in enumerate(positions):
+        _place(track, kick if n % 2 == 0 else snare, position, gain = 0.8, pan = 0 if n % 2 == 0 else -0.2)
+        _place(track, _hat(sr, rng), position + half, gain = 0.3, pan = 0.3)
+    t = np.arange(track.shape[1]) / sr
+    track += 0.1 * np.sin(2 * np.pi * 55 * t)
+    track /= np.max(np.abs(track))
+    return track.astype(np.float32)
+
+def song(length: float = 30, bpm: float = 120, sr: int = 44100, kind: str = 'drums', seed: int = 0):
+    """Returns a `beat_manipulator.song` with synthetic audio and its exact beatmap, so no beat detection is needed."""
+    import beat_manipulator as bm
+    audio = drum_track(length, bpm, sr, seed) if kind == 'drums' else click_track(length, bpm, sr)
+    result = bm.song(audio = audio, sr = sr, log = False)
+    result.path = f'synthetic_{kind}_{bpm}bpm_{length}s_{sr}hz_{seed}.wav'
+    result.beatmap = beats(length, bpm, sr)
+    result.beatmap_default = result.beatmap.copy()
+    result.lib = 'synthetic'
+    return result
@@ -0,0 +1,8 @@
+import pytest
+from beat_manipulator import utils
+
+@pytest.fixture(autouse = True)
+def caches(tmp_path, monkeypatch):
+    """Cached beatmaps and renders go to a temporary folder instead of the package"""
+    monkeypatch.setattr(utils, 'BEATMAPS_DIR', str(tmp_path / 'beatmaps'))
+    monkeypatch.setattr(utils, 'RENDERS_DIR', str(tmp_path / 'renders'))
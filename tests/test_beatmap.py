@@ -0,0 +1,30 @@
+import numpy as np
+import pytest
+from beat_manipulator import beatmap
+from benchmarks import synth
+
+def energy(name, audio, sr, profile = 'full'):
+    """Stands in for a madmom network: smoothed energy of every activation frame, so it needs a bit of context on both sides"""
+    hop = int(sr / beatmap.ACTIVATIONS_FPS)
+    audio = np.pad(audio, (0, -len(audio) % hop))
+    frames = np.abs(audio.reshape(-1, hop)).mean(axis = 1)
+    return np.convolve(frames, np.ones(9) / 9, mode = 'same')
+
+@pytest.fixture(scope = 'module')
+def audio():
+    return beatmap.proxy(synth.song(25, 120, 44100, 'drums', 0).audio, 44100)
+
+@pytest.mark.parametrize('split, workers', [(5, 1), (7.3, 2), (100, None)])
+def test_chunked_matches_whole(monkeypatch, audio, split, workers):
+    monkeypatch.setattr(beatmap, '_activations', energy)
+    whole = energy(None, audio, 44100)
+    chunked = beatmap.activations_chunked(audio, 44100, split = split, overlap = 1, workers = workers)
+    assert chunked.shape == whole.shape
+    assert np.allclose(chunked, whole, atol = 1e-6)
+
+def test_chunked_madmom_within_tolerance(audio):
+    pytest.importorskip('madmom')
+    whole = beatmap._activations('beats.RNNBeatProcessor', audio, 44100, 'fast')
+    chunked = beatmap.activations_chunked(audio, 44100, split = 10, overlap = 5, workers = 2, profile = 'fast')
+    assert chunked.shape == whole.shape
+    assert np.max(np.abs(chunked - whole)) < 0.05
@@ -0,0 +1,49 @@
+import os
+import pytest
+from beat_manipulator import cache, instrument, main
+from benchmarks import synth
+
+@pytest.fixture
+def song(tmp_path):
+    song = synth.song(10, 120, 44100, 'drums', 0)
+    song.log = False
+    song.path = str(tmp_path / 'song.wav')
+    return song
+
+def test_key(song):
+    first = cache.key(song, '1, 3, 2, 4', 0.5)
+    assert cache.key(song, '1,3,2,4', '1/2') == first
+    assert cache.key(song, '1, 3, 2, 4', 1) != first
+    assert cache.key(song, 'random') is None and cache.key(song, '1, @1_8_1', seed = 1) is not None
+    song.audio[:, 0] += 0.5
+    assert cache.key(song, '1, 3, 2, 4', 0.5) != first
+
+def test_hit_miss_eviction(tmp_path):
+    files = {}
+    for n, name in enumerate('abc'):
+        files[name] = tmp_path / f'{name}.wav'
+        files[name].write_bytes(bytes(1000))
+        cache.put(name, str(files[name]))
+        os.utime(cache.path(name, 'wav'), (n, n))
+    with instrument.record() as stats:
+        assert cache.get('a', 'wav') == cache.path('a', 'wav') # now the most recently used
+        assert cache.get('d', 'wav') is None
+        cache.evict(2000)
+    assert stats.counters == {'render_cache_hits': 1, 'render_cache_misses': 1, 'render_cache_evictions': 1}
+    assert [i for i in 'abc' if os.path.exists(cache.path(i, 'wav'))] == ['a', 'c']
+    assert cache.size() == 2000
+    cache.clear()
+    assert cache.size() == 0
+
+def test_beatswap_copies_from_cache(song, tmp_path):
+    with instrument.record() as first:
+        written = main.beatswap(song, '1, 3, 2, 4', 0.5, output = str(tmp_path) + '/', log = False)
+    with instrument.record() as second:
+        again = main.beatswap(song, '1, 3, 2, 4', 0.5, output = str(tmp_path) + '/', log = False)
+    assert written == again and os.path.exists(written)
+    assert 'render' in first.stages and first.counters['render_cache_misses'] == 1
+    assert 'render' not in second.stages and second.counters['render_cache_hits'] == 1
+    # a different render isn't taken from the cache
+    with instrument.record() as third:
+        main.beatswap(song, '1, 3, 2, 4', 2, output = str(tmp_path) + '/', log = False)
+    assert 'render' in third.stages
@@ -0,0 +1,52 @@
+import numpy as np
+import pytest
+from beat_manipulator import cancel, jobs
+from beat_manipulator.effects import BM_EFFECTS
+from benchmarks import synth
+
+@pytest.fixture
+def song():
+    song = synth.song(20, 120, 44100, 'drums', 0)
+    song.log = False
+    return song
+
+class countdown(cancel.token):
+    """Token that cancels itself on its `checks`th check"""
+    def __init__(self, checks: int):
+        super().__init__()
+        self.checks = checks
+
+    def check(self, *args, **kwargs):
+        self.checks -= 1
+        if self.checks == 0: self.cancel()
+        super().check(*args, **kwargs)
+
+def test_cancel_mid_render(song):
+    beatmap = song.beatmap.copy()
+    with pytest.raises(cancel.Cancelled) as e, cancel.scope(countdown(10)):
+        song.beatswap('1, 2r')
+    progress = e.value.progress
+    assert progress['reason'] == 'cancelled' and progress['stage'] == 'render'
+    assert 0 < progress['done'] < progress['total']
+    # nothing was changed
+    assert np.array_equal(song.beatmap, beatmap) and song.audio.shape[1] == 20 * 44100
+
+def stop(audio, value):
+    cancel.current().cancel()
+    return audio
+
+def test_cancel_from_effect(song):
+    with pytest.raises(cancel.Cancelled, match = 'cancelled'), cancel.scope(cancel.token()):
+        song.beatswap('1, 2x1', effects = dict(BM_EFFECTS, x = stop))
+
+def test_deadline(song):
+    with pytest.raises(cancel.Cancelled) as e, cancel.scope(cancel.token(deadline = 0)):
+        song.beatswap('1, 3, 2, 4')
+    assert e.value.progress['reason'] == 'deadline'
+
+@pytest.mark.parametrize('pattern, kwargs, deadline', [('1, 3, 2, 4', {}, 0), ('1, 2x1', {'effects': dict(BM_EFFECTS, x = stop)}, None)])
+def test_job(song, pattern, kwargs, deadline):
+    with jobs.executor(workers = 1) as executor:
+        job = executor.submit(song.beatswap, pattern, return_audio = True, deadline = deadline, **kwargs)
+        with pytest.raises(cancel.Cancelled): job.wait()
+    assert job.status == 'cancelled' and job.error.progress['reason'] == ('deadline' if deadline == 0 else 'cancelled')
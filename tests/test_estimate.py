@@ -0,0 +1,35 @@
+import numpy as np
+import pytest
+from beat_manipulator import estimate
+from benchmarks import synth
+
+@pytest.fixture(scope = 'module')
+def song():
+    song = synth.song(20, 120, 44100, 'drums', 0)
+    song.log = False
+    return song
+
+# fractional slices are rounded once per beat, so an estimate can be a sample per beat off
+@pytest.mark.parametrize('pattern', ['1, 3, 2, 4', '1>0.01, 2', '1>0.01', '1s2, 2r, 3', '1, 3:4, 5>0.5, 6<0.5', 'test', 'reverse'])
+@pytest.mark.parametrize('scale, shift', [(1, 0), (0.5, 0.25), (2, -1.5)])
+def test_estimate_matches_render(song, pattern, scale, shift):
+    result = estimate.estimate(song, pattern, scale = scale, shift = shift)
+    rendered = song.beatswap(pattern, scale = scale, shift = shift, return_audio = True)
+    assert abs(result['length'] - rendered.shape[1]) <= result['beats']
+
+def test_shuffle_is_an_upper_bound(song):
+    result = estimate.estimate(song, 'shuffle')
+    assert all(song.beatswap('shuffle', return_audio = True, seed = i).shape[1] <= result['length'] for i in range(3))
+
+def test_random_needs_a_seed(song):
+    with pytest.raises(ValueError):
+        estimate.estimate(song, 'random')
+    # effect values and `@` are estimated by their average
+    result = estimate.estimate(song, 'random', seed = 2)
+    assert abs(result['length'] - song.beatswap('random', return_audio = True, seed = 2).shape[1]) <= 0.05 * result['length']
+
+def test_budget(song):
+    length = song.beatswap('reverse', return_audio = True).shape[1]
+    song.beatswap('reverse', return_audio = True, budget = {'length': length})
+    with pytest.raises(estimate.BudgetExceeded):
+        song.beatswap('1s0.25', return_audio = True, budget = {'length': len(song.audio[0])})
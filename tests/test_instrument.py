@@ -0,0 +1,40 @@
+import threading
+from beat_manipulator import instrument
+from benchmarks import synth
+
+def test_concurrent_records_only_see_their_own_stages():
+    barrier = threading.Barrier(2)
+    stats = {}
+    def work(name):
+        with instrument.record() as stats[name]:
+            barrier.wait()
+            for _ in range(100):
+                with instrument.stage(name): instrument.count(name)
+            barrier.wait()
+    threads = [threading.Thread(target = work, args = (name,)) for name in ('first', 'second')]
+    for i in threads: i.start()
+    for i in threads: i.join()
+    for name in ('first', 'second'):
+        assert list(stats[name].stages) == [name] and stats[name].calls[name] == 100
+        assert stats[name].counters == {name: 100}
+    assert not instrument.enabled()
+
+def test_callbacks_see_every_thread():
+    events = []
+    def callback(*event): events.append(event)
+    with instrument.record() as stats:
+        instrument.add_callback(callback)
+        try:
+            thread = threading.Thread(target = instrument.count, args = ('other',))
+            thread.start()
+            thread.join()
+        finally: instrument.remove_callback(callback)
+    assert events == [('count', 'other', 1)] and stats.counters == {}
+    assert not instrument.enabled()
+
+def test_worker_threads_record_into_caller():
+    song = synth.song(10, 120, 44100, 'drums', 0)
+    song.log = False
+    with instrument.record() as stats:
+        song.beatswap_many(['1, 3, 2, 4', '1s2, 2r'], workers = 2)
+    assert stats.calls['render'] == 2 and stats.counters['beats_rendered'] > 0
@@ -0,0 +1,40 @@
+import numpy as np
+import pytest
+from benchmarks import synth
+
+@pytest.fixture(scope = 'module')
+def song():
+    song = synth.song(20, 120, 44100, 'drums', 0)
+    song.log = False
+    return song
+
+@pytest.mark.parametrize('pattern', ['1, 3, 2, 4', 'test', 'shuffle', 'reverse', 'random'])
+@pytest.mark.parametrize('scale', [1, 0.5])
+def test_beatswap_many_matches_beatswap(song, pattern, scale):
+    single = song.beatswap(pattern, scale = scale, return_audio = True, seed = 4)
+    many, = song.beatswap_many([pattern], scale = scale, seeds = [4])
+    assert np.array_equal(single, many)
+
+def test_derived_beatmaps_are_reused():
+    song = synth.song(10, 120, 44100, 'drums', 0)
+    first = song.beatmap_derived(0.5, 1, adjust = 500)
+    assert song.beatmap_derived('1/2', 1, adjust = 500) is first
+    assert song.beatmap_derived(0.5, 1) is not first
+    assert not first.flags.writeable
+    with pytest.raises(ValueError): first[0] = 0
+    # only the last 8 are kept
+    for i in range(8): song.beatmap_derived(1, i + 2)
+    assert song.beatmap_derived(0.5, 1, adjust = 500) is not first
+
+@pytest.mark.parametrize('change', ['in place', 'replaced', 'audio'])
+def test_derived_beatmaps_are_made_again(change):
+    song = synth.song(10, 120, 44100, 'drums', 0)
+    first = song.beatmap_derived(2)
+    if change == 'in place': song.beatmap[2] += 100
+    elif change == 'replaced': song.beatmap = song.beatmap[1:]
+    else: song.audio = song.audio[:, :-1000]
+    second = song.beatmap_derived(2)
+    assert second is not first
+    if change == 'in place': assert second[1] == first[1] + 100
+    elif change == 'replaced': assert len(second) == len(song.beatmap[::2])
+    assert song.beatmap_derived(2) is second
@@ -0,0 +1,24 @@
+import os
+import numpy as np
+import pytest
+from beat_manipulator import main, presets, utils
+from benchmarks import synth
+
+@pytest.fixture
+def song():
+    song = synth.song(10, 120, 44100, 'drums', 0)
+    song.log = False
+    return song
+
+@pytest.mark.parametrize('pattern', ['test', 'reverse', '1, 3, 2, 4'])
+def test_scale_sweep_matches_serial(song, pattern, tmp_path):
+    """A sweep renders every scale with `beatswap_many`, which has to give the same files as beatswapping each scale on its own"""
+    import soundfile
+    scales = ['1', '0.5']
+    presets._beatswap(song, pattern, 'sweep', scale = ', '.join(scales), output = str(tmp_path / 'sweep') + '/')
+    for i in scales:
+        main.beatswap(song, pattern = pattern, scale = i, output = str(tmp_path / 'serial') + '/', suffix = f' (sweep x{round(utils._safer_eval(i), 4)})', log = False, caching = False)
+    files = sorted(os.listdir(tmp_path / 'sweep'))
+    assert files == sorted(os.listdir(tmp_path / 'serial')) and len(files) == len(scales)
+    for name in files:
+        assert np.array_equal(soundfile.read(str(tmp_path / 'sweep' / name))[0], soundfile.read(str(tmp_path / 'serial' / name))[0])
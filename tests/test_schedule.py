@@ -0,0 +1,34 @@
+import random
+import numpy as np
+import pytest
+from benchmarks import golden, synth
+
+@pytest.fixture(scope = 'module')
+def ctx():
+    return golden.context()
+
+@pytest.mark.parametrize('name', [name for name, (_, _, deterministic) in golden.PATTERNS.items() if deterministic])
+def test_schedule_matches_reference(ctx, name):
+    pattern, kwargs, _ = golden.PATTERNS[name]
+    fast, slow = golden._render(ctx, pattern, **kwargs), golden._render(ctx, pattern, reference = True, **kwargs)
+    assert fast.shape == slow.shape
+    assert np.max(np.abs(fast - slow), initial = 0) <= 1e-5
+
+@pytest.fixture(scope = 'module')
+def song():
+    song = synth.song(20, 120, 44100, 'drums', 0)
+    song.log = False
+    return song
+
+@pytest.mark.parametrize('pattern', ['1, @1_8_1, 3#1, 4#1', 'random', 'shuffle'])
+def test_seeded_renders_are_identical(song, pattern):
+    first = song.beatswap(pattern, return_audio = True, seed = 3)
+    second = song.beatswap(pattern, return_audio = True, seed = 3)
+    assert np.array_equal(first, second)
+
+def test_global_random_seed(song):
+    results = []
+    for _ in range(2):
+        random.seed(0)
+        results.append(song.beatswap('1, @1_8_1, 3#1, 4#1', return_audio = True))
+    assert np.array_equal(*results)
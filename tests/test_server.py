@@ -0,0 +1,41 @@
+import base64, io, json
+import pytest
+from beat_manipulator import server
+
+@pytest.fixture(scope = 'module')
+def audio(tmp_path_factory):
+    import soundfile
+    from benchmarks import synth
+    song = synth.song(10, 120, 44100, 'drums', 0)
+    path = str(tmp_path_factory.mktemp('server') / 'song.wav')
+    soundfile.write(path, song.audio.T, song.sr)
+    return path
+
+def run(*jobs) -> list:
+    """Runs jobs through `serve_stdio` like a local client would, returns the responses"""
+    stdout = io.StringIO()
+    server.serve_stdio(server.worker(), io.StringIO(''.join(json.dumps(i) + '\n' for i in jobs)), stdout)
+    return [json.loads(i) for i in stdout.getvalue().splitlines()]
+
+def test_ping_stats_unknown():
+    ping, stats, unknown = run({'id': 1, 'type': 'ping'}, {'id': 2, 'type': 'stats'}, {'id': 3, 'type': 'banana'})
+    assert ping['ok'] is True and ping['id'] == 1 and ping['result'] == 'pong'
+    assert stats['ok'] is True and stats['result']['jobs'] == 1
+    assert unknown['ok'] is False and unknown['id'] == 3 and 'banana' in unknown['error']
+
+def test_beatswap(audio):
+    first, second = run(*[{'type': 'beatswap', 'audio': audio, 'pattern': '1, 3, 2, 4', 'lib': 'stunlocked'}] * 2)
+    assert first['ok'] is True, first['error']
+    assert first['result'] == second['result']
+    wav = base64.b64decode(first['result']['wav'])
+    assert wav[:4] == b'RIFF' and first['result']['length'] > 0
+
+def test_deadline(audio):
+    response, = run({'type': 'beatswap', 'audio': audio, 'pattern': '1, 3, 2, 4', 'lib': 'stunlocked', 'deadline': 0})
+    assert response['ok'] is False and response['error'].startswith('Cancelled')
+    assert response['cancelled']['reason'] == 'deadline'
+
+def test_osu_without_madmom_beatmap(audio, tmp_path):
+    response, = run({'type': 'osu', 'audio': audio, 'lib': 'stunlocked', 'output': str(tmp_path) + '/'})
+    assert response['ok'] is True, response['error']
+    assert response['result']['output'].endswith('.osz')
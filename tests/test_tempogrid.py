@@ -0,0 +1,30 @@
+import numpy as np
+import pytest
+from beat_manipulator import beatmap, tempogrid
+from benchmarks import synth
+
+@pytest.fixture(scope = 'module')
+def fitted():
+    array = np.cumsum(np.random.default_rng(0).normal(22050, 200, 115)).astype(int)
+    return array, tempogrid.fit(array)
+
+@pytest.mark.parametrize('shift', [0, 1, 1.5, 0.5, -0.5, -1, -2.25])
+@pytest.mark.parametrize('scale', [1, 0.5, 1/3, 0.75, 2, 2.5, 3])
+def test_same_beats_as_array(fitted, shift, scale):
+    array, grid = fitted
+    expected = beatmap.scale(beatmap.shift(array, shift, log = False), scale, log = False)
+    result = beatmap.scale(beatmap.shift(grid, shift), scale)
+    assert len(result) == len(expected) == len(result.array())
+    # positions are a fraction of a beat off, except before the first beat with negative shift
+    start = int(np.ceil(-shift / scale)) + 1 if shift < 0 else 0
+    assert np.all(np.abs(result.array() - expected)[start:] <= 22050)
+
+def test_derived_from_changed_grid():
+    song = synth.song(5, 120, 44100, 'drums', 0)
+    song.log = False
+    song.beatmap = tempogrid.fit(song.beatmap)
+    first = song.beatmap_derived(0.5)
+    assert song.beatmap_derived(0.5) is first
+    song.beatmap.residuals += 100
+    second = song.beatmap_derived(0.5)
+    assert second is not first and np.array_equal(second, first + 100)